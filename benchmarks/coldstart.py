@@ -0,0 +1,172 @@
+"""量測 Cloud Function 的 cold start：載入模組與第一個 webhook 的時間
+
+    python -m benchmarks.coldstart --runs 5 --rows 1000
+    python -m benchmarks.coldstart --output benchmarks/results-coldstart.json --compare old.json
+    python -m benchmarks.coldstart --env PREWARM_CLIENTS=true
+
+每一輪都啟動新的 python process（python -X importtime），
+依序量測 import linebot_app.linebot_app_gcp、第一個與第二個 webhook 的時間，
+Sheets 與 LINE API 由 fake_server 回應。輸出各項的中位數，
+以及 import 與第一個 webhook 期間累計時間最長的模組。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MARKER = "--- coldstart phase ---"
+
+# 在子 process 中執行，結果以一行 JSON 印到 stdout
+CHILD = f"""
+import json, sys, time
+started = time.perf_counter()
+from linebot_app.linebot_app_gcp import linebot, registry
+imported = time.perf_counter()
+print({MARKER!r}, file=sys.stderr, flush=True)
+
+
+class Request:
+    args = {{}}
+
+    def __init__(self, text, i):
+        event = {{
+            "type": "message", "replyToken": f"cold-{{i}}", "webhookEventId": f"cold-event-{{i}}",
+            "source": {{"type": "user", "userId": "U-cold"}},
+            "message": {{"type": "text", "id": str(i), "text": text}},
+        }}
+        self.body = json.dumps({{"events": [event]}}, ensure_ascii=False).encode("utf-8")
+        self.headers = {{"X-Line-Signature": registry.parser.signature_for(self.body)}}
+
+    def get_data(self):
+        return self.body
+
+
+timings = {{"import_ms": (imported - started) * 1000}}
+for i, key in enumerate(("first_request_ms", "second_request_ms")):
+    request = Request(sys.argv[1], i)
+    start = time.perf_counter()
+    linebot(request)
+    timings[key] = (time.perf_counter() - start) * 1000
+    if i == 0:
+        print({MARKER!r}, file=sys.stderr, flush=True)
+print(json.dumps(timings))
+"""
+
+METRICS = ("import_ms", "first_request_ms", "second_request_ms")
+
+
+def parse_importtime(text, top=10):
+    """解析 -X importtime 的輸出，回傳各階段累計時間最長的頂層模組
+
+    回傳 [[{"module", "cumulative_ms"}, ...], ...]，依 MARKER 分成多個階段。
+    """
+    phases = [[]]
+    for line in text.splitlines():
+        if line.strip() == MARKER:
+            phases.append([])
+            continue
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 巢狀的 import 以空白縮排，只保留被直接載入的模組
+        if name.startswith("   "):
+            continue
+        phases[-1].append({"module": name.strip(), "cumulative_ms": round(int(cumulative) / 1000, 2)})
+    return [sorted(phase, key=lambda m: -m["cumulative_ms"])[:top] for phase in phases]
+
+
+def run_once(env, message):
+    """在新的 process 中執行一輪，回傳 (各項時間, importtime 輸出)"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD, message],
+        env=env, capture_output=True, text=True, timeout=120,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"cold start 子 process 失敗：\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def run_coldstart(runs=5, rows=1000, latency_ms=0.0, message="sum 小美", env=None, top=10):
+    """執行 runs 輪 cold start，回傳結果 dict"""
+    from benchmarks.fake_server import FakeApiServer
+    from benchmarks.fake_sheets import make_rows
+
+    server = FakeApiServer(latency=latency_ms / 1000).start()
+    try:
+        child_env = dict(os.environ)
+        child_env.update({
+            "GOOGLE_API_ENDPOINT": server.url,
+            "LINE_API_ENDPOINT": server.url,
+            "LINE_DATA_ENDPOINT": server.url,
+            "LINE_CHANNEL_SECRET": "coldstart-secret",
+            "LINE_CHANNEL_ACCESS_TOKEN": "coldstart-token",
+        })
+        child_env.update(env or {})
+        spreadsheet = child_env.setdefault("GSPREADSHEET", "linebot_expense")
+        worksheet = child_env.setdefault("GWORKSHEET", "expense")
+        server.add_spreadsheet(spreadsheet, {worksheet: make_rows(rows)})
+
+        samples = []
+        for _ in range(runs):
+            samples.append(run_once(child_env, message))
+    finally:
+        server.stop()
+
+    median = {key: round(statistics.median(s[key] for s, _ in samples), 2) for key in METRICS}
+    # 以 import 時間最接近中位數的一輪列出耗時模組
+    _, stderr = min(samples, key=lambda s: abs(s[0]["import_ms"] - median["import_ms"]))
+    phases = parse_importtime(stderr, top)
+    return {
+        "runs": runs,
+        "rows": rows,
+        "latency_ms": latency_ms,
+        "message": message,
+        "env": env or {},
+        "median": median,
+        "top_imports": {"import": phases[0], "first_request": phases[1] if len(phases) > 1 else []},
+    }
+
+
+def compare(old, new, tolerance=0.2):
+    """回傳比舊結果慢超過 (1 + tolerance) 倍的項目說明"""
+    regressions = []
+    for key in METRICS:
+        before, after = old["median"].get(key), new["median"].get(key)
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{key}: {before} -> {after} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cloud Function cold start 量測")
+    parser.add_argument("--runs", type=int, default=5, help="啟動 process 的次數")
+    parser.add_argument("--rows", type=int, default=1000, help="帳本筆數")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="替身伺服器每個請求的延遲")
+    parser.add_argument("--message", default="sum 小美", help="webhook 送出的訊息")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE，覆寫 Config 設定")
+    parser.add_argument("--top", type=int, default=10, help="列出幾個最耗時的模組")
+    parser.add_argument("--output", help="結果 JSON 路徑")
+    parser.add_argument("--compare", help="與舊的結果 JSON 比較")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的退步比例")
+    args = parser.parse_args(argv)
+
+    env = dict(item.partition("=")[::2] for item in args.env)
+    report = run_coldstart(args.runs, args.rows, args.latency_ms, args.message, env, args.top)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for line in regressions:
+            print("退步", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
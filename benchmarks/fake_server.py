@@ -0,0 +1,705 @@
+"""本機的 Sheets v4 / Drive v3 / LINE reply、content 替身伺服器
+
+    python -m benchmarks.fake_server --port 8081 --rows 10000 --latency-ms 50 --quota-per-minute 300
+
+啟動後以下列設定讓 linebot_app 改連到這台伺服器，不需要網路與憑證：
+
+    GOOGLE_API_ENDPOINT=http://127.0.0.1:8081
+    LINE_API_ENDPOINT=http://127.0.0.1:8081
+    LINE_DATA_ENDPOINT=http://127.0.0.1:8081
+
+只實作 pygsheets 與 LineBotApi 會用到的端點，資料都放在記憶體中。
+GET /_fake/stats 回傳各端點的請求數與 429 次數，GET /_fake/replies 回傳收到的回覆訊息。
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from benchmarks.fake_sheets import make_rows
+
+SHEETS_EPOCH = datetime(1899, 12, 30)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_CELL = re.compile(r"^([A-Z]*)(\d*)$")
+_SUM = re.compile(r"^=SUM\(([A-Z]+)(\d*):([A-Z]+)(\d*)\)$", re.IGNORECASE)
+
+
+class FakeApiError(Exception):
+    def __init__(self, status, message, reason="FAILED_PRECONDITION"):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+def _col_index(letters):
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - ord("A") + 1
+    return col - 1
+
+
+def _col_letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class FakeSheet:
+    """一張工作表，cells 為 list of list，值是使用者輸入的原始值"""
+
+    def __init__(self, sheet_id, title, index, rows=None, row_count=1000, col_count=26):
+        self.id = sheet_id
+        self.title = title
+        self.index = index
+        self.cells = [list(row) for row in rows or []]
+        self.row_count = max(row_count, len(self.cells))
+        self.col_count = max(col_count, max((len(r) for r in self.cells), default=0))
+
+    def properties(self):
+        return {
+            "sheetId": self.id,
+            "title": self.title,
+            "index": self.index,
+            "sheetType": "GRID",
+            "gridProperties": {"rowCount": self.row_count, "columnCount": self.col_count},
+        }
+
+    def raw(self, r, c):
+        if r < len(self.cells) and c < len(self.cells[r]):
+            return self.cells[r][c]
+        return None
+
+    def evaluate(self, value):
+        """計算 =SUM(E2:E) 這類公式，其餘公式回傳 #NAME?"""
+        if not (isinstance(value, str) and value.startswith("=")):
+            return value
+        match = _SUM.match(value)
+        if not match:
+            return "#NAME?"
+        c0, c1 = _col_index(match.group(1).upper()), _col_index(match.group(3).upper())
+        r0 = int(match.group(2)) - 1 if match.group(2) else 0
+        r1 = int(match.group(4)) if match.group(4) else len(self.cells)
+        total = 0
+        for r in range(r0, min(r1, len(self.cells))):
+            for c in range(c0, c1 + 1):
+                number = _to_number(self.raw(r, c))
+                if number is not None:
+                    total += number
+        return total
+
+    def render(self, value, option):
+        if value is None:
+            return ""
+        if option == "FORMULA":
+            return value
+        value = self.evaluate(value)
+        if option == "UNFORMATTED_VALUE":
+            return value
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, (int, float)):
+            return _format_number(value)
+        return value
+
+    def read(self, r0, c0, r1, c1, option="FORMATTED_VALUE", columns=False):
+        r1 = min(len(self.cells), self.row_count if r1 is None else r1)
+        c1 = self.col_count if c1 is None else c1
+        rows = []
+        for r in range(r0, r1):
+            row = [self.render(self.raw(r, c), option) for c in range(c0, c1)]
+            while row and row[-1] == "":
+                row.pop()
+            rows.append(row)
+        while rows and not rows[-1]:
+            rows.pop()
+        if columns:
+            width = max((len(r) for r in rows), default=0)
+            rows = [[row[c] if c < len(row) else "" for row in rows] for c in range(width)]
+            for col in rows:
+                while col and col[-1] == "":
+                    col.pop()
+        return rows
+
+    def write(self, r0, c0, values, columns=False):
+        if columns:
+            width = max((len(col) for col in values), default=0)
+            values = [[col[r] if r < len(col) else None for col in values] for r in range(width)]
+        for offset, row in enumerate(values):
+            r = r0 + offset
+            while len(self.cells) <= r:
+                self.cells.append([])
+            target = self.cells[r]
+            end = c0 + len(row)
+            if len(target) < end:
+                target.extend([None] * (end - len(target)))
+            target[c0:end] = row
+        self.row_count = max(self.row_count, r0 + len(values))
+        self.col_count = max(self.col_count, c0 + max((len(row) for row in values), default=0))
+
+    def clear(self, r0, c0, r1, c1):
+        for r in range(r0, min(len(self.cells), self.row_count if r1 is None else r1)):
+            row = self.cells[r]
+            for c in range(c0, min(len(row), self.col_count if c1 is None else c1)):
+                row[c] = None
+
+    def last_row(self, c0, c1):
+        """range 內最後一列有資料的列（0-based），沒有則回傳 -1"""
+        for r in range(len(self.cells) - 1, -1, -1):
+            row = self.cells[r]
+            if any(v not in (None, "") for v in row[c0:c1]):
+                return r
+        return -1
+
+    def delete_rows(self, start, end):
+        del self.cells[start:end]
+        self.row_count = max(1, self.row_count - (end - start))
+
+    def insert_rows(self, start, count):
+        if start < len(self.cells):
+            self.cells[start:start] = [[] for _ in range(count)]
+        self.row_count += count
+
+
+class FakeSpreadsheet:
+    def __init__(self, spreadsheet_id, title):
+        self.id = spreadsheet_id
+        self.title = title
+        self.sheets = []
+        self._next_sheet_id = 0
+
+    def add_sheet(self, title, rows=None, row_count=1000, col_count=26):
+        if self.by_title(title) is not None:
+            raise FakeApiError(400, f'A sheet with the name "{title}" already exists.', "INVALID_ARGUMENT")
+        sheet = FakeSheet(self._next_sheet_id, title, len(self.sheets), rows, row_count, col_count)
+        self._next_sheet_id += 1
+        self.sheets.append(sheet)
+        return sheet
+
+    def by_title(self, title):
+        return next((s for s in self.sheets if s.title == title), None)
+
+    def by_id(self, sheet_id):
+        sheet = next((s for s in self.sheets if s.id == sheet_id), None)
+        if sheet is None:
+            raise FakeApiError(400, f"No grid with id: {sheet_id}", "INVALID_ARGUMENT")
+        return sheet
+
+    def resource(self):
+        return {
+            "spreadsheetId": self.id,
+            "properties": {
+                "title": self.title,
+                "locale": "zh_TW",
+                "timeZone": "Asia/Taipei",
+                "defaultFormat": {},
+            },
+            "sheets": [{"properties": s.properties()} for s in self.sheets],
+            "namedRanges": [],
+            "spreadsheetUrl": f"https://docs.google.com/spreadsheets/d/{self.id}/edit",
+        }
+
+    def parse_range(self, a1):
+        """把 A1 表示法轉成 (sheet, r0, c0, r1, c1)，結束位置不含且 None 表示不限"""
+        a1 = unquote(a1)
+        if "!" in a1:
+            title, cells = a1.rsplit("!", 1)
+        elif self.by_title(a1.strip("'")) is not None:
+            title, cells = a1, ""
+        else:
+            title, cells = None, a1
+        if title is None:
+            sheet = self.sheets[0]
+        else:
+            if title.startswith("'") and title.endswith("'"):
+                title = title[1:-1].replace("''", "'")
+            sheet = self.by_title(title)
+            if sheet is None:
+                raise FakeApiError(400, f"Unable to parse range: {a1}", "INVALID_ARGUMENT")
+        if not cells:
+            return sheet, 0, 0, None, None
+        start, _, end = cells.partition(":")
+        m0, m1 = _CELL.match(start), _CELL.match(end or start)
+        if not m0 or not m1:
+            raise FakeApiError(400, f"Unable to parse range: {a1}", "INVALID_ARGUMENT")
+        r0 = int(m0.group(2)) - 1 if m0.group(2) else 0
+        c0 = _col_index(m0.group(1)) if m0.group(1) else 0
+        r1 = int(m1.group(2)) if m1.group(2) else None
+        c1 = _col_index(m1.group(1)) + 1 if m1.group(1) else None
+        return sheet, r0, c0, r1, c1
+
+    def a1(self, sheet, r0, c0, r1, c1):
+        # 與 Sheets API 相同，只有名稱含特殊字元時才加引號
+        title = sheet.title
+        if not re.fullmatch(r"\w+", title):
+            title = "'" + title.replace("'", "''") + "'"
+        end_row = r1 if r1 is not None else sheet.row_count
+        end_col = c1 if c1 is not None else sheet.col_count
+        return f"{title}!{_col_letters(c0)}{r0 + 1}:{_col_letters(end_col - 1)}{end_row}"
+
+
+def _cell_value(cell):
+    """CellData 的 userEnteredValue 轉成儲存的原始值，日期格式的序號還原成字串"""
+    entered = (cell or {}).get("userEnteredValue")
+    if not entered:
+        return None
+    if "formulaValue" in entered:
+        return entered["formulaValue"]
+    if "numberValue" in entered:
+        number = entered["numberValue"]
+        fmt = ((cell.get("userEnteredFormat") or {}).get("numberFormat") or {})
+        if fmt.get("type") in ("DATE_TIME", "DATE"):
+            return (SHEETS_EPOCH + timedelta(days=number)).strftime(TIMESTAMP_FORMAT)
+        return number
+    if "boolValue" in entered:
+        return entered["boolValue"]
+    return entered.get("stringValue")
+
+
+def _user_entered(value):
+    """USER_ENTERED 模式下把數字字串存成數字"""
+    if isinstance(value, str) and not value.startswith("="):
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+        return int(number) if number.is_integer() and "." not in value else number
+    return value
+
+
+class FakeApiServer:
+    """Sheets v4、Drive v3 與 LINE reply API 的記憶體替身
+
+    latency：每個請求的延遲秒數
+    quota_per_minute：Sheets / Drive 每 60 秒可處理的請求數，超過回傳 429
+    error_rate：Sheets / Drive 請求隨機回傳 429 的機率
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, quota_per_minute=None, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self.spreadsheets = {}
+        self.replies = []
+        # 使用者上傳的檔案內容：{message id: bytes}
+        self.contents = {}
+        self.stats = Counter()
+        self._recent = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_spreadsheet(self, title, worksheets):
+        """worksheets 為 {工作表名稱: 列} 的 dict"""
+        with self._lock:
+            spreadsheet = FakeSpreadsheet(f"fake-{len(self.spreadsheets) + 1}", title)
+            for sheet_title, rows in worksheets.items():
+                spreadsheet.add_sheet(sheet_title, rows, row_count=max(1000, len(rows)), col_count=26)
+            self.spreadsheets[spreadsheet.id] = spreadsheet
+            return spreadsheet
+
+    def add_content(self, message_id, data):
+        """登錄 GET /v2/bot/message/{id}/content 回傳的檔案內容"""
+        with self._lock:
+            self.contents[str(message_id)] = data
+
+    def reset(self):
+        with self._lock:
+            self.replies.clear()
+            self.stats.clear()
+            self._recent.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _check_quota(self):
+        """超過每分鐘配額或隨機錯誤時拋出 429"""
+        with self._lock:
+            now = time.monotonic()
+            if self.error_rate and self._random.random() < self.error_rate:
+                raise FakeApiError(429, "Quota exceeded (injected)", "RESOURCE_EXHAUSTED")
+            if self.quota_per_minute:
+                while self._recent and now - self._recent[0] >= 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.quota_per_minute:
+                    raise FakeApiError(429, "Quota exceeded for quota metric 'Read requests'", "RESOURCE_EXHAUSTED")
+                self._recent.append(now)
+
+    def _spreadsheet(self, spreadsheet_id):
+        spreadsheet = self.spreadsheets.get(spreadsheet_id)
+        if spreadsheet is None:
+            raise FakeApiError(404, "Requested entity was not found.", "NOT_FOUND")
+        return spreadsheet
+
+    # ---- 路由 ----
+
+    def handle(self, method, path, query, body):
+        """回傳 (status, JSON 物件或 bytes)"""
+        if path.startswith("/_fake/"):
+            return self._control(method, path)
+        if path.startswith("/v2/bot/"):
+            return self._line(method, path, body)
+        self._check_quota()
+        with self._lock:
+            if path.startswith("/drive/v3/files"):
+                return 200, self._drive_files(query)
+            match = re.match(r"^/v4/spreadsheets/([^/:]+)(.*)$", path)
+            if not match:
+                raise FakeApiError(404, f"Unknown path {path}", "NOT_FOUND")
+            spreadsheet = self._spreadsheet(match.group(1))
+            return 200, self._sheets(spreadsheet, method, match.group(2), query, body)
+
+    def _control(self, method, path):
+        if path == "/_fake/stats":
+            with self._lock:
+                return 200, dict(self.stats)
+        if path == "/_fake/replies":
+            with self._lock:
+                return 200, list(self.replies)
+        if path == "/_fake/reset" and method == "POST":
+            self.reset()
+            return 200, {}
+        raise FakeApiError(404, f"Unknown path {path}", "NOT_FOUND")
+
+    def _line(self, method, path, body):
+        if method == "POST" and path == "/v2/bot/message/reply":
+            with self._lock:
+                self.replies.append({"replyToken": body.get("replyToken"), "messages": body.get("messages", [])})
+            return 200, {"sentMessages": [{"id": str(len(self.replies))} for _ in body.get("messages", [])]}
+        match = re.match(r"^/v2/bot/message/([^/]+)/content$", path)
+        if method == "GET" and match:
+            with self._lock:
+                data = self.contents.get(match.group(1))
+            if data is None:
+                raise FakeApiError(404, "Not found", "NOT_FOUND")
+            return 200, data
+        raise FakeApiError(404, f"Unknown path {path}", "NOT_FOUND")
+
+    def _drive_files(self, query):
+        q = query.get("q", [""])[0]
+        match = re.search(r"name\s*=\s*'((?:[^'\\]|\\.)*)'", q)
+        name = match.group(1).replace("\\'", "'") if match else None
+        files = [
+            {"id": s.id, "name": s.title, "parents": []}
+            for s in self.spreadsheets.values()
+            if name is None or s.title == name
+        ]
+        return {"files": files}
+
+    def _sheets(self, spreadsheet, method, rest, query, body):
+        option = query.get("valueRenderOption", ["FORMATTED_VALUE"])[0]
+        columns = query.get("majorDimension", ["ROWS"])[0] == "COLUMNS"
+        input_option = query.get("valueInputOption", [body.get("valueInputOption", "RAW")])[0]
+
+        if method == "GET" and rest == "":
+            return spreadsheet.resource()
+        if method == "POST" and rest == ":batchUpdate":
+            return self._batch_update(spreadsheet, body)
+        if method == "GET" and rest == "/values:batchGet":
+            ranges = query.get("ranges", [])
+            return {
+                "spreadsheetId": spreadsheet.id,
+                "valueRanges": [self._values_get(spreadsheet, r, option, columns) for r in ranges],
+            }
+        if method == "POST" and rest == "/values:batchUpdate":
+            responses = [
+                self._values_update(spreadsheet, d["range"], d, body.get("valueInputOption", "RAW"))
+                for d in body.get("data", [])
+            ]
+            return {"spreadsheetId": spreadsheet.id, "responses": responses}
+        if method == "POST" and rest == "/values:batchClear":
+            for a1 in body.get("ranges", []):
+                sheet, r0, c0, r1, c1 = spreadsheet.parse_range(a1)
+                sheet.clear(r0, c0, r1, c1)
+            return {"spreadsheetId": spreadsheet.id, "clearedRanges": body.get("ranges", [])}
+        if rest.startswith("/values/"):
+            a1, _, action = rest[len("/values/"):].partition(":")
+            if method == "GET" and not action:
+                return self._values_get(spreadsheet, a1, option, columns)
+            if method == "PUT" and not action:
+                return self._values_update(spreadsheet, a1, body, input_option)
+            if method == "POST" and action == "append":
+                return self._values_append(spreadsheet, a1, body, input_option, query)
+            if method == "POST" and action == "clear":
+                sheet, r0, c0, r1, c1 = spreadsheet.parse_range(a1)
+                sheet.clear(r0, c0, r1, c1)
+                return {"spreadsheetId": spreadsheet.id, "clearedRange": unquote(a1)}
+        raise FakeApiError(404, f"Unknown method {method} {rest}", "NOT_FOUND")
+
+    def _values_get(self, spreadsheet, a1, option, columns):
+        sheet, r0, c0, r1, c1 = spreadsheet.parse_range(a1)
+        result = {
+            "range": spreadsheet.a1(sheet, r0, c0, r1, c1),
+            "majorDimension": "COLUMNS" if columns else "ROWS",
+        }
+        values = sheet.read(r0, c0, r1, c1, option, columns)
+        if values:
+            result["values"] = values
+        return result
+
+    def _values_update(self, spreadsheet, a1, body, input_option):
+        sheet, r0, c0, _, _ = spreadsheet.parse_range(a1)
+        values = body.get("values", [])
+        if input_option == "USER_ENTERED":
+            values = [[_user_entered(v) for v in row] for row in values]
+        sheet.write(r0, c0, values, body.get("majorDimension") == "COLUMNS")
+        return {
+            "spreadsheetId": spreadsheet.id,
+            "updatedRange": unquote(a1),
+            "updatedRows": len(values),
+            "updatedColumns": max((len(row) for row in values), default=0),
+            "updatedCells": sum(len(row) for row in values),
+        }
+
+    def _values_append(self, spreadsheet, a1, body, input_option, query):
+        sheet, r0, c0, _, c1 = spreadsheet.parse_range(a1)
+        values = body.get("values", [])
+        if input_option == "USER_ENTERED":
+            values = [[_user_entered(v) for v in row] for row in values]
+        width = c1 if c1 is not None else sheet.col_count
+        start = max(r0, sheet.last_row(c0, width) + 1)
+        if query.get("insertDataOption", ["OVERWRITE"])[0] == "INSERT_ROWS":
+            sheet.insert_rows(start, len(values))
+        sheet.write(start, c0, values)
+        end = start + len(values)
+        return {
+            "spreadsheetId": spreadsheet.id,
+            "tableRange": spreadsheet.a1(sheet, r0, c0, start, width),
+            "updates": {
+                "spreadsheetId": spreadsheet.id,
+                "updatedRange": spreadsheet.a1(sheet, start, c0, end, c0 + max((len(r) for r in values), default=1)),
+                "updatedRows": len(values),
+                "updatedColumns": max((len(row) for row in values), default=0),
+                "updatedCells": sum(len(row) for row in values),
+            },
+        }
+
+    def _batch_update(self, spreadsheet, body):
+        replies = [self._apply_request(spreadsheet, request) for request in body.get("requests", [])]
+        response = {"spreadsheetId": spreadsheet.id, "replies": replies}
+        if body.get("includeSpreadsheetInResponse"):
+            updated = spreadsheet.resource()
+            if body.get("responseIncludeGridData"):
+                for a1 in body.get("responseRanges", []):
+                    sheet, r0, c0, r1, c1 = spreadsheet.parse_range(a1)
+                    r1 = r0 + 1 if r1 is None else r1
+                    c1 = c0 + 1 if c1 is None else c1
+                    row_data = []
+                    for r in range(r0, r1):
+                        values = []
+                        for c in range(c0, c1):
+                            value = sheet.evaluate(sheet.raw(r, c))
+                            cell = {}
+                            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                                cell["effectiveValue"] = {"numberValue": value}
+                            elif value not in (None, ""):
+                                cell["effectiveValue"] = {"stringValue": str(value)}
+                            values.append(cell)
+                        row_data.append({"values": values})
+                    for entry in updated["sheets"]:
+                        if entry["properties"]["sheetId"] == sheet.id:
+                            entry["data"] = [{"startRow": r0, "startColumn": c0, "rowData": row_data}]
+            response["updatedSpreadsheet"] = updated
+        return response
+
+    def _apply_request(self, spreadsheet, request):
+        (kind, params), = request.items()
+        if kind == "addSheet":
+            props = params.get("properties", {})
+            grid = props.get("gridProperties", {})
+            sheet = spreadsheet.add_sheet(
+                props.get("title") or f"工作表{len(spreadsheet.sheets) + 1}",
+                row_count=grid.get("rowCount", 1000), col_count=grid.get("columnCount", 26),
+            )
+            return {"addSheet": {"properties": sheet.properties()}}
+        if kind == "duplicateSheet":
+            source = spreadsheet.by_id(params["sourceSheetId"])
+            sheet = spreadsheet.add_sheet(
+                params.get("newSheetName") or f"{source.title} 的副本",
+                rows=source.cells, row_count=source.row_count, col_count=source.col_count,
+            )
+            return {"duplicateSheet": {"properties": sheet.properties()}}
+        if kind == "copyPaste":
+            src, dst = params["source"], params["destination"]
+            source = spreadsheet.by_id(src.get("sheetId", 0))
+            target = spreadsheet.by_id(dst.get("sheetId", 0))
+            r0, c0 = src.get("startRowIndex", 0), src.get("startColumnIndex", 0)
+            r1 = min(len(source.cells), src.get("endRowIndex", source.row_count))
+            c1 = src.get("endColumnIndex", source.col_count)
+            rows = [[source.raw(r, c) for c in range(c0, c1)] for r in range(r0, r1)]
+            for row in rows:
+                while row and row[-1] is None:
+                    row.pop()
+            target.write(dst.get("startRowIndex", 0), dst.get("startColumnIndex", 0), rows)
+            return {}
+        if kind == "deleteSheet":
+            sheet = spreadsheet.by_id(params["sheetId"])
+            spreadsheet.sheets.remove(sheet)
+            return {}
+        if kind == "updateSheetProperties":
+            props = params.get("properties", {})
+            sheet = spreadsheet.by_id(props.get("sheetId", 0))
+            if "title" in props:
+                sheet.title = props["title"]
+            grid = props.get("gridProperties", {})
+            sheet.row_count = grid.get("rowCount", sheet.row_count)
+            sheet.col_count = grid.get("columnCount", sheet.col_count)
+            return {}
+        if kind in ("deleteDimension", "insertDimension", "appendDimension"):
+            rng = params.get("range", params)
+            sheet = spreadsheet.by_id(rng.get("sheetId", 0))
+            if rng.get("dimension") != "ROWS":
+                raise FakeApiError(400, f"{kind} only supports ROWS", "INVALID_ARGUMENT")
+            if kind == "deleteDimension":
+                sheet.delete_rows(rng["startIndex"], rng["endIndex"])
+            elif kind == "insertDimension":
+                sheet.insert_rows(rng["startIndex"], rng["endIndex"] - rng["startIndex"])
+            else:
+                sheet.row_count += params.get("length", 0)
+            return {}
+        if kind == "appendCells":
+            sheet = spreadsheet.by_id(params.get("sheetId", 0))
+            rows = [[_cell_value(c) for c in row.get("values", [])] for row in params.get("rows", [])]
+            sheet.write(sheet.last_row(0, sheet.col_count) + 1, 0, rows)
+            return {}
+        if kind in ("updateCells", "repeatCell"):
+            if "start" in params:
+                start = params["start"]
+                sheet = spreadsheet.by_id(start.get("sheetId", 0))
+                r0, c0 = start.get("rowIndex", 0), start.get("columnIndex", 0)
+                r1 = c1 = None
+            else:
+                rng = params.get("range", {})
+                sheet = spreadsheet.by_id(rng.get("sheetId", 0))
+                r0, c0 = rng.get("startRowIndex", 0), rng.get("startColumnIndex", 0)
+                r1, c1 = rng.get("endRowIndex"), rng.get("endColumnIndex")
+            if kind == "repeatCell" or not params.get("rows"):
+                # 沒有 rows 表示清除 range 內的值（Worksheet.clear）
+                sheet.clear(r0, c0, r1, c1)
+            else:
+                rows = [[_cell_value(c) for c in row.get("values", [])] for row in params["rows"]]
+                sheet.write(r0, c0, rows)
+            return {}
+        raise FakeApiError(400, f"Unsupported request {kind}", "INVALID_ARGUMENT")
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+                path = re.sub(r"/spreadsheets/[^/:]+", "/spreadsheets/{id}", url.path)
+                path = re.sub(r"/message/[^/]+/content", "/message/{id}/content", path)
+                key = f"{self.command} {re.sub(r'/values/[^:]+', '/values/{range}', path)}"
+                if server.latency and not url.path.startswith("/_fake/"):
+                    time.sleep(server.latency)
+                try:
+                    status, payload = server.handle(self.command, url.path, parse_qs(url.query), body)
+                except FakeApiError as ex:
+                    status = ex.status
+                    payload = {"error": {"code": ex.status, "message": str(ex), "status": ex.reason}}
+                with server._lock:
+                    server.stats[key] += 1
+                    if status == 429:
+                        server.stats["429"] += 1
+                if isinstance(payload, bytes):
+                    data, content_type = payload, "application/octet-stream"
+                else:
+                    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=UTF-8"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本機 Sheets / LINE API 替身伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--spreadsheet", default="linebot_expense", help="試算表名稱（GSPREADSHEET）")
+    parser.add_argument("--worksheet", default="expense", help="工作表名稱（GWORKSHEET）")
+    parser.add_argument("--rows", type=int, default=1000, help="預先產生的帳本筆數")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每個請求的延遲")
+    parser.add_argument("--quota-per-minute", type=int, help="Sheets 每分鐘請求上限，超過回傳 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="隨機回傳 429 的機率")
+    args = parser.parse_args(argv)
+
+    server = FakeApiServer(
+        args.host, args.port, args.latency_ms / 1000, args.quota_per_minute, args.error_rate
+    )
+    server.add_spreadsheet(args.spreadsheet, {args.worksheet: make_rows(args.rows)})
+    print(f"fake API server: {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pygsheets
+
+from linebot_app.store import HEADER, format_total
+from linebot_app.totals import SHEETS_EPOCH, TIMESTAMP_FORMAT
+
+NAMES = ["小美", "小華", "小明", "阿強", "小芳"]
+TYPES = ["餐飲", "交通", "日用", "娛樂", "醫療", "其他"]
+ITEMS = ["午餐", "晚餐", "捷運", "衛生紙", "電影", "掛號"]
+
+_ADDR = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+def make_rows(count, seed=0):
+    """產生含標題列（G1 為總和）的假帳本"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    rows = []
+    total = 0
+    for i in range(count):
+        amount = rng.randint(10, 2000)
+        total += amount
+        ts = start + timedelta(minutes=7 * i)
+        rows.append([
+            ts.strftime("%Y-%m-%d %H:%M:%S"),
+            rng.choice(NAMES),
+            rng.choice(ITEMS),
+            rng.choice(TYPES),
+            str(amount),
+        ])
+    return [HEADER + [str(total)]] + rows
+
+
+def _parse_addr(addr):
+    """把 "A1" 轉成 0-based (row, col)"""
+    match = _ADDR.match(addr)
+    if not match:
+        raise ValueError(f"不支援的儲存格位址: {addr}")
+    col = 0
+    for ch in match.group(1):
+        col = col * 26 + ord(ch) - ord("A") + 1
+    return int(match.group(2)) - 1, col - 1
+
+
+def _col_letters(col):
+    """0-based 欄索引轉成欄名（0 -> A、26 -> AA）"""
+    letters = ""
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def _trim(row):
+    end = len(row)
+    while end and row[end - 1] == "":
+        end -= 1
+    return row[:end]
+
+
+class FakeCell:
+    def __init__(self, value):
+        self.value = value
+
+
+def _cell_text(cell):
+    value = cell.get("userEnteredValue", {})
+    if "numberValue" in value:
+        # 日期格式的序號還原成時間字串，與試算表顯示的值相同
+        fmt = cell.get("userEnteredFormat", {}).get("numberFormat", {})
+        if fmt.get("type") in ("DATE_TIME", "DATE"):
+            return (SHEETS_EPOCH + timedelta(days=value["numberValue"])).strftime(TIMESTAMP_FORMAT)
+        return format_total(value["numberValue"])
+    return str(value.get("stringValue", value.get("formulaValue", "")))
+
+
+class FakeSheetsService:
+    """pygsheets client.sheet 的替身，只實作 SheetsLedgerStore 用到的 batchUpdate 請求"""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def get(self, spreadsheet_id, fields=None):
+        self.spreadsheet._call("get")
+        return {"sheets": [{"properties": wks.properties()} for wks in self.spreadsheet._worksheets.values()]}
+
+    def batch_update(self, spreadsheet_id, requests, **kwargs):
+        self.spreadsheet._call("batch_update")
+        for request in requests:
+            (kind, params), = request.items()
+            getattr(self, f"_{kind}")(params)
+        return {"replies": []}
+
+    def _by_id(self, sheet_id):
+        return next(wks for wks in self.spreadsheet._worksheets.values() if wks.id == sheet_id)
+
+    def _duplicateSheet(self, params):
+        source = self._by_id(params["sourceSheetId"])
+        # 內層 list 不會被原地修改，複製外層即可
+        self.spreadsheet._add(params["newSheetName"], source.rows)
+
+    def _deleteSheet(self, params):
+        del self.spreadsheet._worksheets[self._by_id(params["sheetId"]).title]
+
+    def _updateSheetProperties(self, params):
+        pass
+
+    def _deleteDimension(self, params):
+        rng = params["range"]
+        wks = self._by_id(rng["sheetId"])
+        del wks._rows[rng["startIndex"]:rng["endIndex"]]
+
+    def _updateCells(self, params):
+        if "range" in params:
+            self._by_id(params["range"]["sheetId"])._rows = []
+        else:
+            start = params["start"]
+            rows = [[_cell_text(cell) for cell in row["values"]] for row in params["rows"]]
+            addr = f"{_col_letters(start.get('columnIndex', 0))}{start['rowIndex'] + 1}"
+            self._by_id(start["sheetId"])._write(addr, rows)
+
+    def _copyPaste(self, params):
+        source = self._by_id(params["source"]["sheetId"])
+        self._by_id(params["destination"]["sheetId"])._rows = list(source.rows)
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.sheet = FakeSheetsService(spreadsheet)
+
+
+class FakeSpreadsheet:
+    """記憶體中的試算表，所有工作表共用呼叫次數與延遲設定"""
+
+    def __init__(self, latency=0.0):
+        self.id = "fake-spreadsheet"
+        self.latency = latency
+        self.calls = Counter()
+        self.client = FakeClient(self)
+        self._worksheets = {}
+        self._next_id = 0
+
+    def _add(self, title, values=None):
+        wks = FakeWorksheet(self, title, values, sheet_id=self._next_id)
+        self._next_id += 1
+        self._worksheets[title] = wks
+        return wks
+
+    def _call(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add_worksheet(self, title, rows=100, cols=26, values=None):
+        self._call("add_worksheet")
+        return self._add(title, values)
+
+    def worksheet_by_title(self, title):
+        self._call("worksheet_by_title")
+        try:
+            return self._worksheets[title]
+        except KeyError:
+            raise pygsheets.WorksheetNotFound(title)
+
+
+class FakeWorksheet:
+    """實作 SheetsLedgerStore 用到的 pygsheets Worksheet 方法
+
+    每次呼叫都計入 spreadsheet.calls 並等待 spreadsheet.latency 秒，
+    讀取時回傳新的 list，模擬 API 回應反序列化的成本。
+    內層 list 不會被原地修改，可以與其他工作表共用。
+    """
+
+    def __init__(self, spreadsheet, title, values=None, sheet_id=0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.client = spreadsheet.client
+        self._rows = list(values or [])
+
+    @property
+    def rows(self):
+        return self._rows
+
+    def properties(self):
+        return {
+            "sheetId": self.id,
+            "title": self.title,
+            "gridProperties": {"rowCount": max(1000, len(self._rows)), "columnCount": 26},
+        }
+
+    def get_all_values(self, include_tailing_empty_rows=True, include_tailing_empty=True):
+        self.spreadsheet._call("get_all_values")
+        rows = [list(row) if include_tailing_empty else _trim(row) for row in self._rows]
+        if not include_tailing_empty_rows:
+            while rows and not rows[-1]:
+                rows.pop()
+        return rows
+
+    def get_values(self, start, end, include_tailing_empty=True, include_tailing_empty_rows=True):
+        self.spreadsheet._call("get_values")
+        (r1, c1), (r2, c2) = start, end
+        rows = [row[c1 - 1:c2] for row in self._rows[r1 - 1:r2]]
+        if not include_tailing_empty:
+            rows = [_trim(row) for row in rows]
+        return rows
+
+    def get_values_batch(self, ranges):
+        self.spreadsheet._call("get_values_batch")
+        result = []
+        for crange in ranges:
+            start, end = crange.split(":")
+            (r1, c1), (r2, c2) = _parse_addr(start), _parse_addr(end)
+            rows = [_trim(row[c1:c2 + 1]) for row in self._rows[r1:r2 + 1]]
+            result.append(rows or [[""]])
+        return result
+
+    def get_col(self, col, include_tailing_empty=True):
+        self.spreadsheet._call("get_col")
+        return [row[col - 1] if len(row) >= col else "" for row in self._rows]
+
+    def cell(self, addr):
+        self.spreadsheet._call("cell")
+        r, c = _parse_addr(addr)
+        row = self._rows[r] if r < len(self._rows) else []
+        return FakeCell(row[c] if c < len(row) else "")
+
+    def update_value(self, addr, value):
+        self.spreadsheet._call("update_value")
+        self._write(addr, [[str(value)]])
+
+    def update_values(self, crange, values):
+        self.spreadsheet._call("update_values")
+        self._write(crange, values)
+
+    def _write(self, addr, values):
+        r0, c0 = _parse_addr(addr)
+        while len(self._rows) < r0 + len(values):
+            self._rows.append([])
+        for offset, values_row in enumerate(values):
+            # 換成新的 list，不修改共用的內層 list
+            row = list(self._rows[r0 + offset])
+            row.extend([""] * (c0 + len(values_row) - len(row)))
+            row[c0:c0 + len(values_row)] = [str(v) for v in values_row]
+            self._rows[r0 + offset] = row
+
+    def append_table(self, values):
+        self.spreadsheet._call("append_table")
+        self._rows.extend([str(v) for v in row] for row in values)
+
+    def delete_rows(self, index, number=1):
+        self.spreadsheet._call("delete_rows")
+        del self._rows[index - 1:index - 1 + number]
+
+    def clear(self):
+        self.spreadsheet._call("clear")
+        self._rows = []
+
+
+def fake_worksheet(rows, latency=0.0, title="benchmark"):
+    """建立只有一張工作表的假試算表，並回傳該工作表"""
+    return FakeSpreadsheet(latency)._add(title, rows)
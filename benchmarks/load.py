@@ -0,0 +1,173 @@
+"""以本機替身伺服器對整個 webhook 流程做負載測試
+
+    python -m benchmarks.load --requests 200 --concurrency 8 --rows 10000 --latency-ms 50
+    python -m benchmarks.load --env WRITE_BATCH_WINDOW_MS=20 --env LEDGER_CACHE_MAX_AGE=0
+    python -m benchmarks.load --asgi --requests 500 --concurrency 200 --latency-ms 100
+
+簽好章的 webhook 直接送進 Flask app，Sheets 與 LINE API 都由 fake_server 回應，
+--asgi 時改送進 linebot_app.asgi，以 asyncio 同時送出 concurrency 個請求。
+最後輸出吞吐量、webhook 延遲分位數、替身伺服器收到的請求數與 429 次數。
+--env 的設定會在載入 linebot_app 前寫入環境變數，可用來比較批次、快取等設定。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MESSAGES = ["write 小美 午餐 餐飲 100", "sum 小美", "read 10", "type 餐飲"]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _send_asgi(webhook, args, server):
+    """以 asyncio 同時送出最多 concurrency 個 webhook，回傳 (結果, 全部回應 200 的秒數)"""
+    from linebot_app.asgi import app
+    from linebot_app.async_http import async_http
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(i):
+        body, signature = webhook(i)
+        messages = [{"type": "http.request", "body": body}]
+        statuses = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def respond(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        scope = {"type": "http", "method": "POST", "path": "/", "headers": [(b"x-line-signature", signature.encode())]}
+        async with semaphore:
+            start = time.perf_counter()
+            await app(scope, receive, respond)
+            return time.perf_counter() - start, statuses[0]
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(send(i) for i in range(args.requests)))
+        acked = time.perf_counter() - started
+        # ASYNC_ACK 時指令在背景 task 執行，等到全部回覆完成
+        deadline = time.monotonic() + args.timeout
+        while len(server.replies) < args.requests and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        await async_http.close()
+    return results, acked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="webhook 端對端負載測試")
+    parser.add_argument("--requests", type=int, default=100, help="webhook 請求數")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時送出的請求數")
+    parser.add_argument("--rows", type=int, default=1000, help="帳本筆數")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="替身伺服器每個請求的延遲")
+    parser.add_argument("--quota-per-minute", type=int, help="Sheets 每分鐘請求上限")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="隨機回傳 429 的機率")
+    parser.add_argument("--message", action="append", help="輪流送出的訊息，可重複指定")
+    parser.add_argument("--asgi", action="store_true", help="改用 ASGI app（asyncio）處理 webhook")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE，覆寫 Config 設定")
+    parser.add_argument("--timeout", type=float, default=120.0, help="等待所有回覆的秒數")
+    parser.add_argument("--output", help="結果 JSON 路徑")
+    args = parser.parse_args(argv)
+
+    # 模組層級的 singleton（快取、批次、worker）在 import 時讀取設定
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    from benchmarks.fake_server import FakeApiServer
+    from benchmarks.fake_sheets import make_rows
+    from linebot_app.config import Config
+    from linebot_app.webhook import WebhookParser
+
+    server = FakeApiServer(
+        latency=args.latency_ms / 1000,
+        quota_per_minute=args.quota_per_minute,
+        error_rate=args.error_rate,
+    ).start()
+    server.add_spreadsheet(Config.GSPREADSHEET, {Config.GWORKSHEET: make_rows(args.rows)})
+    Config.GOOGLE_API_ENDPOINT = server.url
+    Config.LINE_API_ENDPOINT = server.url
+    Config.LINE_DATA_ENDPOINT = server.url
+    Config.LINE_CHANNEL_SECRET = "load-test-secret"
+    Config.LINE_CHANNEL_ACCESS_TOKEN = "load-test-token"
+
+    signer = WebhookParser(Config.LINE_CHANNEL_SECRET)
+    messages = args.message or DEFAULT_MESSAGES
+
+    def webhook(i):
+        event = {
+            "type": "message",
+            "replyToken": f"load-{i}",
+            "webhookEventId": f"load-event-{i}",
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": "U-load"},
+            "message": {"type": "text", "id": str(i), "text": messages[i % len(messages)]},
+        }
+        body = json.dumps({"destination": "load", "events": [event]}, ensure_ascii=False).encode("utf-8")
+        return body, signer.signature_for(body)
+
+    started = time.perf_counter()
+    if args.asgi:
+        results, acked = asyncio.run(_send_asgi(webhook, args, server))
+    else:
+        from linebot_app.linebot_app_gcp import app
+
+        def send(i):
+            body, signature = webhook(i)
+            headers = {"X-Line-Signature": signature, "Content-Type": "application/json"}
+            start = time.perf_counter()
+            response = app.test_client().post("/", data=body, headers=headers)
+            return time.perf_counter() - start, response.status_code
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(send, range(args.requests)))
+        acked = time.perf_counter() - started
+
+        # async-ack 模式下回覆在背景送出，等到全部回覆完成
+        deadline = time.monotonic() + args.timeout
+        while len(server.replies) < args.requests and time.monotonic() < deadline:
+            time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    latencies = [seconds for seconds, _ in results]
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "asgi": args.asgi,
+        "rows": args.rows,
+        "latency_ms": args.latency_ms,
+        "env": args.env,
+        "ack_seconds": round(acked, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(server.replies) / elapsed, 2) if elapsed else 0.0,
+        "replies": len(server.replies),
+        "http_errors": sum(1 for _, status in results if status != 200),
+        "webhook_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 2),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "server_requests": dict(sorted(server.stats.items())),
+    }
+    server.stop()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
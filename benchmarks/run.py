@@ -0,0 +1,219 @@
+"""BotOperation 各指令在不同帳本大小下的效能測試
+
+    python -m benchmarks.run
+    python -m benchmarks.run --rows 1000 10000 100000 1000000 --latency-ms 50
+    python -m benchmarks.run --output new.json --compare benchmarks/results.json
+
+每個指令都在全新的假工作表上執行，記錄 wall time（多次取中位數）、
+Sheets API 呼叫次數、tracemalloc 的 peak 記憶體與淨配置區塊數，
+結果存成 JSON；加上 --compare 時與舊結果比較，有退步則回傳 1。
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from benchmarks.fake_sheets import fake_worksheet, make_rows
+from linebot_app.config import Config
+from linebot_app.ledger import LedgerCache
+from linebot_app.linebot_app_gcp import BotOperation
+from linebot_app.store import SheetsLedgerStore
+
+DEFAULT_ROWS = [1_000, 10_000, 100_000]
+
+# import 一次匯入 1000 筆（一個月份的收據）
+IMPORT_MESSAGE = "import\n" + "\n".join(f"2024-02-{i % 28 + 1:02d} 12:00 小美 午餐 餐飲 {i % 500 + 1}" for i in range(1000))
+
+# (指令名稱, 訊息, 執行前的準備)
+COMMANDS = [
+    ("read", "read", None),
+    ("read_last", "read 20", None),
+    ("read_page", "read p2", None),
+    ("write", "write 小美 午餐 餐飲 100", None),
+    ("import", IMPORT_MESSAGE, None),
+    ("sum", "sum 小美", None),
+    ("type", "type 餐飲", None),
+    ("type_list", "type", None),
+    ("sum_range", "sum 小美 2024-01-01~2024-01-15", None),
+    ("month", "month 2024-01", None),
+    ("report", "report 2024-01~2024-03", None),
+    ("export", "export xlsx 2024-01", None),
+    ("delete", "delete 1", None),
+    ("update", "update 1 2024-01-01 12:00:00 小美 午餐 餐飲 100", None),
+    ("clear", "clear", None),
+    ("revert", "revert", "clear"),
+]
+
+
+class FakeLineBotApi:
+    """只記錄回覆次數的 LineBotApi"""
+
+    def __init__(self):
+        self.replies = 0
+
+    def reply_message(self, reply_token, messages):
+        self.replies += 1
+
+
+def bench_config(**overrides):
+    """以 Config 為基礎、固定為直接讀寫試算表的設定"""
+    values = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    values.update(GWORKSHEET="benchmark", TOTAL_MODE="read_write", LEDGER_BACKEND="sheets")
+    values.update(EXPORT_BASE_URL="http://localhost", EXPORT_MAX_AGE=0)
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+def _run(op, msg, store, config, api, cache):
+    bot = BotOperation(store, api, msg, "benchmark", config, cache=cache)
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot.execute_command(op)
+
+
+def _prepare(template, latency, config, setup, use_cache):
+    """建立全新的假工作表，執行準備指令並預熱快取，回傳 (store, cache)"""
+    wks = fake_worksheet(template, latency=0.0, title=config.GWORKSHEET)
+    store = SheetsLedgerStore(wks, backup_title=f"{config.GWORKSHEET}_backup")
+    cache = LedgerCache(max_age=3600) if use_cache else None
+    if setup:
+        _run(setup, setup, store, config, FakeLineBotApi(), None)
+    if cache is not None:
+        bot = BotOperation(store, FakeLineBotApi(), "", "benchmark", config, cache=cache)
+        cache.index(bot.ledger_key, store.all_values)
+    # 準備完成後才開始計算延遲與呼叫次數
+    wks.spreadsheet.latency = latency
+    wks.spreadsheet.calls.clear()
+    return store, cache
+
+
+def bench_command(name, msg, setup, template, latency=0.0, repeat=3, use_cache=False, config=None):
+    """量測單一指令，回傳一筆結果"""
+    config = config or bench_config()
+    op = msg.split(None, 1)[0]
+
+    timings = []
+    calls = None
+    api = None
+    for _ in range(repeat):
+        store, cache = _prepare(template, latency, config, setup, use_cache)
+        api = FakeLineBotApi()
+        start = time.perf_counter()
+        _run(op, msg, store, config, api, cache)
+        timings.append(time.perf_counter() - start)
+        calls = store.wks.spreadsheet.calls
+
+    # 記憶體另外量測，避免 tracemalloc 影響計時
+    store, cache = _prepare(template, 0.0, config, setup, use_cache)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        _run(op, msg, store, config, FakeLineBotApi(), cache)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+    return {
+        "command": name,
+        "message": msg,
+        "rows": len(template) - 1,
+        "cache": use_cache,
+        "latency_ms": latency * 1000,
+        "wall_ms": round(statistics.median(timings) * 1000, 3),
+        "wall_ms_min": round(min(timings) * 1000, 3),
+        "sheets_calls": sum(calls.values()),
+        "sheets_calls_by_method": dict(sorted(calls.items())),
+        "replies": api.replies,
+        "peak_kib": round(peak / 1024, 1),
+        "net_alloc_blocks": blocks,
+    }
+
+
+def run_suite(sizes=DEFAULT_ROWS, latency=0.0, repeat=3, use_cache=False, commands=None, log=None):
+    """對每個帳本大小執行所有指令"""
+    selected = [c for c in COMMANDS if commands is None or c[0] in commands]
+    results = []
+    for size in sizes:
+        template = make_rows(size)
+        for name, msg, setup in selected:
+            result = bench_command(name, msg, setup, template, latency, repeat, use_cache)
+            results.append(result)
+            if log:
+                log(
+                    f"{size:>9}  {name:<10} {result['wall_ms']:>10.2f} ms  "
+                    f"{result['sheets_calls']:>3} calls  {result['peak_kib']:>10.1f} KiB"
+                )
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_ms": latency * 1000,
+            "repeat": repeat,
+            "cache": use_cache,
+        },
+        "results": results,
+    }
+
+
+def compare(old, new, tolerance=0.2):
+    """比較兩次結果，回傳退步項目的說明
+
+    wall time 或 peak 記憶體超過舊值 (1 + tolerance) 倍、
+    或 Sheets 呼叫次數增加時視為退步。
+    """
+    baseline = {(r["command"], r["rows"], r["cache"]): r for r in old["results"]}
+    regressions = []
+    for r in new["results"]:
+        prev = baseline.get((r["command"], r["rows"], r["cache"]))
+        if prev is None:
+            continue
+        label = f"{r['command']} @ {r['rows']} 筆"
+        if r["sheets_calls"] > prev["sheets_calls"]:
+            regressions.append(f"{label}: Sheets 呼叫 {prev['sheets_calls']} -> {r['sheets_calls']}")
+        for field in ("wall_ms", "peak_kib"):
+            if r[field] > prev[field] * (1 + tolerance):
+                regressions.append(f"{label}: {field} {prev[field]} -> {r[field]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BotOperation 指令效能測試")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="帳本筆數，可多個")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每次 Sheets 呼叫的模擬延遲")
+    parser.add_argument("--repeat", type=int, default=3, help="每個指令計時次數，取中位數")
+    parser.add_argument("--cache", action="store_true", help="使用預熱過的 LedgerCache")
+    parser.add_argument("--commands", nargs="+", choices=[c[0] for c in COMMANDS], help="只執行指定指令")
+    parser.add_argument("--output", default="benchmarks/results.json", help="結果 JSON 路徑")
+    parser.add_argument("--compare", help="與舊的結果 JSON 比較")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的退步比例")
+    args = parser.parse_args(argv)
+
+    report = run_suite(
+        args.rows, args.latency_ms / 1000, args.repeat, args.cache, args.commands, log=print
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果已存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for line in regressions:
+            print("退步", line)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""ASGI 版本的 webhook，一個 process 以 asyncio 同時處理大量請求
+
+    uvicorn linebot_app.asgi:app --port 8080
+
+Sheets 與 LINE API 透過共用的 aiohttp 連線池送出，等待回應時不佔用執行緒：
+每個事件讀取一次工作表（或使用帳本快取），BotOperation 在記憶體中執行指令，
+修改以一次 batchUpdate 寫入成功後才送出回覆。
+需要備份工作表、下載檔案或本機資料庫的指令，以及 formula 模式會修改帳本的指令，
+沿用同步流程在 worker 執行緒處理。
+"""
+import asyncio
+import contextlib
+import weakref
+
+from linebot_app.async_http import AsyncApiError, AsyncLineApi, AsyncSheetsApi, SheetTarget, async_http
+from linebot_app.clients import is_invalid_handle, registry
+from linebot_app.dedup import deduplicator
+from linebot_app.dispatch import EventDispatcher
+from linebot_app.export import media_type, read_export
+from linebot_app.ledger import ledger_cache
+from linebot_app.linebot_app_gcp import (
+    WRITE_UNCERTAIN_TEXT, BotOperation, command_of, drop_duplicates, handle_event, ledger_key_for,
+)
+from linebot_app.messages import TextSendMessage
+from linebot_app.metrics import metrics
+from linebot_app.quota import QuotaExceeded, WriteUncertain
+from linebot_app.sources import config_for
+from linebot_app.store import SnapshotLedgerStore, UnsupportedOperation
+from linebot_app.webhook import is_import_file, is_text
+
+# 在 worker 執行緒以同步流程處理的指令（需要備份工作表、分批寫入或分頁讀取）
+THREAD_COMMANDS = SnapshotLedgerStore.UNSUPPORTED | {"export"}
+# 會修改帳本與 G1 的指令：TOTAL_MODE 為 formula 時走同步流程，總和取自同一次 batchUpdate 回傳的 G1；
+# read_write 時先讀取最新的 G1 再計算新的總和，不使用快取中可能較舊的值
+MUTATING_COMMANDS = {"write", "delete", "update"}
+
+# 同一個帳本的指令依序執行（讀取、計算、寫入之間不能穿插其他修改）
+_ledger_locks = weakref.WeakValueDictionary()
+# ASYNC_ACK 時在背景執行的工作，保留參照避免被回收
+_tasks = set()
+
+
+class ReplyRecorder:
+    """BotOperation 使用的 LINE API：先記錄回覆，寫入成功後再以 async 送出"""
+
+    def __init__(self):
+        self.replies = []
+
+    def reply_message(self, reply_token, messages):
+        self.replies.append((reply_token, messages))
+
+
+def _ledger_lock(key):
+    lock = _ledger_locks.get(key)
+    if lock is None:
+        lock = _ledger_locks[key] = asyncio.Lock()
+    return lock
+
+
+def _sheet_target(config):
+    """開啟（或由快取取得）工作表，回傳 async 呼叫需要的 id 與 token
+
+    第一次開啟與更新 token 會阻塞，所以在 worker 執行緒執行；之後都直接由快取取得。
+    """
+    wks = registry.worksheet(config.GWORKSHEET)
+    return SheetTarget(wks.spreadsheet.id, wks.id, wks.title, registry.gsheets_client().oauth.token)
+
+
+def sheets_api(config):
+    return AsyncSheetsApi(async_http, config.GOOGLE_API_ENDPOINT)
+
+
+async def handle_event_async(event, config, parent=None):
+    """async 版的 handle_event：執行單一事件的指令並回覆"""
+    msg = "import" if is_import_file(event) else event.text
+    op = command_of(msg)
+    if (
+        op in THREAD_COMMANDS or config.LEDGER_BACKEND == "sqlite"
+        or (config.TOTAL_MODE == "formula" and op in MUTATING_COMMANDS)
+    ):
+        key = ledger_key_for(event, config)
+        async with _ledger_lock(key) if key is not None else contextlib.nullcontext():
+            await asyncio.to_thread(handle_event, event, None, registry.line_bot_api, config, parent)
+        return
+
+    config = config_for(event, config)
+    tk = event.reply_token
+    print(msg, tk)
+    key = (config.GSPREADSHEET, config.GWORKSHEET)
+    cache = ledger_cache if config.LEDGER_CACHE_MAX_AGE > 0 else None
+    recorder = ReplyRecorder()
+    command = op if op in BotOperation.COMMANDS else "unknown"
+    with metrics.command(command, parent, config.TRACE_LOG) as trace:
+        try:
+            if op in BotOperation.LEDGER_FREE_COMMANDS or op not in BotOperation.COMMANDS:
+                # 不讀寫帳本的指令與一般聊天訊息不需要開啟工作表
+                BotOperation(SnapshotLedgerStore([], None), recorder, msg, tk, config).execute_command(op)
+            else:
+                async with _ledger_lock(key):
+                    with metrics.phase("auth"):
+                        target = await asyncio.to_thread(_sheet_target, config)
+                    values = cache.peek(key) if cache is not None else None
+                    total = None
+                    if values is None:
+                        values = await sheets_api(config).values_get(target)
+                        if cache is not None:
+                            # write 等不讀取快取的指令之後，同一個帳本的下一個指令不必再讀取
+                            cache.replace(key, values)
+                    elif op in MUTATING_COMMANDS:
+                        # 與同步流程相同，寫入前讀取最新的 G1，其他 instance 或手動修改的總和不會被覆蓋
+                        total = await sheets_api(config).total_get(target)
+                    store = SnapshotLedgerStore(values, target.sheet_id, total)
+                    BotOperation(store, recorder, msg, tk, config, cache=cache).execute_command(op)
+                    if store.requests:
+                        try:
+                            await sheets_api(config).batch_update(target, store.requests)
+                        except Exception:
+                            # 快取已套用這次的修改，寫入失敗時改為重新載入
+                            if cache is not None:
+                                cache.invalidate(key)
+                            raise
+        except KeyError:
+            trace.status = "unsupported"
+            recorder.replies = [(tk, TextSendMessage(text="不支援的指令"))]
+        except QuotaExceeded as ex:
+            print(ex)
+            trace.status = "throttled"
+            deduplicator.release(event.webhook_event_id)
+            recorder.replies = [(tk, TextSendMessage(text="試算表忙碌中，請稍後再試"))]
+        except UnsupportedOperation as ex:
+            print("async 流程不支援的操作", ex)
+            trace.status = "unsupported"
+            recorder.replies = [(tk, TextSendMessage(text="此指令目前無法使用，請稍後再試"))]
+        except WriteUncertain as ex:
+            print(ex)
+            trace.status = "error"
+            recorder.replies = [(tk, TextSendMessage(text=WRITE_UNCERTAIN_TEXT))]
+        except Exception as ex:
+            print(ex)
+            trace.status = "error"
+            # 指令沒有完成，同一個事件重送時要再處理
+            deduplicator.release(event.webhook_event_id)
+            if is_invalid_handle(ex) or (isinstance(ex, AsyncApiError) and ex.status in (400, 404)):
+                # 工作表已被刪除或改名，下一次請求重新開啟
+                registry.invalidate_worksheet(config.GWORKSHEET)
+                ledger_cache.invalidate(key)
+            recorder.replies = [(tk, TextSendMessage(text="指令執行失敗"))]
+
+        line_api = AsyncLineApi(async_http, config.LINE_API_ENDPOINT, config.LINE_CHANNEL_ACCESS_TOKEN)
+        for reply_token, messages in recorder.replies:
+            await line_api.reply_message(reply_token, messages)
+
+
+async def _run_group(group, config, trace):
+    for event in group:
+        try:
+            await handle_event_async(event, config, trace)
+        except Exception as ex:
+            # 單一事件失敗不影響同一批的其他事件
+            print("事件處理失敗", ex)
+
+
+async def _dispatch(events, config, trace):
+    """同一個帳本的事件依序處理，不同帳本的事件同時處理"""
+    groups = EventDispatcher.group(events, lambda event: ledger_key_for(event, config))
+    await asyncio.gather(*(_run_group(group, config, trace) for group in groups))
+
+
+async def webhook(body, signature):
+    """驗證簽章並處理所有事件，ASYNC_ACK 時不等待指令完成"""
+    config = registry.config
+    with metrics.request(config.TRACE_LOG) as trace:
+        # 驗證簽章與解析都只用 CPU，直接在 event loop 執行
+        with metrics.phase("verify"):
+            events = [
+                event for event in registry.parser.parse(body, signature)
+                if is_text(event) or is_import_file(event)
+            ]
+        events = drop_duplicates(events)
+        if not events:
+            return
+        if config.ASYNC_ACK:
+            task = asyncio.create_task(_dispatch(events, config, trace))
+            _tasks.add(task)
+            task.add_done_callback(_tasks.discard)
+        else:
+            await _dispatch(events, config, trace)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body, content_type="text/plain; charset=utf-8", headers=()):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode("latin-1"))] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _tasks:
+                await asyncio.gather(*_tasks, return_exceptions=True)
+            await async_http.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application：POST / 為 webhook，另有 /metrics 與 /exports/檔名"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if method == "POST" and path == "/":
+        body = await _read_body(receive)
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        try:
+            await webhook(body, headers.get("x-line-signature", ""))
+        except Exception as ex:
+            print(ex)
+            await _respond(send, 400, "Bad Request")
+            return
+        await _respond(send, 200, "OK")
+    elif method == "GET" and path == "/metrics":
+        await _respond(send, 200, metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+    elif method == "GET" and path.startswith("/exports/"):
+        name = path[len("/exports/"):]
+        data = await asyncio.to_thread(read_export, registry.config.EXPORT_DIR, name)
+        if data is None:
+            await _respond(send, 404, "Not Found")
+            return
+        disposition = f'attachment; filename="{name}"'.encode("latin-1")
+        await _respond(send, 200, data, media_type(name), [(b"content-disposition", disposition)])
+    else:
+        await _respond(send, 404, "Not Found")
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+from linebot_app.config import Config
+from linebot_app.metrics import metrics, payload_size
+from linebot_app.quota import INTERACTIVE, RETRY_STATUSES, QuotaExceeded, WriteUncertain, scheduler
+
+SHEETS_API_ROOT = "https://sheets.googleapis.com"
+
+# async 呼叫 Sheets API 需要的工作表資訊與 access token
+SheetTarget = namedtuple("SheetTarget", ["spreadsheet_id", "sheet_id", "title", "token"])
+
+
+class AsyncApiError(Exception):
+    """Sheets / LINE API 回傳 4xx / 5xx"""
+
+    def __init__(self, status, body="", retry_after=None):
+        super().__init__(f"HTTP {status}: {body[:200]}")
+        self.status = status
+        self.body = body
+        try:
+            self.retry_after = float(retry_after or 0)
+        except ValueError:
+            self.retry_after = 0.0
+
+
+def is_retryable(ex):
+    """429 / 5xx 與連線錯誤可以重試"""
+    import aiohttp
+
+    if isinstance(ex, AsyncApiError):
+        return ex.status in RETRY_STATUSES
+    return isinstance(ex, (aiohttp.ClientConnectionError, ConnectionError, TimeoutError))
+
+
+class AsyncHttp:
+    """整個 process 共用的 aiohttp session，所有 async 請求共用同一個連線池
+
+    session 綁定建立時的 event loop，換了 loop（例如測試中多次 asyncio.run）時重新建立。
+    aiohttp 在第一次送出請求時才載入。
+    """
+
+    def __init__(self, pool_size=100, timeout=30.0):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self._loop = None
+
+    def session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._loop = loop
+        return self._session
+
+    async def request(self, service, name, method, url, headers=None, body=None, params=None):
+        """送出 JSON 請求並回傳解析後的回應，記錄到 metrics（與同步路徑相同的 service / method）"""
+        start = time.perf_counter()
+        error = None
+        result = None
+        try:
+            async with self.session().request(method, url, json=body, params=params, headers=headers) as response:
+                text = await response.text()
+                if response.status >= 400:
+                    raise AsyncApiError(response.status, text, response.headers.get("Retry-After"))
+                result = json.loads(text) if text else {}
+                return result
+        except Exception as ex:
+            error = type(ex).__name__
+            raise
+        finally:
+            metrics.record_call(
+                service, name, time.perf_counter() - start, payload_size(body), payload_size(result), error
+            )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+
+class AsyncSheetsApi:
+    """以 Sheets REST API 讀取整張工作表與送出 batchUpdate
+
+    與同步路徑共用 SheetsScheduler 的配額與退避設定，
+    等待配額與重試都以 asyncio.sleep 進行，不佔用執行緒。
+    """
+
+    def __init__(self, http, endpoint=""):
+        self.http = http
+        self.root = f"{(endpoint or SHEETS_API_ROOT).rstrip('/')}/v4/spreadsheets"
+
+    async def _acquire(self, deadline):
+        bucket = scheduler.bucket
+        start = time.perf_counter()
+        # 以已過期的 deadline 呼叫 acquire 不會阻塞，拿不到 token 時改為 await 等待
+        while not bucket.acquire(INTERACTIVE, time.monotonic()):
+            if time.monotonic() >= deadline:
+                raise QuotaExceeded("等待 Sheets 配額逾時")
+            await asyncio.sleep(min(0.1, 1 / bucket.rate))
+        waited = time.perf_counter() - start
+        if waited > 0.001:
+            metrics.record_phase("throttle", waited)
+
+    async def _call(self, name, method, url, target, body=None, params=None, idempotent=True):
+        """與 SheetsScheduler.call 相同：idempotent 為 False 時只在 429 重試"""
+        deadline = time.monotonic() + scheduler.deadline
+        headers = {"Authorization": f"Bearer {target.token}"}
+        attempt = 0
+        while True:
+            await self._acquire(deadline)
+            try:
+                return await self.http.request("sheets", name, method, url, headers, body, params)
+            except Exception as ex:
+                if not is_retryable(ex):
+                    raise
+                if not idempotent and getattr(ex, "status", None) != 429:
+                    raise WriteUncertain(f"寫入結果不確定: {ex}") from ex
+                if getattr(ex, "status", None) == 429:
+                    scheduler.bucket.drain()
+                delay = max(scheduler.backoff(attempt), getattr(ex, "retry_after", 0.0))
+                attempt += 1
+                if time.monotonic() + delay >= deadline:
+                    raise QuotaExceeded(f"Sheets 重試 {attempt} 次仍失敗: {ex}") from ex
+                metrics.record_phase("throttle", delay)
+                await asyncio.sleep(delay)
+
+    async def values_get(self, target):
+        """讀取整張工作表（與 get_all_values 相同，不含結尾的空白列與空白欄）"""
+        a1 = "'{}'".format(target.title.replace("'", "''"))
+        url = f"{self.root}/{target.spreadsheet_id}/values/{quote(a1, safe='')}"
+        response = await self._call("get_all_values", "GET", url, target)
+        return response.get("values", [])
+
+    async def total_get(self, target):
+        """讀取 G1 目前顯示的內容（與 wks.cell("G1").value 相同），空白時回傳空字串"""
+        a1 = "'{}'!G1".format(target.title.replace("'", "''"))
+        url = f"{self.root}/{target.spreadsheet_id}/values/{quote(a1, safe='')}"
+        response = await self._call("cell", "GET", url, target)
+        values = response.get("values") or [[""]]
+        return values[0][0] if values[0] else ""
+
+    async def batch_update(self, target, requests):
+        url = f"{self.root}/{target.spreadsheet_id}:batchUpdate"
+        return await self._call("batch_update", "POST", url, target, body={"requests": requests}, idempotent=False)
+
+
+class AsyncLineApi:
+    """LINE reply API 的 async 版本，reply_message 的參數與 LineBotApi 相同"""
+
+    def __init__(self, http, endpoint, access_token):
+        self.http = http
+        self.url = f"{endpoint.rstrip('/')}/v2/bot/message/reply"
+        self.headers = {"Authorization": f"Bearer {access_token}"}
+
+    async def reply_message(self, reply_token, messages):
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        body = {"replyToken": reply_token, "messages": [message.as_json_dict() for message in messages]}
+        await self.http.request("line", "reply_message", "POST", self.url, self.headers, body)
+
+
+async_http = AsyncHttp(pool_size=Config.ASYNC_HTTP_POOL_SIZE, timeout=Config.ASYNC_HTTP_TIMEOUT)
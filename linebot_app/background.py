@@ -0,0 +1,126 @@
+import atexit
+import itertools
+import queue
+import signal
+import threading
+import time
+
+from linebot_app.config import Config
+
+# 放入佇列代表 worker 結束的標記
+_STOP = object()
+
+
+class BackgroundProcessor:
+    """先回覆 webhook，再由背景 worker 執行指令與回覆
+
+    每個 worker 有自己的佇列，同一個帳本的事件固定交給同一個 worker，
+    所以跨 webhook 仍維持原本順序；不同帳本則平行處理。
+    process 結束時會先把佇列中剩下的事件處理完。
+    """
+
+    def __init__(self, workers=2):
+        self.workers = max(1, workers)
+        self._queues = [queue.Queue() for _ in range(self.workers)]
+        self._threads = []
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        self._processed = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._hooks_installed = False
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for q in self._queues:
+                thread = threading.Thread(target=self._work, args=(q,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self.install_hooks()
+
+    def install_hooks(self):
+        """註冊 atexit 與 SIGTERM（Cloud Run 關閉執行個體）時先清空佇列，回傳是否已安裝
+
+        signal handler 只能在主執行緒安裝，所以要在 import 時（主執行緒）呼叫；
+        第一次 submit 才啟動 worker 時通常已在處理請求的執行緒，無法安裝。
+        """
+        with self._lock:
+            if self._hooks_installed:
+                return True
+            if threading.current_thread() is not threading.main_thread():
+                print("無法在非主執行緒安裝 SIGTERM handler，關閉時佇列中的事件可能遺失")
+                return False
+            atexit.register(self.shutdown)
+            self._install_sigterm_handler()
+            self._hooks_installed = True
+            return True
+
+    def _install_sigterm_handler(self):
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def _handle_sigterm(signum, frame):
+            self.shutdown()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+
+    def _shard(self, key):
+        if key is None:
+            return next(self._round_robin) % self.workers
+        return hash(key) % self.workers
+
+    def submit(self, events, key_func, handle):
+        """把事件放入佇列後立即返回"""
+        self.start()
+        now = time.monotonic()
+        for event in events:
+            self._queues[self._shard(key_func(event))].put((now, event, handle))
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                enqueued_at, event, handle = item
+                lag = time.monotonic() - enqueued_at
+                with self._lock:
+                    self._last_lag = lag
+                    self._max_lag = max(self._max_lag, lag)
+                try:
+                    handle(event)
+                except Exception as ex:
+                    print("背景事件處理失敗", ex)
+                with self._lock:
+                    self._processed += 1
+            finally:
+                q.task_done()
+
+    def stats(self):
+        """回傳佇列深度與處理延遲（事件入列到開始處理的秒數）"""
+        with self._lock:
+            return {
+                "queue_depth": sum(q.qsize() for q in self._queues),
+                "processed": self._processed,
+                "last_lag_seconds": round(self._last_lag, 3),
+                "max_lag_seconds": round(self._max_lag, 3),
+            }
+
+    def shutdown(self):
+        """處理完佇列中剩下的事件後停止所有 worker"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        for q in self._queues:
+            q.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+
+background = BackgroundProcessor(workers=Config.ASYNC_ACK_WORKERS)
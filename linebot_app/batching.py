@@ -0,0 +1,76 @@
+import threading
+
+from linebot_app.config import Config
+
+
+class _Batch:
+    """同一個帳本在同一個時間窗內收集到的 write"""
+
+    def __init__(self):
+        self.entries = []  # (rows, amount)
+        self.row_count = 0
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class WriteBatcher:
+    """把短時間內多個 write 合併成一次 append 與一次總和更新
+
+    第一個進入的請求成為 leader，等待 window 秒（或累積到 max_rows 列）
+    後代表整批呼叫一次 flush；其他請求等待結果，各自拿回寫入自己那幾列後的總和，
+    讓每個人的回覆仍然只包含自己的資料與門檻提醒。
+    """
+
+    def __init__(self, window=0.1, max_rows=500):
+        self.window = window
+        self.max_rows = max_rows
+        self._pending = {}
+        self._cond = threading.Condition()
+
+    def submit(self, key, rows, amount, flush):
+        """加入一筆 write，回傳寫入後（含本次與之前排隊的金額）的總和
+
+        flush(rows, amount) 由 leader 對整批資料呼叫一次，須回傳寫入後的總和。
+        """
+        with self._cond:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            position = len(batch.entries)
+            batch.entries.append((rows, amount))
+            batch.row_count += len(rows)
+            if batch.row_count >= self.max_rows:
+                self._cond.notify_all()
+            if leader:
+                self._cond.wait_for(lambda: batch.row_count >= self.max_rows, timeout=self.window)
+                # 關閉這一批，之後到達的請求開始新的一批
+                del self._pending[key]
+
+        if leader:
+            self._flush(batch, flush)
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[position]
+
+    def _flush(self, batch, flush):
+        all_rows = [row for rows, _ in batch.entries for row in rows]
+        amount = sum(amount for _, amount in batch.entries)
+        try:
+            new_total = flush(all_rows, amount)
+            # 依排隊順序計算每個請求寫入後的累計總和
+            running = new_total - amount
+            results = []
+            for _, entry_amount in batch.entries:
+                running += entry_amount
+                results.append(running)
+            batch.results = results
+        except Exception as ex:
+            batch.error = ex
+        finally:
+            batch.done.set()
+
+
+write_batcher = WriteBatcher(window=Config.WRITE_BATCH_WINDOW_MS / 1000)
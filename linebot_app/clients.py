@@ -0,0 +1,309 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from linebot_app.config import Config
+from linebot_app.quota import scheduler
+from linebot_app.store import HEADER
+from linebot_app.totals import TOTAL_FORMULA
+from linebot_app.webhook import WebhookParser
+
+
+# Sheets 與 Drive API 的網址，設定 GOOGLE_API_ENDPOINT 時改送到該位址
+GOOGLE_API_ROOTS = ("https://sheets.googleapis.com/", "https://www.googleapis.com/")
+
+
+class ThreadLocalHttp:
+    """每個執行緒各自持有一個 httplib2.Http
+
+    httplib2 不是 thread-safe，透過這層代理讓同一個 pygsheets client
+    與 worksheet handle 可以被多個 worker 同時使用，且各自重複使用連線。
+    有 endpoint 時把 Google API 的網址改寫到該位址（本機替身伺服器）。
+    """
+
+    def __init__(self, endpoint=None):
+        self._local = threading.local()
+        self.endpoint = endpoint.rstrip("/") + "/" if endpoint else None
+
+    @property
+    def http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            from googleapiclient.http import build_http
+
+            http = self._local.http = build_http()
+        return http
+
+    def request(self, uri, *args, **kwargs):
+        if self.endpoint:
+            for root in GOOGLE_API_ROOTS:
+                if uri.startswith(root):
+                    uri = self.endpoint + uri[len(root):]
+                    break
+        return self.http.request(uri, *args, **kwargs)
+
+    def close(self):
+        self.http.close()
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+def is_invalid_handle(ex):
+    """判斷例外是否代表 worksheet handle 已失效（工作表被刪除或改名）"""
+    import pygsheets
+    from googleapiclient.errors import HttpError
+
+    if isinstance(ex, pygsheets.WorksheetNotFound):
+        return True
+    if isinstance(ex, HttpError):
+        # 工作表被刪除時回傳 404，被改名時 range 會無法解析而回傳 400
+        status = int(ex.resp.status)
+        return status == 404 or (status == 400 and "unable to parse range" in str(ex).lower())
+    return False
+
+
+class WorksheetCache:
+    """已開啟的 worksheet handle，依最近使用順序保存（LRU）
+
+    超過 max_size 時丟棄最久沒用的，閒置超過 idle_seconds 的也會被丟棄，
+    服務很多群組時只保留常用帳本的 handle。
+    """
+
+    def __init__(self, max_size=128, idle_seconds=1800, clock=time.monotonic):
+        self.max_size = max(1, max_size)
+        self.idle_seconds = idle_seconds
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> [handle, 最後使用時間]
+        self._lock = threading.Lock()
+        # 正在開啟的 key -> [lock, 等待中的執行緒數]，同一個 key 一次只開啟一次
+        self._opening = {}
+
+    def _evict_idle(self, now):
+        while self._entries:
+            key, (_, used) = next(iter(self._entries.items()))
+            if now - used <= self.idle_seconds:
+                break
+            del self._entries[key]
+
+    def _lookup(self, key):
+        with self._lock:
+            now = self._clock()
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry[1] = now
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def get(self, key, opener):
+        """取得 key 的 handle，不在快取中時以 opener() 開啟
+
+        同一個 key 同時只有一個執行緒呼叫 opener()，其他執行緒等它開完後直接沿用，
+        新來源的第一批事件不會重複建立同名的工作表。
+        """
+        handle = self._lookup(key)
+        if handle is not None:
+            return handle
+        with self._lock:
+            opening = self._opening.get(key)
+            if opening is None:
+                opening = self._opening[key] = [threading.Lock(), 0]
+            opening[1] += 1
+        try:
+            with opening[0]:
+                handle = self._lookup(key)
+                if handle is not None:
+                    return handle
+                handle = opener()
+                with self._lock:
+                    self._entries[key] = [handle, self._clock()]
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+                return handle
+        finally:
+            with self._lock:
+                opening[1] -= 1
+                if not opening[1]:
+                    del self._opening[key]
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class ClientRegistry:
+    """整個 process 共用的 LINE 與 Google Sheets 客戶端
+
+    第一次使用時才建立，之後的 webhook 直接重複使用，
+    OAuth token 在到期前主動更新，worksheet 只在失效時重新開啟。
+    pygsheets、google-auth、linebot 等套件在第一次建立客戶端時才載入，縮短 cold start。
+    每個帳本（工作表）的 handle 存在 WorksheetCache，試算表 handle 只開啟一次。
+    """
+
+    # token 剩餘時間少於此值時提前更新
+    TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+    def __init__(self, config=None):
+        self.config = config or Config()
+        self._lock = threading.RLock()
+        self._line_bot_api = None
+        self._parser = None
+        self._gc = None
+        self._spreadsheet = None
+        self._worksheets = WorksheetCache(self.config.WORKSHEET_CACHE_SIZE, self.config.WORKSHEET_IDLE_SECONDS)
+        self._auth_request = None
+        self._export_bucket = None
+
+    @property
+    def line_bot_api(self):
+        if self._line_bot_api is None:
+            with self._lock:
+                if self._line_bot_api is None:
+                    from linebot import LineBotApi
+
+                    from linebot_app.line_http import SessionHttpClient
+
+                    self._line_bot_api = LineBotApi(
+                        self.config.LINE_CHANNEL_ACCESS_TOKEN,
+                        endpoint=self.config.LINE_API_ENDPOINT,
+                        data_endpoint=self.config.LINE_DATA_ENDPOINT,
+                        http_client=SessionHttpClient
+                    )
+        return self._line_bot_api
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            with self._lock:
+                if self._parser is None:
+                    self._parser = WebhookParser(self.config.LINE_CHANNEL_SECRET)
+        return self._parser
+
+    def gsheets_client(self):
+        """取得已授權的 pygsheets client，必要時更新 token"""
+        with self._lock:
+            if self._gc is None:
+                import pygsheets
+                from google.oauth2.credentials import Credentials
+
+                endpoint = self.config.GOOGLE_API_ENDPOINT
+                # 429 / 5xx 交給 SheetsScheduler 重試，關閉 pygsheets 內建的重試與固定等待
+                options = {"check": False, "retries": 0}
+                if endpoint:
+                    # 替身伺服器不驗證 token，不需要 service account 金鑰
+                    self._gc = pygsheets.authorize(
+                        custom_credentials=Credentials(token="fake-token"),
+                        http=ThreadLocalHttp(endpoint), **options
+                    )
+                else:
+                    self._gc = pygsheets.authorize(
+                        service_file=self.config.GDRIVE_JSON, http=ThreadLocalHttp(), **options
+                    )
+            self._refresh_token_if_needed(self._gc.oauth)
+            return self._gc
+
+    def _refresh(self, credentials):
+        if self._auth_request is None:
+            import requests
+            from google.auth.transport.requests import Request as AuthRequest
+
+            self._auth_request = AuthRequest(session=requests.Session())
+        credentials.refresh(self._auth_request)
+
+    def _refresh_token_if_needed(self, credentials):
+        expiry = getattr(credentials, "expiry", None)
+        if credentials.token is None:
+            self._refresh(credentials)
+            return
+        if expiry is None:
+            return
+        # google-auth 的 expiry 是 naive UTC 時間
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if expiry - now < self.TOKEN_REFRESH_MARGIN:
+            self._refresh(credentials)
+
+    def _open_spreadsheet(self, gc):
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = scheduler.call(gc.open, self.config.GSPREADSHEET)
+            return self._spreadsheet
+
+    def _open_worksheet(self, gc, title):
+        import pygsheets
+
+        spreadsheet = self._open_spreadsheet(gc)
+        try:
+            return scheduler.call(spreadsheet.worksheet_by_title, title)
+        except pygsheets.WorksheetNotFound:
+            if title == self.config.GWORKSHEET:
+                raise
+        # 新的群組或使用者第一次記帳，建立該來源專用的工作表
+        wks = scheduler.call(spreadsheet.add_worksheet, title, rows=1000, cols=7, idempotent=False)
+        total = TOTAL_FORMULA if self.config.TOTAL_MODE == "formula" else 0
+        scheduler.call(wks.update_row, 1, HEADER + [total])
+        return wks
+
+    def export_bucket(self):
+        """EXPORT_BUCKET 的上傳客戶端，以 GDRIVE_JSON 的 service account 授權與簽章"""
+        with self._lock:
+            if self._export_bucket is None:
+                from linebot_app.gcs import ExportBucket
+
+                self._export_bucket = ExportBucket(self.config.EXPORT_BUCKET, self.config.GDRIVE_JSON)
+            return self._export_bucket
+
+    def worksheet(self, title=None):
+        """取得記帳工作表（預設為 GWORKSHEET），只有第一次、失效或被 LRU 丟棄後才重新開啟"""
+        gc = self.gsheets_client()
+        title = title or self.config.GWORKSHEET
+        return self._worksheets.get(
+            (self.config.GSPREADSHEET, title), lambda: self._open_worksheet(gc, title)
+        )
+
+    def invalidate_worksheet(self, title=None):
+        """標記 worksheet handle 失效（title 為 None 時全部），下次取得時重新開啟"""
+        with self._lock:
+            self._spreadsheet = None
+        self._worksheets.invalidate(None if title is None else (self.config.GSPREADSHEET, title))
+
+    def prewarm(self):
+        """在背景執行緒載入 LINE 與 Sheets 套件並開啟工作表，回傳該執行緒
+
+        instance 啟動後馬上進行，第一個 webhook 不必等待套件載入與授權。
+        """
+        def warm():
+            try:
+                self.line_bot_api
+                if self.config.LEDGER_SCOPE == "source":
+                    self.gsheets_client()
+                else:
+                    self.worksheet()
+            except Exception as ex:
+                print("預先建立客戶端失敗", ex)
+
+        thread = threading.Thread(target=warm, name="prewarm-clients", daemon=True)
+        thread.start()
+        return thread
+
+    def reset(self):
+        """清除所有快取的客戶端（測試或設定變更時使用）"""
+        with self._lock:
+            self._line_bot_api = None
+            self._parser = None
+            self._gc = None
+            self._spreadsheet = None
+            self._export_bucket = None
+        self._worksheets.invalidate()
+
+
+registry = ClientRegistry()
@@ -0,0 +1,18 @@
+# 表單欄位索引，BotOperation 與各種帳本表示共用
+COL_TIME = 0
+COL_NAME = 1
+COL_ITEM = 2
+COL_TYPE = 3
+COL_AMOUNT = 4
+
+# 金額（分）的上限，超過時視為無法解析，確保能存進 64 位元整數欄位
+MAX_CENTS = 2 ** 62
+
+
+def to_cents(value):
+    """把金額字串轉成整數分，避免浮點數累加誤差；無法解析或超出範圍時回傳 None"""
+    try:
+        cents = round(float(value) * 100)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return cents if -MAX_CENTS < cents < MAX_CENTS else None
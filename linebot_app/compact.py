@@ -0,0 +1,329 @@
+import weakref
+from array import array
+from collections.abc import Sequence
+from datetime import date
+
+from linebot_app.columns import COL_AMOUNT, COL_ITEM, COL_NAME, COL_TIME, COL_TYPE, to_cents
+from linebot_app.timeindex import day_key
+
+# 時間、金額無法解析，或欄位不存在（人名、品項、分類的代碼為 -1）
+MISSING = -(2 ** 63)
+NO_CODE = -1
+
+EPOCH_DAY = date(1970, 1, 1).toordinal()
+_TWO_DIGITS = tuple(f"{i:02d}" for i in range(60))
+# 逐列讀取時每次組回的列數
+_CHUNK = 4096
+
+
+def day_of(stamp):
+    """epoch 秒轉成日期序號（date.toordinal）"""
+    return stamp // 86400 + EPOCH_DAY
+
+
+class StringTable:
+    """字串與整數代碼的對照表，只會新增；同一個帳本的人名、品項、分類共用"""
+
+    __slots__ = ("strings", "_codes")
+
+    def __init__(self):
+        self.strings = []
+        self._codes = {}
+
+    def code(self, text):
+        code = self._codes.get(text)
+        if code is None:
+            code = self._codes[text] = len(self.strings)
+            self.strings.append(text)
+        return code
+
+    def find(self, text):
+        """回傳字串的代碼，沒有出現過時回傳 None"""
+        return self._codes.get(text)
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class CompactLedger(Sequence):
+    """快取中帳本的欄式表示，行為與含標題列的 list of rows 相同
+
+    人名、品項、分類存成 StringTable 的整數代碼，時間存成 epoch 秒（試算表上的 UTC+8 時間），
+    金額存成整數分，都放在 array 裡，每列約 32 bytes，不必為每個儲存格保留 Python 字串。
+    讀取某一列時才組回字串 list；組不回原本文字的列（時間或金額的寫法不同、欄位數不是 5）
+    另外保存原始內容，所以 read、export 的輸出與試算表一致。
+    """
+
+    __slots__ = (
+        "header", "table", "stamps", "names", "items", "kinds", "cents", "raw_ids", "_raw", "_memo", "_views",
+        "__weakref__",
+    )
+
+    def __init__(self, rows=()):
+        self.header = None
+        self.table = StringTable()
+        self.stamps = array("q")
+        self.names = array("i")
+        self.items = array("i")
+        self.kinds = array("i")
+        self.cents = array("q")
+        # 0 表示由欄位組回，k 表示原始內容在 _raw[k]
+        self.raw_ids = array("i")
+        self._raw = {}
+        # 解析與格式化的結果：時間字串前 10 字 -> 日期序號、金額字串 -> 分、
+        # epoch 日 -> "YYYY-MM-DD "、一天中的分鐘數 -> "HH:MM:"、分 -> 字串
+        self._memo = ({}, {}, {}, {}, {})
+        # 共用同一組 array 的物件（id -> 物件的 WeakValueDictionary，被回收的副本自動移除），
+        # 其中還有其他物件時，修改前要先複製
+        self._views = None
+        self.extend(rows)
+
+    # 解析與格式化
+
+    def _stamp(self, text):
+        dates = self._memo[0]
+        day = dates.get(text[:10])
+        if day is None:
+            day = dates[text[:10]] = day_key(text)
+        if day is None:
+            return MISSING
+        stamp = (day - EPOCH_DAY) * 86400
+        clock = text[11:19]
+        if len(text) == 19 and text[10] == " " and clock[2] == ":" and clock[5] == ":":
+            try:
+                return stamp + int(clock[0:2]) * 3600 + int(clock[3:5]) * 60 + int(clock[6:8])
+            except ValueError:
+                pass
+        return stamp
+
+    def _cents(self, text):
+        amounts = self._memo[1]
+        cents = amounts.get(text)
+        if cents is None:
+            # 超出 array("q") 範圍的金額也視為無法解析並保留原始文字
+            cents = to_cents(text)
+            if cents is None:
+                cents = MISSING
+            amounts[text] = cents
+        return cents
+
+    def _time_text(self, stamp):
+        day, seconds = divmod(stamp, 86400)
+        dates, clocks = self._memo[2], self._memo[3]
+        text = dates.get(day)
+        if text is None:
+            text = dates[day] = date.fromordinal(day + EPOCH_DAY).isoformat() + " "
+        minute, second = divmod(seconds, 60)
+        clock = clocks.get(minute)
+        if clock is None:
+            clock = clocks[minute] = f"{minute // 60:02d}:{minute % 60:02d}:"
+        return text + clock + _TWO_DIGITS[second]
+
+    def _amount_text(self, cents):
+        texts = self._memo[4]
+        text = texts.get(cents)
+        if text is None:
+            text = texts[cents] = str(cents // 100) if cents % 100 == 0 else str(cents / 100)
+        return text
+
+    # 列的編碼與組回
+
+    def _encode(self, row):
+        """回傳 (時間, 人名, 品項, 分類, 金額, 原始內容或 None)"""
+        size = len(row)
+        code = self.table.code
+        stamp = self._stamp(row[COL_TIME]) if size > COL_TIME else MISSING
+        cents = self._cents(row[COL_AMOUNT]) if size > COL_AMOUNT else MISSING
+        fields = (
+            stamp,
+            code(row[COL_NAME]) if size > COL_NAME else NO_CODE,
+            code(row[COL_ITEM]) if size > COL_ITEM else NO_CODE,
+            code(row[COL_TYPE]) if size > COL_TYPE else NO_CODE,
+            cents,
+        )
+        exact = (
+            size == 5 and stamp != MISSING and cents != MISSING
+            and self._time_text(stamp) == row[COL_TIME] and self._amount_text(cents) == row[COL_AMOUNT]
+        )
+        return fields + (None if exact else list(row),)
+
+    def _store_raw(self, row):
+        if row is None:
+            return 0
+        raw_id = len(self._raw) + 1
+        while raw_id in self._raw:
+            raw_id += 1
+        self._raw[raw_id] = row
+        return raw_id
+
+    def _decode(self, j):
+        raw_id = self.raw_ids[j]
+        if raw_id:
+            return list(self._raw[raw_id])
+        strings = self.table.strings
+        return [
+            self._time_text(self.stamps[j]), strings[self.names[j]], strings[self.items[j]],
+            strings[self.kinds[j]], self._amount_text(self.cents[j]),
+        ]
+
+    def _decode_range(self, start, stop):
+        """依序組回 array 中 start 到 stop 的列"""
+        strings, raw = self.table.strings, self._raw
+        dates, clocks, amounts = self._memo[2:]
+        columns = (self.stamps, self.names, self.items, self.kinds, self.cents, self.raw_ids)
+        for stamp, name, item, kind, cents, raw_id in zip(*(column[start:stop] for column in columns)):
+            if raw_id:
+                yield list(raw[raw_id])
+                continue
+            # 與 _time_text、_amount_text 相同，已格式化過的日期、分鐘、金額直接查表
+            day, seconds = divmod(stamp, 86400)
+            try:
+                text = dates[day] + clocks[seconds // 60] + _TWO_DIGITS[seconds % 60]
+            except KeyError:
+                text = self._time_text(stamp)
+            amount = amounts.get(cents) or self._amount_text(cents)
+            yield [text, strings[name], strings[item], strings[kind], amount]
+
+    # list 介面
+
+    def _detach(self):
+        """還有其他物件共用 array 與標題列時，先複製一份再修改"""
+        views = self._views
+        if views is None:
+            return
+        views.pop(id(self), None)
+        self._views = None
+        if views:
+            self.header = None if self.header is None else list(self.header)
+            for name in ("stamps", "names", "items", "kinds", "cents", "raw_ids"):
+                column = getattr(self, name)
+                setattr(self, name, array(column.typecode, column))
+            self._raw = dict(self._raw)
+
+    def append(self, row):
+        self._detach()
+        if self.header is None:
+            self.header = list(row)
+            return
+        stamp, name, item, kind, cents, raw = self._encode(row)
+        self.stamps.append(stamp)
+        self.names.append(name)
+        self.items.append(item)
+        self.kinds.append(kind)
+        self.cents.append(cents)
+        self.raw_ids.append(self._store_raw(raw))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def _position(self, index):
+        """列索引（0 為標題列）轉成資料列在 array 中的位置"""
+        if index < 0:
+            index += len(self)
+        if not 1 <= index < len(self):
+            raise IndexError("ledger row index out of range")
+        return index - 1
+
+    def pop(self, index):
+        self._detach()
+        j = self._position(index)
+        row = self._decode(j)
+        raw_id = self.raw_ids[j]
+        if raw_id:
+            del self._raw[raw_id]
+        for column in (self.stamps, self.names, self.items, self.kinds, self.cents, self.raw_ids):
+            del column[j]
+        return row
+
+    def __setitem__(self, index, row):
+        self._detach()
+        if index == 0:
+            self.header = list(row)
+            return
+        j = self._position(index)
+        old = self.raw_ids[j]
+        if old:
+            del self._raw[old]
+        stamp, name, item, kind, cents, raw = self._encode(row)
+        self.stamps[j], self.names[j], self.items[j], self.kinds[j], self.cents[j] = stamp, name, item, kind, cents
+        self.raw_ids[j] = self._store_raw(raw)
+
+    def set_total(self, total):
+        """同步標題列 G1 的總和"""
+        self._detach()
+        if self.header is not None:
+            self.header.extend([""] * (7 - len(self.header)))
+            self.header[6] = str(total)
+
+    def __len__(self):
+        return 0 if self.header is None else len(self.stamps) + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1 or start >= stop:
+                return [self[i] for i in range(start, stop, step)]
+            rows = [self.header] if start == 0 else []
+            return rows + list(self._decode_range(max(start, 1) - 1, stop - 1))
+        if index < 0:
+            index += len(self)
+        if index == 0 and self.header is not None:
+            return self.header
+        return self._decode(self._position(index))
+
+    def __iter__(self):
+        if self.header is None:
+            return
+        yield self.header
+        # 分段組回，不必一次複製整個欄位
+        for start in range(0, len(self.stamps), _CHUNK):
+            yield from self._decode_range(start, start + _CHUNK)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def copy(self):
+        """內容相同的新物件，copy-on-write：共用 array，任何一方修改前才複製
+
+        StringTable 與解析結果只會新增，一直共用。
+        """
+        other = CompactLedger.__new__(CompactLedger)
+        for name in self.__slots__[:-2]:  # 不含 _views 與 __weakref__
+            setattr(other, name, getattr(self, name))
+        if self._views is None:
+            self._views = weakref.WeakValueDictionary({id(self): self})
+        self._views[id(other)] = other
+        other._views = self._views
+        return other
+
+    def select(self, period=None, name=None, kind=None):
+        """依日期區間、人名、分類篩選資料列（條件與 export.row_filter 相同）
+
+        先在整數欄位上比對，只組回符合的列。
+        """
+        find = self.table.find
+        name_code = find(name) if name is not None else NO_CODE
+        kind_code = find(kind) if kind is not None else NO_CODE
+        if None in (name_code, kind_code):
+            return
+        start, end = (period[0].toordinal(), period[1].toordinal()) if period else (None, None)
+        for j, (stamp, row_name, row_kind) in enumerate(zip(self.stamps, self.names, self.kinds)):
+            if row_kind < 0:
+                continue
+            if name is not None and row_name != name_code:
+                continue
+            if kind is not None and row_kind != kind_code:
+                continue
+            if start is not None and (stamp == MISSING or not start <= day_of(stamp) <= end):
+                continue
+            yield self._decode(j)
+
+    def nbytes(self):
+        """各欄 array 佔用的位元組數（不含共用的字串與少數保留原始內容的列）"""
+        columns = (self.stamps, self.names, self.items, self.kinds, self.cents, self.raw_ids)
+        return sum(column.itemsize * len(column) for column in columns)
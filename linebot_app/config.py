@@ -1,8 +1,26 @@
 import os
-from dotenv import load_dotenv
+import tempfile
 
-# 載入 .env 文件
-load_dotenv()
+
+def _find_env_file():
+    """由本檔案所在目錄往上尋找 .env（與 python-dotenv 的 find_dotenv 相同）"""
+    path = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(path, ".env")
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+# 載入 .env 文件；部署環境通常直接設定環境變數，沒有 .env 時不載入 python-dotenv
+_env_file = _find_env_file()
+if _env_file:
+    from dotenv import load_dotenv
+
+    load_dotenv(_env_file)
 
 class Config: # 必須是全大寫
     LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
@@ -12,4 +30,84 @@ class Config: # 必須是全大寫
     GOOGLE_SHEET_URL = os.getenv("GOOGLE_SHEET_URL")
     GSPREADSHEET = os.getenv("GSPREADSHEET", "linebot_expense")
     GWORKSHEET = os.getenv("GWORKSHEET", "expense")
-    THRESHOLD_AMOUNT = int(os.getenv("THRESHOLD_AMOUNT", "6000"))
\ No newline at end of file
+    THRESHOLD_AMOUNT = int(os.getenv("THRESHOLD_AMOUNT", "6000"))
+
+    # 帳本範圍：shared（所有聊天共用 GWORKSHEET）或 source（每個群組、聊天室、使用者各自一個工作表）
+    LEDGER_SCOPE = os.getenv("LEDGER_SCOPE", "shared")
+    # 保留已開啟的 worksheet handle 數量，以及閒置多少秒後丟棄
+    WORKSHEET_CACHE_SIZE = int(os.getenv("WORKSHEET_CACHE_SIZE", "128"))
+    WORKSHEET_IDLE_SECONDS = int(os.getenv("WORKSHEET_IDLE_SECONDS", "1800"))
+    # instance 啟動時在背景先建立 LINE / Sheets 客戶端並開啟工作表（需要可用的金鑰）
+    PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "false").lower() == "true"
+
+    # 改連到本機替身伺服器（benchmarks/fake_server.py），空值表示使用正式 API
+    GOOGLE_API_ENDPOINT = os.getenv("GOOGLE_API_ENDPOINT", "")
+    LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+    # 下載使用者上傳檔案（import）的 LINE API 位址
+    LINE_DATA_ENDPOINT = os.getenv("LINE_DATA_ENDPOINT", "https://api-data.line.me")
+
+    # Sheets API 每分鐘可用的請求數與可累積的上限，0 表示不限制速率（仍會重試）
+    SHEETS_QUOTA_PER_MINUTE = int(os.getenv("SHEETS_QUOTA_PER_MINUTE", "60"))
+    SHEETS_QUOTA_BURST = int(os.getenv("SHEETS_QUOTA_BURST", "10"))
+    # 每次 Sheets 呼叫（含排隊與重試）的最長秒數
+    SHEETS_RETRY_DEADLINE = float(os.getenv("SHEETS_RETRY_DEADLINE", "30"))
+
+    # import 每批新增的筆數（一批為一次 Sheets append 請求）
+    IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+
+    # clear 建立的備份快照最多保留幾份
+    BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "5"))
+
+    # 帳本快取的最長保存秒數，0 表示不使用快取
+    LEDGER_CACHE_MAX_AGE = int(os.getenv("LEDGER_CACHE_MAX_AGE", "300"))
+    # 記憶體中最多保留的帳本數，以及閒置多少秒後丟棄（每個來源一個帳本時避免無限增加）
+    LEDGER_CACHE_SIZE = int(os.getenv("LEDGER_CACHE_SIZE", "128"))
+    LEDGER_CACHE_IDLE_SECONDS = int(os.getenv("LEDGER_CACHE_IDLE_SECONDS", "1800"))
+
+    # 合併同時到達的 write 的時間窗（毫秒），0 表示不合併
+    WRITE_BATCH_WINDOW_MS = int(os.getenv("WRITE_BATCH_WINDOW_MS", "0"))
+
+    # G1 總和的維護方式：read_write（讀取後寫回）或 formula（試算表公式計算）
+    TOTAL_MODE = os.getenv("TOTAL_MODE", "read_write")
+
+    # 平行處理同一批 webhook 事件的 worker 數量
+    EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "4"))
+
+    # 略過 LINE 重送的事件：webhookEventId 保留的秒數與數量，DEDUP_PATH 設定時另存到 SQLite 檔案
+    DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+    DEDUP_MAX_EVENTS = int(os.getenv("DEDUP_MAX_EVENTS", "100000"))
+    DEDUP_PATH = os.getenv("DEDUP_PATH", "")
+
+    # 先回覆 webhook 再於背景處理指令（需要常駐 CPU 的環境，例如 Cloud Run）
+    ASYNC_ACK = os.getenv("ASYNC_ACK", "false").lower() == "true"
+    ASYNC_ACK_WORKERS = int(os.getenv("ASYNC_ACK_WORKERS", "2"))
+
+    # ASGI 模式（linebot_app.asgi）共用的 HTTP 連線池大小與每個請求的逾時秒數
+    ASYNC_HTTP_POOL_SIZE = int(os.getenv("ASYNC_HTTP_POOL_SIZE", "100"))
+    ASYNC_HTTP_TIMEOUT = float(os.getenv("ASYNC_HTTP_TIMEOUT", "30"))
+
+    # read p頁數 每頁顯示的筆數
+    READ_PAGE_SIZE = int(os.getenv("READ_PAGE_SIZE", "50"))
+
+    # report 排行榜顯示的名次數
+    REPORT_TOP_N = int(os.getenv("REPORT_TOP_N", "5"))
+
+    # export 檔案的存放目錄與下載連結的網址開頭（例如 https://example.com，連結為 /exports/檔名）
+    EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "linebot_exports"))
+    EXPORT_BASE_URL = os.getenv("EXPORT_BASE_URL", "")
+    # 設定時 export 檔案上傳到此 Cloud Storage bucket，回覆 signed URL（多個 instance 時使用）
+    EXPORT_BUCKET = os.getenv("EXPORT_BUCKET", "")
+    # 每次從試算表讀取的列數，以及匯出檔案保留的秒數
+    EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+    EXPORT_MAX_AGE = int(os.getenv("EXPORT_MAX_AGE", "3600"))
+
+    # 帳本儲存方式：sheets（直接讀寫試算表）或 sqlite（本機資料庫，試算表於背景同步）
+    LEDGER_BACKEND = os.getenv("LEDGER_BACKEND", "sheets")
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "ledger.sqlite3")
+    # 同時開啟的 SQLite 帳本數（每本一個連線與一個背景同步執行緒），超過時關閉最久沒用的
+    SQLITE_STORE_CACHE_SIZE = int(os.getenv("SQLITE_STORE_CACHE_SIZE", "32"))
+
+    # 記錄 Sheets / LINE API 呼叫與各階段時間，於 /metrics 輸出
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # 每個請求與指令結束時輸出一行 JSON trace
+    TRACE_LOG = os.getenv("TRACE_LOG", "false").lower() == "true"
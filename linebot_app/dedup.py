@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from linebot_app.config import Config
+
+
+class EventDeduplicator:
+    """記錄處理過的 webhookEventId，TTL 內再次收到同一個事件時略過
+
+    LINE 在我們回應太慢時會重送事件（deliveryContext.isRedelivery），
+    沒有這層檢查時 write 會把同一筆記帳寫入兩次、G1 也加兩次。
+    記憶體中最多保留 max_size 個 id；設定 path 時另存到 SQLite 檔案，
+    重新啟動或多個 process 共用同一個檔案時也能辨識重送。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS processed_events (
+        event_id TEXT PRIMARY KEY,
+        expires REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_processed_events_expires ON processed_events (expires);
+    """
+
+    # 每記錄幾個事件清理一次 SQLite 中過期的 id
+    PURGE_EVERY = 500
+
+    def __init__(self, ttl=86400, max_size=100000, path=None, clock=time.time):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._clock = clock
+        self._seen = OrderedDict()  # event id -> 到期時間，TTL 固定所以依到期順序排列
+        self._lock = threading.Lock()
+        self._claims = 0
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self.SCHEMA)
+
+    def _evict(self, now):
+        while self._seen:
+            event_id, expires = next(iter(self._seen.items()))
+            if expires > now and len(self._seen) <= self.max_size:
+                break
+            del self._seen[event_id]
+
+    def _claim_persisted(self, event_id, now):
+        cursor = self._conn.execute(
+            "INSERT INTO processed_events (event_id, expires) VALUES (?, ?) "
+            "ON CONFLICT (event_id) DO UPDATE SET expires = excluded.expires "
+            "WHERE processed_events.expires <= ?",
+            (event_id, now + self.ttl, now),
+        )
+        self._claims += 1
+        if self._claims % self.PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM processed_events WHERE expires <= ?", (now,))
+        return cursor.rowcount == 1
+
+    def claim(self, event_id):
+        """第一次看到 event_id（或已過期）時記錄並回傳 True，重送的事件回傳 False
+
+        沒有 id 的事件（舊版 webhook）一律回傳 True。處理失敗時要呼叫 release()。
+        """
+        if not event_id:
+            return True
+        with self._lock:
+            now = self._clock()
+            self._evict(now)
+            expires = self._seen.get(event_id)
+            if expires is not None and expires > now:
+                return False
+            if self._conn is not None and not self._claim_persisted(event_id, now):
+                self._seen[event_id] = now + self.ttl
+                return False
+            self._seen[event_id] = now + self.ttl
+            self._evict(now)
+            return True
+
+    def release(self, event_id):
+        """處理失敗時取消 claim，LINE 重送同一個事件時會再處理一次"""
+        if not event_id:
+            return
+        with self._lock:
+            self._seen.pop(event_id, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM processed_events WHERE event_id = ?", (event_id,))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._seen)
+
+
+deduplicator = EventDeduplicator(
+    ttl=Config.DEDUP_TTL_SECONDS, max_size=Config.DEDUP_MAX_EVENTS, path=Config.DEDUP_PATH or None,
+)
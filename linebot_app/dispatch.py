@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from linebot_app.config import Config
+
+
+class EventDispatcher:
+    """把一次 webhook 中的所有事件分派到有上限的 thread pool
+
+    key_func(event) 相同的事件（同一個帳本）會依原本順序在同一個工作中處理，
+    讓總和與列索引保持一致；key 為 None 的事件彼此獨立，可以任意平行。
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="linebot-event"
+            )
+        return self._executor
+
+    @staticmethod
+    def group(events, key_func):
+        """依 key 分組並保留每組內的原始順序"""
+        groups = {}
+        independent = []
+        for event in events:
+            key = key_func(event)
+            if key is None:
+                independent.append([event])
+            else:
+                groups.setdefault(key, []).append(event)
+        return list(groups.values()) + independent
+
+    @staticmethod
+    def _run_group(group, handle):
+        for event in group:
+            try:
+                handle(event)
+            except Exception as ex:
+                # 單一事件失敗不影響同一批的其他事件
+                print("事件處理失敗", ex)
+
+    def dispatch(self, events, key_func, handle):
+        """處理所有事件並等待完成"""
+        groups = self.group(events, key_func)
+        if len(groups) <= 1 or self.max_workers <= 1:
+            # 只有一組時直接在目前的執行緒處理，省去排程成本
+            for group in groups:
+                self._run_group(group, handle)
+            return
+        futures = [self.executor.submit(self._run_group, group, handle) for group in groups]
+        wait(futures)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+dispatcher = EventDispatcher(max_workers=Config.EVENT_WORKERS)
@@ -0,0 +1,175 @@
+import csv
+import mimetypes
+import os
+import secrets
+import time
+import zipfile
+from html import escape
+
+from linebot_app.columns import COL_NAME, COL_TIME, COL_TYPE
+from linebot_app.timeindex import day_key
+
+EXPORT_HEADER = ["時間", "人名", "品項", "分類", "費用"]
+FORMATS = ("csv", "xlsx")
+
+
+def row_filter(period=None, name=None, kind=None):
+    """回傳判斷一列是否符合日期區間、人名、分類的函式，沒有條件時回傳 None"""
+    if period is None and name is None and kind is None:
+        return None
+    start, end = (period[0].toordinal(), period[1].toordinal()) if period else (None, None)
+
+    def match(row):
+        if len(row) <= COL_TYPE:
+            return False
+        if name is not None and row[COL_NAME] != name:
+            return False
+        if kind is not None and row[COL_TYPE] != kind:
+            return False
+        if start is not None:
+            day = day_key(row[COL_TIME])
+            return day is not None and start <= day <= end
+        return True
+
+    return match
+
+
+def _padded(row):
+    row = list(row[:5])
+    return row + [""] * (5 - len(row))
+
+
+def write_csv(path, rows):
+    """逐列寫成 CSV（UTF-8 BOM，Excel 可直接開啟中文），回傳資料列數"""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_HEADER)
+        for row in rows:
+            writer.writerow(_padded(row))
+            count += 1
+    return count
+
+
+_XLSX_FILES = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="ledger" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _is_number(value):
+    return str(value).lstrip("-").replace(".", "", 1).isdigit()
+
+
+def _xlsx_row(number, row):
+    cells = []
+    for col, value in zip("ABCDE", row):
+        ref = f"{col}{number}"
+        # 金額寫成數字儲存格，才能在 Excel 直接加總
+        if col == "E" and number > 1 and _is_number(value):
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+            continue
+        cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{escape(str(value), quote=False)}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+
+def write_xlsx(path, rows):
+    """逐列寫成 XLSX，回傳資料列數
+
+    以 zipfile 直接寫出最小的 OOXML 結構，字串用 inline string，
+    不需要先收集 shared strings，工作表內容邊產生邊壓縮。
+    """
+    count = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_FILES.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(1, EXPORT_HEADER).encode("utf-8"))
+            for row in rows:
+                count += 1
+                sheet.write(_xlsx_row(count + 1, _padded(row)).encode("utf-8"))
+            sheet.write(b"</sheetData></worksheet>")
+    return count
+
+
+WRITERS = {"csv": write_csv, "xlsx": write_xlsx}
+
+
+def cleanup(directory, max_age):
+    """刪除超過 max_age 秒的匯出檔案"""
+    now = time.time()
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.startswith("ledger-") and now - entry.stat().st_mtime > max_age:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def export_rows(rows, directory, fmt="csv", max_age=3600):
+    """把 rows 寫入 directory 下的新檔案，回傳 (檔名, 資料列數)
+
+    檔名含隨機字串，下載連結無法被猜到；同時清掉過期的舊檔。
+    """
+    os.makedirs(directory, exist_ok=True)
+    cleanup(directory, max_age)
+    name = f"ledger-{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_urlsafe(12)}.{fmt}"
+    path = os.path.join(directory, name)
+    try:
+        count = WRITERS[fmt](path, rows)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return name, count
+
+
+def media_type(name):
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def read_export(directory, name):
+    """export 指令產生的檔案內容，不存在或檔名不合法時回傳 None"""
+    if not name.startswith("ledger-") or "/" in name or "\\" in name or ".." in name:
+        return None
+    try:
+        with open(os.path.join(directory, name), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
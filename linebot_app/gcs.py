@@ -0,0 +1,87 @@
+import hashlib
+import threading
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+GCS_HOST = "storage.googleapis.com"
+GCS_SCOPE = "https://www.googleapis.com/auth/devstorage.read_write"
+# V4 signed URL 的最長有效秒數（7 天）
+MAX_EXPIRES = 7 * 24 * 3600
+
+
+def _quote(text, safe=""):
+    return quote(text, safe=safe + "~")
+
+
+def signed_url(credentials, bucket, name, expires, now=None, host=GCS_HOST):
+    """以 service account 金鑰產生 GET 的 V4 signed URL，expires 秒內有效
+
+    credentials 需要 service_account_email 與 sign_bytes（google.oauth2.service_account.Credentials）。
+    """
+    now = now or datetime.now(timezone.utc)
+    stamp = now.strftime("%Y%m%dT%H%M%SZ")
+    scope = f"{stamp[:8]}/auto/storage/goog4_request"
+    path = f"/{_quote(bucket)}/{_quote(name, safe='/')}"
+    query = "&".join(f"{_quote(key)}={_quote(value)}" for key, value in sorted({
+        "X-Goog-Algorithm": "GOOG4-RSA-SHA256",
+        "X-Goog-Credential": f"{credentials.service_account_email}/{scope}",
+        "X-Goog-Date": stamp,
+        "X-Goog-Expires": str(max(1, min(expires, MAX_EXPIRES))),
+        "X-Goog-SignedHeaders": "host",
+    }.items()))
+    canonical = "\n".join(["GET", path, query, f"host:{host}\n", "host", "UNSIGNED-PAYLOAD"])
+    to_sign = "\n".join(["GOOG4-RSA-SHA256", stamp, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+    signature = credentials.sign_bytes(to_sign.encode()).hex()
+    return f"https://{host}{path}?{query}&X-Goog-Signature={signature}"
+
+
+class ExportBucket:
+    """把 export 檔案上傳到 Cloud Storage，回傳 signed URL
+
+    每個 instance 的 /tmp 互相看不到，下載請求不一定送到產生檔案的 instance，
+    所以有設定 bucket 時檔案改存 bucket；連結以 service account 金鑰簽章，bucket 不必公開。
+    過期的檔案請在 bucket 設定 lifecycle 規則刪除。
+    """
+
+    def __init__(self, bucket, service_file, session=None, credentials=None):
+        self.bucket = bucket
+        self.service_file = service_file
+        self._session = session
+        self._credentials = credentials
+        self._lock = threading.Lock()
+
+    @property
+    def credentials(self):
+        with self._lock:
+            if self._credentials is None:
+                from google.oauth2 import service_account
+
+                self._credentials = service_account.Credentials.from_service_account_file(
+                    self.service_file, scopes=[GCS_SCOPE]
+                )
+            return self._credentials
+
+    @property
+    def session(self):
+        credentials = self.credentials
+        with self._lock:
+            if self._session is None:
+                from google.auth.transport.requests import AuthorizedSession
+
+                self._session = AuthorizedSession(credentials)
+            return self._session
+
+    def upload(self, path, name, content_type="application/octet-stream"):
+        """以 JSON API 的 media upload 上傳單一檔案"""
+        with open(path, "rb") as f:
+            response = self.session.post(
+                f"https://{GCS_HOST}/upload/storage/v1/b/{_quote(self.bucket)}/o",
+                params={"uploadType": "media", "name": name},
+                data=f, headers={"Content-Type": content_type}, timeout=60,
+            )
+        response.raise_for_status()
+
+    def publish(self, path, name, expires, content_type="application/octet-stream"):
+        """上傳檔案並回傳 expires 秒內有效的下載連結"""
+        self.upload(path, name, content_type)
+        return signed_url(self.credentials, self.bucket, name, expires)
@@ -0,0 +1,100 @@
+import codecs
+import csv
+from datetime import datetime
+
+from linebot_app.totals import TIMESTAMP_FORMAT
+
+# 可省略秒數或時間的日期格式
+TIME_FORMATS = (TIMESTAMP_FORMAT, "%Y-%m-%d %H:%M", "%Y-%m-%d")
+# 匯入檔案的第一列若是標題列則略過
+HEADER_FIELDS = {"時間", "人名", "名字"}
+
+
+def iter_lines(chunks, encoding="utf-8-sig"):
+    """把檔案內容的 bytes 區塊逐行解碼，不需要一次載入整個檔案"""
+    pending = ""
+    for text in codecs.iterdecode(chunks, encoding):
+        pending += text
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def _split(line):
+    """有逗號或 tab 時以 CSV 解析，否則以空白分隔"""
+    for delimiter in (",", "\t"):
+        if delimiter in line:
+            return [field.strip() for field in next(csv.reader([line], delimiter=delimiter))]
+    return line.split()
+
+
+def _normalize_time(text):
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"時間格式錯誤: {text}")
+
+
+def parse_row(fields, timestamp):
+    """把欄位轉成 [時間, 人名, 品項, 分類, 金額]，格式錯誤時拋出 ValueError
+
+    4 欄為 名字 品項 分類 金額（時間為匯入時間），5 欄在前面加上時間，
+    以空白分隔時日期與時間可能分成兩欄，共 6 欄。
+    """
+    if len(fields) == 6:
+        fields = [f"{fields[0]} {fields[1]}"] + fields[2:]
+    if len(fields) == 4:
+        row = [timestamp] + fields
+    elif len(fields) == 5:
+        row = [_normalize_time(fields[0])] + fields[1:]
+    else:
+        raise ValueError("欄位數量錯誤，格式：[時間] 名字 品項 分類 金額")
+    if not all(row):
+        raise ValueError("欄位不可為空白")
+    # 與 write 相同的金額檢查
+    try:
+        float(row[4])
+    except ValueError:
+        raise ValueError(f"金額格式錯誤: {row[4]}")
+    return row
+
+
+class ImportParser:
+    """逐行解析匯入內容，每累積 chunk_size 筆有效資料就產生一批
+
+    格式錯誤的行記錄在 errors（行號, 內容, 原因），解析結束後一起回報。
+    """
+
+    def __init__(self, timestamp, chunk_size=500):
+        self.timestamp = timestamp
+        self.chunk_size = max(1, chunk_size)
+        self.count = 0
+        self.amount = 0.0
+        self.errors = []
+
+    def chunks(self, lines):
+        chunk = []
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            fields = _split(line)
+            if number == 1 and fields[0] in HEADER_FIELDS:
+                continue
+            try:
+                row = parse_row(fields, self.timestamp)
+            except ValueError as ex:
+                self.errors.append((number, line, str(ex)))
+                continue
+            chunk.append(row)
+            self.count += 1
+            self.amount += float(row[4])
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
@@ -0,0 +1,378 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from linebot_app.columns import COL_AMOUNT, COL_NAME, COL_TIME, COL_TYPE, to_cents
+from linebot_app.compact import MISSING, CompactLedger, day_of
+from linebot_app.config import Config
+from linebot_app.timeindex import DaySeries, day_key
+
+
+class LedgerIndex:
+    """每個人名、每個分類的累計金額與分類集合
+
+    一次掃描建立，之後隨每筆新增/刪除增量更新，
+    讓 sum 名字、type 分類、type 的查詢不受帳本列數影響。
+    另外依時間欄的日期維護每個人名、分類的 DaySeries，
+    日期區間的查詢只需 bisect，時間字串只在建立索引時解析一次。
+    """
+
+    def __init__(self):
+        self.totals_by_name = {}
+        self.totals_by_type = {}
+        # 分類出現次數，歸零時從分類集合移除
+        self.type_counts = {}
+        # 金額無法解析的列數，查詢時沿用原本回報錯誤的行為
+        self.invalid_by_name = {}
+        self.invalid_by_type = {}
+        # 人名、分類 -> DaySeries
+        self.days_by_name = {}
+        self.days_by_type = {}
+
+    @classmethod
+    def build(cls, rows):
+        """由含標題列的所有列建立索引"""
+        if isinstance(rows, CompactLedger):
+            return cls.from_compact(rows)
+        index = cls()
+        for row in rows[1:]:  # 跳過標題列
+            index.add(row)
+        return index
+
+    @classmethod
+    def from_compact(cls, ledger):
+        """直接在 CompactLedger 的整數欄位上加總，最後才把代碼換回字串"""
+        # 每個 tuple 依序為人名、分類，dict 的 key 為字串代碼
+        counts, totals, invalid, days = {}, ({}, {}), ({}, {}), ({}, {})
+        for stamp, name, kind, cents in zip(ledger.stamps, ledger.names, ledger.kinds, ledger.cents):
+            if kind >= 0:
+                counts[kind] = counts.get(kind, 0) + 1
+            for side, code in ((0, name), (1, kind)):
+                if code < 0:
+                    continue
+                if cents == MISSING:
+                    invalid[side][code] = invalid[side].get(code, 0) + 1
+                    continue
+                totals[side][code] = totals[side].get(code, 0) + cents
+                if stamp != MISSING:
+                    by_day = days[side].get(code)
+                    if by_day is None:
+                        by_day = days[side][code] = {}
+                    day = day_of(stamp)
+                    by_day[day] = by_day.get(day, 0) + cents
+
+        strings = ledger.table.strings
+        index = cls()
+        index.type_counts = {strings[code]: count for code, count in counts.items()}
+        index.totals_by_name, index.totals_by_type = (
+            {strings[code]: cents for code, cents in side.items() if cents} for side in totals
+        )
+        index.invalid_by_name, index.invalid_by_type = (
+            {strings[code]: count for code, count in side.items()} for side in invalid
+        )
+        for side, target in zip(days, (index.days_by_name, index.days_by_type)):
+            for code, by_day in side.items():
+                series = DaySeries.from_totals(by_day)
+                if series.days:
+                    target[strings[code]] = series
+        return index
+
+    @staticmethod
+    def _bump(counter, key, delta):
+        value = counter.get(key, 0) + delta
+        if value:
+            counter[key] = value
+        else:
+            counter.pop(key, None)
+
+    def _apply(self, row, sign):
+        if not row:
+            return
+        name = row[COL_NAME] if len(row) > COL_NAME else None
+        kind = row[COL_TYPE] if len(row) > COL_TYPE else None
+        if kind is not None:
+            self._bump(self.type_counts, kind, sign)
+        cents = to_cents(row[COL_AMOUNT]) if len(row) > COL_AMOUNT else None
+        if cents is None:
+            if name is not None:
+                self._bump(self.invalid_by_name, name, sign)
+            if kind is not None:
+                self._bump(self.invalid_by_type, kind, sign)
+            return
+        if name is not None:
+            self._bump(self.totals_by_name, name, sign * cents)
+        if kind is not None:
+            self._bump(self.totals_by_type, kind, sign * cents)
+        day = day_key(row[COL_TIME])
+        if day is None:
+            return
+        for series_by, key in ((self.days_by_name, name), (self.days_by_type, kind)):
+            if key is not None:
+                series = series_by.get(key)
+                if series is None:
+                    series = series_by[key] = DaySeries()
+                series.add(day, sign * cents)
+                if not series.days:
+                    del series_by[key]
+
+    def add(self, row):
+        self._apply(row, 1)
+
+    def remove(self, row):
+        self._apply(row, -1)
+
+    def total(self, target, kind="sum", period=None):
+        """回傳 (總金額, 是否有金額格式錯誤的列)，kind 為 sum（人名）或 type（分類）
+
+        period 為含頭尾的 (start, end) date 時只加總該日期區間。
+        """
+        if kind == "sum":
+            totals, invalid, days = self.totals_by_name, self.invalid_by_name, self.days_by_name
+        else:
+            totals, invalid, days = self.totals_by_type, self.invalid_by_type, self.days_by_type
+        if period is None:
+            cents = totals.get(target)
+        else:
+            series = days.get(target)
+            cents = series.total(period[0].toordinal(), period[1].toordinal()) if series else None
+        total = cents / 100 if cents else 0
+        return total, target in invalid
+
+    def summary(self, period):
+        """日期區間內每個人名與每個分類的合計，回傳兩個 {名稱: 金額} dict（只含非零的項目）"""
+        start, end = period[0].toordinal(), period[1].toordinal()
+        result = []
+        for days in (self.days_by_name, self.days_by_type):
+            totals = {}
+            for key, series in days.items():
+                cents = series.total(start, end)
+                if cents:
+                    totals[key] = cents / 100
+            result.append(totals)
+        return tuple(result)
+
+    def types(self):
+        """回傳排序後的分類清單"""
+        return sorted(self.type_counts)
+
+    def diff(self, other):
+        """回傳與另一份索引不一致的欄位名稱，一致時為空 list"""
+        fields = [
+            "totals_by_name", "totals_by_type", "type_counts", "invalid_by_name", "invalid_by_type",
+            "days_by_name", "days_by_type",
+        ]
+        return [field for field in fields if getattr(self, field) != getattr(other, field)]
+
+
+class CachedLedger:
+    """單一工作表在記憶體中的副本，以 CompactLedger 保存"""
+
+    def __init__(self, rows, version, index=None):
+        self.rows = CompactLedger(rows)
+        self.loaded_at = self.used_at = time.monotonic()
+        # 每次內容變動就換成新的版本號，讓其他快取判斷是否過期
+        self.version = version
+        # 第一次查詢時才建立的 LedgerIndex
+        self._index = index
+        # 已渲染的回覆內容（例如 read 的分頁），帳本變動時清空
+        self.rendered = {}
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = LedgerIndex.build(self.rows)
+        return self._index
+
+    def index_add(self, row):
+        if self._index is not None:
+            self._index.add(row)
+
+    def index_remove(self, row):
+        if self._index is not None:
+            self._index.remove(row)
+
+
+class LedgerCache:
+    """process 層級的帳本快取，以 (spreadsheet, worksheet) 為 key
+
+    第一次讀取時從 Google Sheets 載入，之後由本程式的
+    write/delete/update/clear/revert 直接更新記憶體中的副本；
+    超過 max_age 秒就強制重新載入，以涵蓋直接在試算表上的修改。
+    與 WorksheetCache 相同依最近使用順序保存，超過 max_size 個或閒置超過 idle_seconds 的帳本會被丟棄。
+    """
+
+    def __init__(self, max_age=300, max_size=128, idle_seconds=1800):
+        self.max_age = max_age
+        self.max_size = max(1, max_size)
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._versions = itertools.count()
+        # 最近一次 invalidate（或修改未載入的帳本）時的版本號，在那之前開始的載入不放進快取
+        self._invalidated = -1
+
+    def _is_stale(self, entry):
+        return self.max_age is not None and time.monotonic() - entry.loaded_at > self.max_age
+
+    def _get(self, key):
+        """回傳 key 的快取並標記為最近使用，沒有時回傳 None（呼叫端需持有 _lock）"""
+        now = time.monotonic()
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if now - oldest.used_at <= self.idle_seconds:
+                break
+            self._entries.popitem(last=False)
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.used_at = now
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        """放入快取，超過 max_size 時丟棄最久沒用的（呼叫端需持有 _lock）"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _entry(self, key, loader):
+        with self._lock:
+            entry = self._get(key)
+            if entry is not None and not self._is_stale(entry):
+                return entry
+            started = next(self._versions)
+        # 讀取整份試算表時不持有 lock，其他帳本的讀寫不必等待
+        rows = loader()
+        with self._lock:
+            entry = self._get(key)
+            if entry is not None and entry.version > started:
+                # 載入期間已有更新的內容（其他執行緒載入、replace 或寫入），沿用它
+                return entry
+            entry = CachedLedger(rows, next(self._versions))
+            if self._invalidated < started:
+                self._put(key, entry)
+            return entry
+
+    def rows(self, key, loader):
+        """回傳帳本所有列的副本（CompactLedger），必要時呼叫 loader() 重新載入"""
+        entry = self._entry(key, loader)
+        with self._lock:
+            return entry.rows.copy()
+
+    def peek(self, key):
+        """帳本已載入且未過期時回傳所有列的副本，否則回傳 None（不會載入）"""
+        with self._lock:
+            entry = self._get(key)
+            if entry is None or self._is_stale(entry):
+                return None
+            return entry.rows.copy()
+
+    def index(self, key, loader):
+        """回傳帳本的 LedgerIndex，必要時呼叫 loader() 重新載入"""
+        entry = self._entry(key, loader)
+        with self._lock:
+            return entry.index
+
+    def rebuild_index(self, key):
+        """以快取中的列重新建立索引"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry._index = LedgerIndex.build(entry.rows)
+
+    def verify_index(self, key, loader):
+        """重新讀取試算表並比對索引，回傳不一致的欄位
+
+        不一致時以試算表的內容取代快取，之後的查詢會使用正確的索引。
+        """
+        rows = loader()
+        fresh = LedgerIndex.build(rows)
+        with self._lock:
+            entry = self._entries.get(key)
+            mismatches = entry.index.diff(fresh) if entry is not None else []
+            if mismatches:
+                self._put(key, CachedLedger(rows, next(self._versions), fresh))
+            return mismatches
+
+    def rendered(self, key, spec, render):
+        """回傳快取的渲染結果，帳本變動前重複使用；沒有快取時呼叫 render()"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_stale(entry):
+                entry, version = None, None
+            elif spec in entry.rendered:
+                return entry.rendered[spec]
+            else:
+                version = entry.version
+        result = render()
+        with self._lock:
+            # render() 期間帳本沒有變動才保存
+            if entry is not None and self._entries.get(key) is entry and entry.version == version:
+                entry.rendered[spec] = result
+        return result
+
+    def version(self, key):
+        """回傳帳本目前的版本，尚未載入時回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.version if entry else None
+
+    def _mutate(self, key, func):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # 載入中的內容可能不含這次修改，不放進快取
+                self._invalidated = next(self._versions)
+                return
+            func(entry)
+            entry.version = next(self._versions)
+            entry.rendered.clear()
+
+    def append(self, key, rows):
+        """在帳本末端加入多列"""
+        def _append(entry):
+            for row in rows:
+                entry.rows.append(row)
+                entry.index_add(row)
+        self._mutate(key, _append)
+
+    def delete(self, key, index):
+        """刪除索引 index 的列（index 與 read 顯示的索引相同）"""
+        def _delete(entry):
+            if 0 < index < len(entry.rows):
+                entry.index_remove(entry.rows.pop(index))
+        self._mutate(key, _delete)
+
+    def update(self, key, index, row):
+        """以新資料取代索引 index 的列"""
+        def _update(entry):
+            if 0 < index < len(entry.rows):
+                entry.index_remove(entry.rows[index])
+                entry.rows[index] = row
+                entry.index_add(row)
+        self._mutate(key, _update)
+
+    def set_total(self, key, total):
+        """同步標題列 G1 的總和"""
+        self._mutate(key, lambda entry: entry.rows.set_total(total))
+
+    def replace(self, key, rows):
+        """整份帳本被覆寫（clear/revert）時直接換成新內容"""
+        with self._lock:
+            self._put(key, CachedLedger(rows, next(self._versions)))
+
+    def invalidate(self, key=None):
+        """丟棄快取，下次讀取時重新載入"""
+        with self._lock:
+            self._invalidated = next(self._versions)
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+ledger_cache = LedgerCache(
+    max_age=Config.LEDGER_CACHE_MAX_AGE, max_size=Config.LEDGER_CACHE_SIZE,
+    idle_seconds=Config.LEDGER_CACHE_IDLE_SECONDS,
+)
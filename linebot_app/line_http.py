@@ -0,0 +1,33 @@
+import requests
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+
+class SessionHttpClient(RequestsHttpClient):
+    """共用同一個 requests.Session 的 HttpClient，讓 LINE API 重複使用連線"""
+
+    session = requests.Session()
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = self.session.get(
+            url, headers=headers, params=params, stream=stream,
+            timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = self.session.post(
+            url, headers=headers, data=data, timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        response = self.session.delete(
+            url, headers=headers, data=data, timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        response = self.session.put(
+            url, headers=headers, data=data, timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
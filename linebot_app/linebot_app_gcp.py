@@ -1,19 +1,88 @@
-import json
+import itertools
 import os
 import sys
+import threading
 from datetime import datetime, timedelta, timezone
 
-import pygsheets
-from flask import Flask, request
-from linebot import LineBotApi, WebhookHandler
-from linebot.models import TextSendMessage
 
-from linebot_app.config import Config
+from linebot_app.background import background
+from linebot_app.batching import write_batcher
+from linebot_app.clients import is_invalid_handle, registry
+from linebot_app.columns import COL_AMOUNT, COL_ITEM, COL_NAME, COL_TIME, COL_TYPE
+from linebot_app.dedup import deduplicator
+from linebot_app.dispatch import dispatcher
+from linebot_app.export import FORMATS, export_rows, media_type, read_export, row_filter
+from linebot_app.importer import ImportParser, iter_lines
+from linebot_app.ledger import ledger_cache
+from linebot_app.messages import TextSendMessage, split_text
+from linebot_app.report import LedgerColumns, render_report
+from linebot_app.quota import QuotaExceeded, WriteUncertain, bulk, scheduler
+from linebot_app.metrics import SHEETS_WRAP, metrics
+from linebot_app.sources import config_for, worksheet_title
+from linebot_app.webhook import is_import_file, is_text
+from linebot_app.timeindex import month_period, parse_period
+from linebot_app.store import (
+    HEADER, BackupNotFound, LedgerStore, PartialImport, SheetsLedgerStore, format_total, open_store,
+)
+from linebot_app.totals import FormulaTotals
+
+# 寫入時連線中斷，無法確定試算表是否已套用
+WRITE_UNCERTAIN_TEXT = "無法確認是否已寫入，請先以 read 確認再重試"
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def create_app():
+    """本機與 Cloud Run 使用的 Flask app
+
+    Cloud Functions 直接呼叫 linebot(request)，不需要建立 app，
+    所以 flask 在第一次存取 app 時才載入。
+    """
+    from flask import Flask, request
+
+    app = Flask(__name__)
+
+    @app.route("/", methods=["POST"])
+    def callback():
+        return linebot(request)
+
+    @app.route("/queue", methods=["GET"])
+    def queue_status():
+        """async-ack 模式的佇列深度與處理延遲"""
+        return background.stats()
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_route():
+        """Prometheus 格式的 API 呼叫與處理階段統計"""
+        return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    @app.route("/exports/<name>", methods=["GET"])
+    def export_file(name):
+        """export 指令產生的檔案（檔名含隨機字串）"""
+        return export_response(name)
+
+    return app
+
+
+def __getattr__(name):
+    # linebot_app_gcp.app 在第一次存取時才建立
+    global _app
+    if name == "app":
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def export_response(name):
+    """回傳下載 export 檔案的 (內容, 狀態碼, headers)，找不到時為 404"""
+    data = read_export(registry.config.EXPORT_DIR, name)
+    if data is None:
+        return "Not Found", 404
+    return data, 200, {"Content-Type": media_type(name), "Content-Disposition": f'attachment; filename="{name}"'}
 
-app = Flask(__name__)
-@app.route("/", methods=["POST"])
-def callback():
-    return linebot(request)
 
 def linebot(request):
     """Responds to any HTTP request.
@@ -24,83 +93,253 @@ def linebot(request):
         Response object using
         `make_response <http://flask.pocoo.org/docs/1.0/api/#flask.Flask.make_response>`.
     """
-    
+    if request.method == "GET" and request.path.startswith("/exports/"):
+        # Cloud Functions 只有這個進入點，沒有設定 EXPORT_BUCKET 時的下載連結也在這裡處理
+        return export_response(request.path[len("/exports/"):])
+
+    events = []
     try:
-        config = Config()
-        line_bot_api = LineBotApi(config.LINE_CHANNEL_ACCESS_TOKEN)
-        handler = WebhookHandler(config.LINE_CHANNEL_SECRET)
-
-        # get X-Line-Signature header value
-        signature = request.headers["X-Line-Signature"]
-        # get request body as text
-        body = request.get_data(as_text=True)
-        body_json = json.loads(body)
-        
-        # 驗證並處理 webhook
-        handler.handle(body, signature)
-        
-        # 提取訊息和回覆 token
-        msg = body_json["events"][0]["message"]["text"]
-        tk = body_json["events"][0]["replyToken"]
-        print(msg, tk)
+        config = registry.config
+        line_bot_api = registry.line_bot_api
+        parser = registry.parser
 
-        if msg != "":
-            try:
-                gc = pygsheets.authorize(service_file=config.GDRIVE_JSON)
-                wks = gc.open(config.GSPREADSHEET).worksheet_by_title(config.GWORKSHEET)
-            except Exception as ex:
-                print("無法連線google sheet", ex)
-                sys.exit(1)
+        with metrics.request(config.TRACE_LOG) as trace:
+            # get X-Line-Signature header value
+            signature = request.headers["X-Line-Signature"]
+            # get request body as raw bytes
+            body = request.get_data()
 
-            bo = BotOperation(wks, line_bot_api, msg, tk, config)
-            try:
-                op = msg.lstrip().split(" ", 1)[0]
-                bo.execute_command(op)
-            except KeyError:
-                line_bot_api.reply_message(tk, TextSendMessage(text="不支援的指令"))
-            except Exception as ex:
-                print(ex)
-                line_bot_api.reply_message(tk, TextSendMessage(text="指令執行失敗"))
+            # 以原始 bytes 驗證簽章，並只解析一次成 LineEvent
+            # 只處理文字訊息與可匯入的檔案，其他事件（加入好友、貼圖等）直接略過
+            with metrics.phase("verify"):
+                events = [
+                    event for event in parser.parse(body, signature)
+                    if is_text(event) or is_import_file(event)
+                ]
+            events = drop_duplicates(events)
+
+            if events and config.ASYNC_ACK:
+                # 先回覆 LINE，指令交給背景 worker 執行（worksheet 於背景取得）
+                background.submit(
+                    events,
+                    lambda event: ledger_key_for(event, config),
+                    lambda event: handle_event(event, None, line_bot_api, config, trace),
+                )
+            elif events:
+                # 每個來源各自一個帳本時，由 handle_event 從 worksheet 快取取得
+                wks = None
+                if config.LEDGER_SCOPE != "source":
+                    try:
+                        # 同一批事件共用同一個 worksheet handle
+                        with metrics.phase("auth"):
+                            wks = registry.worksheet()
+                    except Exception as ex:
+                        print("無法連線google sheet", ex)
+                        # 回覆錯誤讓 LINE 重送，重送的事件不能被當成已處理
+                        release_claims(events)
+                        sys.exit(1)
+
+                dispatcher.dispatch(
+                    events,
+                    lambda event: ledger_key_for(event, config),
+                    lambda event: handle_event(event, wks, line_bot_api, config, trace),
+                )
     except Exception as ex:
         print(request.args)
         print(ex)
+        release_claims(events)
         sys.exit(1)
 
     return "OK"
 
 
+def drop_duplicates(events):
+    """略過已處理過的事件（LINE 重送），只回覆 OK 不再執行指令"""
+    fresh = []
+    for event in events:
+        if deduplicator.claim(event.webhook_event_id):
+            fresh.append(event)
+        else:
+            print("略過重送的事件", event.webhook_event_id)
+            metrics.inc("linebot_duplicate_events_total", redelivery=str(bool(event.is_redelivery)).lower())
+    return fresh
+
+
+def release_claims(events):
+    """事件沒有處理完成，取消 drop_duplicates 的記錄，LINE 重送時再處理"""
+    for event in events:
+        deduplicator.release(event.webhook_event_id)
+
+
+def ledger_key_for(event, config):
+    """事件會用到的帳本，不需要讀寫帳本的指令回傳 None（可任意平行）"""
+    op = command_of(event.text)
+    if op in BotOperation.LEDGER_FREE_COMMANDS:
+        return None
+    return (config.GSPREADSHEET, worksheet_title(config, event.source_id))
+
+
+def command_of(msg):
+    """訊息的第一個字為指令（import 的資料可能從下一行開始）"""
+    words = msg.split(None, 1)
+    return words[0] if words else ""
+
+
+def handle_event(event, wks, line_bot_api, config, parent=None):
+    """執行單一文字訊息事件的指令並回覆，wks 為 None 時才取得 worksheet"""
+    config = config_for(event, config)
+    # 提取訊息和回覆 token，上傳的檔案視為 import 指令
+    msg = "import" if is_import_file(event) else event.text
+    tk = event.reply_token
+    print(msg, tk)
+
+    op = command_of(msg)
+    # 指令以外的訊息歸為 unknown，避免 metrics label 無限增加
+    command = op if op in BotOperation.COMMANDS else "unknown"
+    with metrics.command(command, parent, config.TRACE_LOG) as trace:
+        line_bot_api = metrics.instrument(line_bot_api, "line")
+        store = None
+        try:
+            if wks is None:
+                with metrics.phase("auth"):
+                    wks = registry.worksheet(config.GWORKSHEET)
+            # 每次 Sheets 呼叫都經過配額排程與重試，metrics 記錄的是每一次實際送出的請求
+            wks = scheduler.wrap(metrics.instrument(wks, "sheets", **SHEETS_WRAP))
+            cache = ledger_cache if config.LEDGER_CACHE_MAX_AGE > 0 else None
+            batcher = write_batcher if config.WRITE_BATCH_WINDOW_MS > 0 else None
+            store = open_store(wks, config)
+            bo = BotOperation(
+                store, line_bot_api, msg, tk, config, cache=cache, batcher=batcher,
+                message_id=event.message_id if is_import_file(event) else None,
+            )
+            bo.execute_command(op)
+        except KeyError:
+            trace.status = "unsupported"
+            line_bot_api.reply_message(tk, TextSendMessage(text="不支援的指令"))
+        except QuotaExceeded as ex:
+            print(ex)
+            trace.status = "throttled"
+            deduplicator.release(event.webhook_event_id)
+            line_bot_api.reply_message(tk, TextSendMessage(text="試算表忙碌中，請稍後再試"))
+        except WriteUncertain as ex:
+            print(ex)
+            trace.status = "error"
+            # 試算表可能已套用這次的修改，快取改為重新載入
+            ledger_cache.invalidate((config.GSPREADSHEET, config.GWORKSHEET))
+            line_bot_api.reply_message(tk, TextSendMessage(text=WRITE_UNCERTAIN_TEXT))
+        except Exception as ex:
+            print(ex)
+            trace.status = "error"
+            # 指令沒有完成，同一個事件重送時要再處理
+            deduplicator.release(event.webhook_event_id)
+            if is_invalid_handle(ex):
+                # 工作表已被刪除或改名，下一次請求重新開啟
+                registry.invalidate_worksheet(config.GWORKSHEET)
+                ledger_cache.invalidate((config.GSPREADSHEET, config.GWORKSHEET))
+            line_bot_api.reply_message(tk, TextSendMessage(text="指令執行失敗"))
+        finally:
+            if store is not None:
+                store.release()
+
+
 class BotOperation:
-    # 表單欄位索引常量
-    COL_TIME = 0
-    COL_NAME = 1
-    COL_ITEM = 2
-    COL_TYPE = 3
-    COL_AMOUNT = 4
+    # 表單欄位索引常量（定義在 columns.py）
+    COL_TIME = COL_TIME
+    COL_NAME = COL_NAME
+    COL_ITEM = COL_ITEM
+    COL_TYPE = COL_TYPE
+    COL_AMOUNT = COL_AMOUNT
+
+    # 不會讀寫帳本的指令，可以與其他事件平行處理
+    LEDGER_FREE_COMMANDS = {"display", "指令"}
+    # 所有支援的指令，用於 metrics 的 command label
+    COMMANDS = {"read", "display", "write", "import", "sum", "type", "month", "report", "export", "delete", "clear", "revert", "update", "指令"}
     
-    def __init__(self, wks, line_bot_api, msg, tk, config):
-        self.wks = wks
+    def __init__(self, store, line_bot_api, msg, tk, config, cache=None, batcher=None, message_id=None):
+        # store 可以是 LedgerStore，或直接傳入 pygsheets worksheet
+        if not isinstance(store, LedgerStore):
+            totals = FormulaTotals(store) if config.TOTAL_MODE == "formula" else None
+            store = SheetsLedgerStore(
+                store, totals=totals, backup_title=f"{config.GWORKSHEET}_backup", keep=config.BACKUP_KEEP
+            )
+        self.store = store
         self.api = line_bot_api
         self.msg = msg
         self.tk = tk
         self.config = config
+        # process 層級的帳本快取（LedgerCache），None 表示每次都讀取試算表
+        self.cache = cache
+        self.ledger_key = (config.GSPREADSHEET, config.GWORKSHEET)
+        # 合併同時到達的 write（WriteBatcher），None 表示每次直接寫入
+        self.batcher = batcher
+        # 使用者上傳檔案的 message id（import 指令下載內容用）
+        self.message_id = message_id
 
     def _get_all_values(self):
-        """獲取所有非空值"""
-        return self.wks.get_all_values(
-            include_tailing_empty_rows=False, 
-            include_tailing_empty=False
-        )
+        """獲取所有非空值，有快取時優先使用快取"""
+        if self.cache is not None:
+            return self.cache.rows(self.ledger_key, self._load_all_values)
+        return self._load_all_values()
+
+    def _load_all_values(self):
+        """從儲存層讀取所有非空值"""
+        return self.store.all_values()
 
-    def read(self):
-        all_values = self._get_all_values()
-        sub_content = [
+    def _sync_cache(self, action, *args):
+        """將本次對試算表的修改同步到帳本快取"""
+        if self.cache is not None:
+            getattr(self.cache, action)(self.ledger_key, *args)
+
+    def _format_row(self, i, row):
+        row = list(row) + [""] * (5 - len(row))
+        return (
             f"{i}  {row[self.COL_TIME]:<3s}  {row[self.COL_NAME]:<3s}  "
             f"{row[self.COL_ITEM]:<3s}  {row[self.COL_TYPE]:<3s}  "
             f"{row[self.COL_AMOUNT]:<3s}"
-            for i, row in enumerate(all_values)
-        ]
-        content = "\n".join(sub_content)
-        self.api.reply_message(self.tk, TextSendMessage(text=content))
+        )
+
+    def _read_rows(self, last=None, page=None):
+        """回傳要顯示的 (索引, 列)，分頁或最後 N 筆時只讀取該範圍"""
+        size = self.config.READ_PAGE_SIZE
+        if self.cache is not None or (last is None and page is None):
+            all_values = self._get_all_values()
+            if last is not None:
+                start, end = max(1, len(all_values) - last), len(all_values)
+            elif page is not None:
+                start = (page - 1) * size + 1
+                end = min(start + size, len(all_values))
+            else:
+                start, end = 0, len(all_values)
+            return list(enumerate(all_values[start:end], start))
+
+        if last is not None:
+            row_count = self.store.row_count()
+            start, end = max(1, row_count - last), row_count
+        else:
+            start = (page - 1) * size + 1
+            end = start + size
+        values = self.store.get_rows(start, end)
+        return [(start + k, row) for k, row in enumerate(values)]
+
+    def _render_read(self, last=None, page=None):
+        rows = self._read_rows(last, page)
+        if not rows:
+            return [f"沒有第 {page} 頁" if page is not None else "表單為空"]
+        lines = [self._format_row(i, row) for i, row in rows]
+        hint = "...內容過長，請使用 read 筆數 或 read p頁數"
+        return split_text(lines, overflow_hint=hint)
+
+    def read(self, last=None, page=None):
+        """讀取資料，last 為最後 N 筆，page 為第幾頁（每頁 READ_PAGE_SIZE 筆）"""
+        if self.cache is not None:
+            # 帳本沒有變動前重複使用已渲染的結果
+            texts = self.cache.rendered(
+                self.ledger_key, ("read", last, page), lambda: self._render_read(last, page)
+            )
+        else:
+            texts = self._render_read(last, page)
+        messages = [TextSendMessage(text=text) for text in texts]
+        self.api.reply_message(self.tk, messages[0] if len(messages) == 1 else messages)
 
     def display(self, url):
         self.api.reply_message(self.tk, [TextSendMessage(text="完整表單"), TextSendMessage(text=url)])
@@ -154,13 +393,11 @@ class BotOperation:
         
 
         
-        # 寫入資料
-        self.wks.append_table(values=content)
-        
-        # 更新總和
-        current_total = float(self.wks.cell("G1").value or 0)
-        new_total = current_total + total_this_time
-        self.wks.update_value("G1", new_total)
+        if self.batcher is not None:
+            # 與同時間其他 write 合併寫入，拿回寫入本次資料後的總和
+            new_total = self.batcher.submit(self.ledger_key, content, total_this_time, self._append_rows)
+        else:
+            new_total = self._append_rows(content, total_this_time)
         
         # 回覆訊息
         success_text = "\n".join(success_log)
@@ -173,118 +410,272 @@ class BotOperation:
         
         self.api.reply_message(self.tk, messages)
 
-    def ssum(self, target, kind="sum"):
-        all_values = self._get_all_values()
-        
-        if kind == "sum":
-            idx = self.COL_NAME
-        elif kind == "type":
-            idx = self.COL_TYPE
-        else:
+    def bulk_import(self, lines):
+        """匯入多筆資料：逐行解析，有效的資料分批新增，總和只更新一次"""
+        dt_local = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
+        parser = ImportParser(dt_local.strftime("%Y-%m-%d %H:%M:%S"), self.config.IMPORT_CHUNK_SIZE)
+        # 只有帳本已在快取時才保留匯入的列，之後同步到快取；否則逐批寫入後就丟棄
+        cached = self.cache is not None and self.cache.version(self.ledger_key) is not None
+        imported = []
+
+        def chunks():
+            for chunk in parser.chunks(lines):
+                if cached:
+                    imported.append(chunk)
+                yield chunk
+
+        try:
+            new_total = self.store.import_rows(chunks())
+        except PartialImport as ex:
+            self._sync_cache("invalidate")
+            total = "總和可能不正確，請稍後再試一次" if ex.total is None else f"目前總和 {format_total(ex.total)} 元"
+            self.api.reply_message(self.tk, TextSendMessage(text=(
+                f"匯入中斷：已新增前 {ex.rows} 筆，共 {format_total(ex.amount)} 元，其餘未匯入\n"
+                f"{total}\n請以 read 確認後，只重新匯入尚未新增的資料"
+            )))
+            return
+        except Exception:
+            # 可能只新增了部分資料，快取改為重新載入
+            self._sync_cache("invalidate")
+            raise
+        if new_total is not None:
+            for chunk in imported:
+                self._sync_cache("append", chunk)
+            self._sync_cache("set_total", new_total)
+
+        report = [f"匯入成功 {parser.count} 筆，共 {format_total(parser.amount)} 元"]
+        if parser.errors:
+            report.append(f"以下 {len(parser.errors)} 行格式錯誤，未匯入：")
+            report += [f"第 {number} 行 {reason}：{line}" for number, line, reason in parser.errors]
+        messages = [TextSendMessage(text=text) for text in split_text(report, overflow_hint="...錯誤過多，僅顯示部分")]
+        if new_total is not None and new_total >= self.config.THRESHOLD_AMOUNT:
+            messages = messages[:4] + [TextSendMessage(text=f"目前已消費 {new_total} 元已超過預期")]
+        self.api.reply_message(self.tk, messages[0] if len(messages) == 1 else messages)
+
+    def _download_lines(self):
+        """逐行讀取使用者上傳的檔案"""
+        content = self.api.get_message_content(self.message_id)
+        return iter_lines(content.iter_content())
+
+    def _get_index(self):
+        """取得快取帳本的 LedgerIndex，沒有快取時回傳 None"""
+        if self.cache is None:
+            return None
+        return self.cache.index(self.ledger_key, self._load_all_values)
+
+    def _append_rows(self, rows, amount):
+        """新增多列並更新總和，回傳新的總和"""
+        new_total = self.store.append_rows(rows, amount)
+        self._sync_cache("append", rows)
+        self._sync_cache("set_total", new_total)
+        return new_total
+
+    def ssum(self, target, kind="sum", period=None, label=None):
+        # sum 依人名、type 依分類加總，period 為 (start, end) 時只算該日期區間
+        if kind not in ("sum", "type"):
             self.api.reply_message(
                 self.tk, 
                 TextSendMessage(text="ssum function error, 通知皮兒!")
             )
             return
         
-        total = 0
-        for row in all_values[1:]:  # 跳過標題列
-            if row and len(row) > idx and row[idx] == target:
-                try:
-                    total += float(row[self.COL_AMOUNT])
-                except (ValueError, IndexError):
-                    print(f"金額格式錯誤: {row[self.COL_AMOUNT]}")
-                    return
+        index = self._get_index()
+        if index is not None:
+            # 由累計索引直接取得總和，不需掃描每一列
+            total, has_invalid = index.total(target, kind, period)
+            if has_invalid:
+                print(f"金額格式錯誤: {target}")
+        else:
+            total, has_invalid = self.store.sum_by(kind, target, period)
+        if has_invalid:
+            return
         
-        content = f"{target} 已花費 {total} 元"
+        if period is None:
+            content = f"{target} 已花費 {total} 元"
+        else:
+            content = f"{target} 在 {label} 已花費 {total} 元"
+        self.api.reply_message(self.tk, TextSendMessage(text=content))
+
+    def month(self, period=None, label=None):
+        """日期區間（預設為本月）的總花費，以及每個人與每個分類的合計"""
+        if period is None:
+            period, label = self._this_month()
+        index = self._get_index()
+        if index is not None:
+            by_name, by_type = index.summary(period)
+        else:
+            by_name, by_type = self.store.summary(period)
+        if not by_name:
+            self.api.reply_message(self.tk, TextSendMessage(text=f"{label} 沒有記錄"))
+            return
+        total = round(sum(by_name.values()), 2)
+        lines = [f"{label} 共花費 {format_total(total)} 元", "", "依人名："]
+        lines += [f"{k}: {format_total(v)} 元" for k, v in sorted(by_name.items(), key=lambda kv: -kv[1])]
+        lines += ["", "依分類："]
+        lines += [f"{k}: {format_total(v)} 元" for k, v in sorted(by_type.items(), key=lambda kv: -kv[1])]
+        self.api.reply_message(self.tk, TextSendMessage(text="\n".join(lines)))
+
+    @staticmethod
+    def _this_month():
+        """本月（UTC+8）的 (start, end) 與顯示用的 YYYY-MM"""
+        today = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8))).date()
+        return month_period(today), today.strftime("%Y-%m")
+
+    def _get_columns(self):
+        """帳本的 LedgerColumns，有快取時在帳本變動前重複使用"""
+        if self.cache is not None:
+            return self.cache.rendered(
+                self.ledger_key, ("columns",), lambda: LedgerColumns.build(self._get_all_values())
+            )
+        return LedgerColumns.build(self._get_all_values())
+
+    def report(self, period=None, label=None):
+        """日期區間（預設為本月）依人名 × 分類 × 月份的報表與排行"""
+        if period is None:
+            period, label = self._this_month()
+        lines = render_report(self._get_columns(), period, label, self.config.REPORT_TOP_N)
+        texts = split_text(lines, overflow_hint="...內容過長，請縮小日期區間")
+        messages = [TextSendMessage(text=text) for text in texts]
+        self.api.reply_message(self.tk, messages[0] if len(messages) == 1 else messages)
+
+    def _export_source(self, period=None, name=None, kind=None):
+        """要匯出的資料列：帳本已在快取時直接在整數欄位上篩選，否則從儲存層分頁讀取"""
+        match = row_filter(period, name, kind)
+        if self.cache is not None and self.cache.version(self.ledger_key) is not None:
+            ledger = self._get_all_values()
+            if match is not None:
+                return ledger.select(period, name, kind)
+            rows = itertools.islice(ledger, 1, None)  # 跳過標題列
+        else:
+            pages = self.store.iter_pages(self.config.EXPORT_PAGE_SIZE)
+            rows = itertools.chain.from_iterable(pages)
+        rows = (row for row in rows if row)
+        return rows if match is None else filter(match, rows)
+
+    def export(self, fmt="csv", period=None, name=None, kind=None):
+        """把符合條件的記錄寫成 CSV / XLSX 檔，回覆下載連結"""
+        if not self.config.EXPORT_BUCKET and not self.config.EXPORT_BASE_URL:
+            self.api.reply_message(
+                self.tk, TextSendMessage(text="尚未設定 EXPORT_BUCKET 或 EXPORT_BASE_URL，無法提供下載連結")
+            )
+            return
+        # 逐頁讀取、逐列寫檔，不會同時持有整份帳本
+        with bulk():
+            file_name, count = export_rows(
+                self._export_source(period, name, kind),
+                self.config.EXPORT_DIR, fmt, self.config.EXPORT_MAX_AGE,
+            )
+        if self.config.EXPORT_BUCKET:
+            # 上傳到 Cloud Storage，任何 instance 收到下載請求都拿得到檔案
+            path = os.path.join(self.config.EXPORT_DIR, file_name)
+            try:
+                url = registry.export_bucket().publish(
+                    path, file_name, self.config.EXPORT_MAX_AGE, media_type(file_name)
+                )
+            finally:
+                os.remove(path)
+        else:
+            url = f"{self.config.EXPORT_BASE_URL.rstrip('/')}/exports/{file_name}"
+        content = f"匯出完成，共 {count} 筆\n{url}\n（連結 {self.config.EXPORT_MAX_AGE // 60} 分鐘內有效）"
         self.api.reply_message(self.tk, TextSendMessage(text=content))
 
+    def _export_args(self, args):
+        """解析 export 的參數，回傳 export() 的 kwargs，格式錯誤時回傳 None"""
+        options = {}
+        for arg in args:
+            if arg in FORMATS and "fmt" not in options:
+                options["fmt"] = arg
+            elif arg.startswith("name=") and len(arg) > 5 and "name" not in options:
+                options["name"] = arg[5:]
+            elif arg.startswith("type=") and len(arg) > 5 and "kind" not in options:
+                options["kind"] = arg[5:]
+            elif self._period_arg(arg) and "period" not in options:
+                options["period"] = self._period_arg(arg)
+            else:
+                return None
+        return options
+
     def get_type(self):
-        all_values = self._get_all_values()
-        types = set()
-        
-        for row in all_values[1:]:  # 跳過標題列
-            if row and len(row) > self.COL_TYPE:
-                types.add(row[self.COL_TYPE])
-        
-        types_list = sorted(list(types))
+        index = self._get_index()
+        if index is not None:
+            types_list = index.types()
+        else:
+            types_list = self.store.categories()
         content = f"共有以下 {len(types_list)} 種分類：\n{types_list}"
         self.api.reply_message(self.tk, TextSendMessage(text=content))
 
-    def delete(self, index=None):
-        all_values = self._get_all_values()
-        
-        if len(all_values) <= 1:
-            content = "表單為空"
-            self.api.reply_message(self.tk, TextSendMessage(text=content))
-            return
-        
-        # 如果沒有指定 index，刪除最後一筆
-        if index is None:
-            row_num = len(all_values)
-            deleted_row = " ".join(all_values[-1])
-            self.wks.delete_rows(row_num)
-            
-            # 更新總和
-            current_total = float(self.wks.cell("G1").value or 0)
-            new_total = current_total - float(all_values[-1][self.COL_AMOUNT])
-            self.wks.update_value("G1", new_total)
-            
-            content = f"已刪除最後一筆\n{deleted_row}"
+    def _fetch_rows(self, indices):
+        """回傳 ({索引: 列}, 列數)；有快取時由快取取得，否則只讀取這些列，列數為 None"""
+        if self.cache is not None:
+            all_values = self._get_all_values()
+            return {i: all_values[i] for i in indices if 0 < i < len(all_values)}, len(all_values)
+        rows = self.store.get_rows_at(indices)
+        return {i: row for i, row in zip(indices, rows) if row}, None
+
+    def _index_error(self, row_count=None):
+        """索引超出範圍時的回覆，列數只在這時才讀取"""
+        if row_count is None:
+            row_count = self.store.row_count()
+        if row_count <= 1:
+            return "表單為空"
+        return f"索引錯誤，請輸入 0 到 {row_count - 1} 之間的數字"
+
+    def _amount(self, row):
+        """列的金額，無法解析時為 None"""
+        try:
+            return float(row[self.COL_AMOUNT])
+        except (ValueError, IndexError):
+            return None
+
+    def delete(self, *indices):
+        """刪除指定索引的列（read 顯示的索引），沒有指定時刪除最後一筆"""
+        if not indices:
+            # 最後一筆：有快取時直接取得，否則只讀取列數與最後一列
+            last = self._read_rows(last=1)
+            if not last:
+                self.api.reply_message(self.tk, TextSendMessage(text="表單為空"))
+                return
+            idx, row = last[-1]
+            rows = {idx: row}
+            content = f"已刪除最後一筆\n{' '.join(row)}"
         else:
             try:
-                # index 對應 all_values 的索引
-                # 用戶輸入的 index 就是 read 顯示的索引
-                idx = int(index)
-                
-                if idx < 0 or idx >= len(all_values):
-                    content = f"索引錯誤，請輸入 0 到 {len(all_values)-1} 之間的數字"
-                    self.api.reply_message(self.tk, TextSendMessage(text=content))
-                    return
-                
-                # 不允許刪除標題列（index 0）
-                if idx == 0:
-                    content = "無法刪除標題列"
-                    self.api.reply_message(self.tk, TextSendMessage(text=content))
-                    return
-                
-                deleted_row = " ".join(all_values[idx])
-                # pygsheets 使用 1-based row number
-                self.wks.delete_rows(idx + 1)
-                
-                # 更新總和（idx >= 1 是數據行）
-                if idx >= 1 and len(all_values[idx]) > self.COL_AMOUNT:
-                    try:
-                        amount = float(all_values[idx][self.COL_AMOUNT])
-                        current_total = float(self.wks.cell("G1").value or 0)
-                        new_total = current_total - amount
-                        self.wks.update_value("G1", new_total)
-                    except (ValueError, IndexError):
-                        pass
-                
-                content = f"已刪除第 #{idx} 筆\n{deleted_row}"
+                targets = sorted({int(index) for index in indices}, reverse=True)
             except ValueError:
-                content = "索引必須是數字"
-        
+                self.api.reply_message(self.tk, TextSendMessage(text="索引必須是數字"))
+                return
+
+            # 不允許刪除標題列（index 0）
+            if targets[-1] == 0:
+                self.api.reply_message(self.tk, TextSendMessage(text="無法刪除標題列"))
+                return
+
+            rows, row_count = ({}, None) if targets[-1] < 0 else self._fetch_rows(targets)
+            if len(rows) != len(targets):
+                self.api.reply_message(self.tk, TextSendMessage(text=self._index_error(row_count)))
+                return
+
+            if len(targets) == 1:
+                content = f"已刪除第 #{targets[0]} 筆\n{' '.join(rows[targets[0]])}"
+            else:
+                lines = [f"#{i} {' '.join(rows[i])}" for i in reversed(targets)]
+                content = f"已刪除 {len(targets)} 筆\n" + "\n".join(lines)
+
+        # 由下往上在同一次請求刪除，金額無法解析的列不更新總和
+        targets = sorted(rows, reverse=True)
+        new_total = self.store.delete_rows(targets, [self._amount(rows[i]) for i in targets])
+        for idx in targets:
+            self._sync_cache("delete", idx)
+        if new_total is not None:
+            self._sync_cache("set_total", new_total)
+
         self.api.reply_message(self.tk, TextSendMessage(text=content))
 
     def update(self, index, data_str):
         """更新指定索引的資料行"""
-        all_values = self._get_all_values()
-        
-        if len(all_values) <= 1:
-            content = "表單為空，無法更新"
-            self.api.reply_message(self.tk, TextSendMessage(text=content))
-            return
-        
         try:
             idx = int(index)
             
-            if idx < 0 or idx >= len(all_values):
-                content = f"索引錯誤，請輸入 0 到 {len(all_values)-1} 之間的數字"
-                self.api.reply_message(self.tk, TextSendMessage(text=content))
-                return
-            
             # 不允許更新標題列（index 0）
             if idx == 0:
                 content = "無法更新標題列"
@@ -327,31 +718,24 @@ class BotOperation:
                 self.api.reply_message(self.tk, TextSendMessage(text=content))
                 return
             
-            # 獲取舊數據的金額（用於更新總和）
-            old_amount = 0
-            try:
-                if len(all_values[idx]) > self.COL_AMOUNT:
-                    old_amount = float(all_values[idx][self.COL_AMOUNT])
-            except (ValueError, IndexError):
-                old_amount = 0
+            # 格式正確後才讀取目標列，取得舊金額（用於更新總和）
+            rows, row_count = self._fetch_rows([idx])
+            if idx not in rows:
+                content = self._index_error(row_count)
+                if content == "表單為空":
+                    content = "表單為空，無法更新"
+                self.api.reply_message(self.tk, TextSendMessage(text=content))
+                return
+            old_amount = self._amount(rows[idx]) or 0
             
             # 構建新數據
             new_row = [new_time, new_name, new_item, new_type, new_amount]
-            row_number = idx + 1  # pygsheets 使用 1-based
-            
-            # 更新該行的數據
-            self.wks.update_values(f"A{row_number}", [new_row])
             
-            # 更新總和
-            new_amount_float = float(new_amount)
-            if old_amount != 0 or new_amount_float != 0:
-                try:
-                    current_total = float(self.wks.cell("G1").value or 0)
-                    # 減去舊金額，加上新金額
-                    new_total = current_total - old_amount + new_amount_float
-                    self.wks.update_value("G1", new_total)
-                except (ValueError, IndexError):
-                    pass
+            # 更新該行的數據與總和（同一次請求）
+            new_total = self.store.update_row(idx, new_row, old_amount, float(new_amount))
+            self._sync_cache("update", idx, new_row)
+            if new_total is not None:
+                self._sync_cache("set_total", new_total)
             
             content = f"已更新第 #{idx} 筆\n{' '.join(new_row)}"
             self.api.reply_message(self.tk, TextSendMessage(text=content))
@@ -361,29 +745,10 @@ class BotOperation:
             self.api.reply_message(self.tk, TextSendMessage(text=content))
 
     def clear(self):
-        # 獲取當前試算表的所有工作表
-        spreadsheet = self.wks.spreadsheet
-        
-        # 獲取所有數據用於備份
-        all_values = self._get_all_values()
-        
-        # 嘗試獲取或創建備份工作表
-        backup_sheet_name = f"{self.config.GWORKSHEET}_backup"
-        try:
-            backup_wks = spreadsheet.worksheet_by_title(backup_sheet_name)
-        except pygsheets.WorksheetNotFound:
-            # 如果備份工作表不存在，創建它
-            backup_wks = spreadsheet.add_worksheet(backup_sheet_name, rows=len(all_values) if all_values else 100, cols=7)
-        
-        # 備份數據到備份工作表
-        if all_values:
-            backup_wks.clear()
-            backup_wks.update_values("A1", all_values)
-        
-        # 清除原工作表
-        self.wks.clear()
-        header = ["時間", "人名", "品項", "分類", "費用", "總和", 0]
-        self.wks.update_values("A1", [header])
+        # 由儲存層建立快照後清除，資料不經過快取
+        header = HEADER + [0]
+        backup_sheet_name = self.store.clear(header)
+        self._sync_cache("replace", [[str(v) for v in header]])
         
         # 記錄備份時間
         dt_local = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
@@ -392,59 +757,86 @@ class BotOperation:
         
         self.api.reply_message(self.tk, TextSendMessage(text=f"全部清除成功\n{backup_info}"))
 
-    def revert(self):
-        """還原備份的數據"""
+    def revert(self, n=1):
+        """還原第 n 新的備份快照"""
         try:
-            # 獲取當前試算表
-            spreadsheet = self.wks.spreadsheet
-            backup_sheet_name = f"{self.config.GWORKSHEET}_backup"
+            # 由儲存層直接還原，資料不經過這個 process
+            snapshot = self.store.revert(n)
             
-            # 嘗試獲取備份工作表
-            backup_wks = spreadsheet.worksheet_by_title(backup_sheet_name)
-            backup_values = backup_wks.get_all_values(
-                include_tailing_empty_rows=False,
-                include_tailing_empty=False
-            )
-            
-            if not backup_values or len(backup_values) == 0:
+            if not snapshot:
                 self.api.reply_message(self.tk, TextSendMessage(text="沒有備份資料可還原"))
                 return
             
-            # 將備份數據還原到當前工作表
-            self.wks.clear()
-            self.wks.update_values("A1", backup_values)
-            
-            self.api.reply_message(self.tk, TextSendMessage(text="備份資料還原成功"))
-        except pygsheets.WorksheetNotFound:
+            self._sync_cache("invalidate")
+            self.api.reply_message(self.tk, TextSendMessage(text=f"備份資料還原成功\n還原自：{snapshot}"))
+        except BackupNotFound:
             self.api.reply_message(self.tk, TextSendMessage(text="找不到備份工作表"))
         except Exception as ex:
             print(f"還原錯誤: {ex}")
             self.api.reply_message(self.tk, TextSendMessage(text=f"還原失敗: {ex}"))
 
+    def list_snapshots(self):
+        """列出可還原的備份快照"""
+        snapshots = self.store.snapshots()
+        if not snapshots:
+            content = "沒有備份資料"
+        else:
+            content = "可還原的備份（revert 編號）：\n" + "\n".join(
+                f"{i}  {name}" for i, name in enumerate(snapshots, start=1)
+            )
+        self.api.reply_message(self.tk, TextSendMessage(text=content))
+
     def method(self):
         content = (
             "read: 讀取資料（顯示索引）\n"
+            "read 筆數: 讀取最後幾筆，例如 read 20\n"
+            "read p頁數: 分頁讀取，例如 read p3\n"
             "display: 完整表單\n"
             "write 名字 品項 分類 金額(記得空格): 記帳\n"
             "write 名字 品項1 分類1 金額1/品項2 分類2 金額2\n"
             "(記得空格，多筆以此類推)\n"
+            "import 後換行貼上多筆（每行 [時間] 名字 品項 分類 金額），或上傳 CSV 檔: 大量匯入\n"
             "sum 名字(記得空格): 加總\n"
+            "sum 名字 2025-01 或 sum 名字 2025-01-01~2025-01-15: 指定月份或日期區間的加總\n"
+            "month: 本月各人與各分類的花費，month 2025-01 查詢指定月份\n"
+            "report: 本月依人名、分類的報表與排行，report 2025-01~2025-03 查詢指定區間\n"
+            "export [csv|xlsx] [日期區間] [name=名字] [type=分類]: 匯出檔案並回傳下載連結\n"
             "delete: 刪除最後一筆記錄\n"
             "delete 索引: 刪除指定索引的記錄\n"
+            "delete 索引1 索引2 ...: 一次刪除多筆記錄\n"
             "update 索引 時間 名字 品項 分類 金額: 更新指定記錄\n"
             "例如：update 2 2024-01-01 12:00 小美 午餐 餐飲 100\n"
             "clear: 清除全部項目（會自動備份）\n"
-            "revert: 還原備份的資料\n"
+            "revert: 還原最近一次備份的資料\n"
+            "revert 編號: 還原較舊的備份，revert list 列出備份\n"
             "type: 獲得分類項目\n"
-            "type 分類(記得空格): 獲得分類金額加總"
+            "type 分類(記得空格): 獲得分類金額加總\n"
+            "type 分類 日期區間: 指定月份或日期區間的分類加總"
         )
         self.api.reply_message(self.tk, TextSendMessage(text=content))
 
+    @staticmethod
+    def _period_arg(text):
+        """解析日期區間參數，格式錯誤時回傳 None"""
+        try:
+            return parse_period(text)
+        except ValueError:
+            return None
+
     def execute_command(self, op):
         """執行對應的指令"""
         match op:
             case "read":
-                self.read()
+                lst = self.msg.split()
+                arg = lst[1] if len(lst) == 2 else ""
+                if len(lst) == 1:
+                    self.read()
+                elif arg.isdigit() and int(arg) > 0:
+                    self.read(last=int(arg))
+                elif arg[:1] == "p" and arg[1:].isdigit() and int(arg[1:]) > 0:
+                    self.read(page=int(arg[1:]))
+                else:
+                    self.api.reply_message(self.tk, TextSendMessage(text="格式錯誤\n格式：read、read 筆數 或 read p頁數"))
                 print("讀取資料成功")
             case "display":
                 self.display(self.config.GOOGLE_SHEET_URL)
@@ -452,12 +844,28 @@ class BotOperation:
             case "write":
                 self.write()
                 print("新增資料到試算表")
+            case "import":
+                words = self.msg.split(None, 1)
+                if len(words) == 2:
+                    self.bulk_import(words[1].splitlines())
+                elif self.message_id is not None:
+                    self.bulk_import(self._download_lines())
+                else:
+                    self.api.reply_message(self.tk, TextSendMessage(text=(
+                        "格式錯誤\n格式：import 後換行，每行一筆\n"
+                        "[時間] 名字 品項 分類 金額（可用空白或逗號分隔），或直接上傳 CSV 檔"
+                    )))
+                print("匯入資料")
             case "sum":
                 lst = self.msg.split(' ')
-                if len(lst) != 2:
-                    self.api.reply_message(self.tk, TextSendMessage(text="查詢失敗,格式:\nsum 名字(記得空格)"))
-                else:
+                if len(lst) == 2:
                     self.ssum(lst[-1], "sum")
+                elif len(lst) == 3 and self._period_arg(lst[2]):
+                    self.ssum(lst[1], "sum", self._period_arg(lst[2]), lst[2])
+                else:
+                    self.api.reply_message(self.tk, TextSendMessage(text=(
+                        "查詢失敗,格式:\nsum 名字(記得空格)\nsum 名字 2025-01 或 sum 名字 2025-01-01~2025-01-15"
+                    )))
                 print("計算總和")
             case "type":
                 msg = self.msg.strip()
@@ -465,29 +873,67 @@ class BotOperation:
                 if len(lst) == 1:
                     self.get_type()
                     print("提供分類項目")
-                elif len(lst) != 2:
-                    self.api.reply_message(self.tk, TextSendMessage(text="查詢失敗,格式:\ntype 或是 type 種類(記得空格)"))
-                else:
+                elif len(lst) == 2:
                     self.ssum(lst[-1], "type")
                     print("計算分類總和")
+                elif len(lst) == 3 and self._period_arg(lst[2]):
+                    self.ssum(lst[1], "type", self._period_arg(lst[2]), lst[2])
+                    print("計算分類總和")
+                else:
+                    self.api.reply_message(self.tk, TextSendMessage(text=(
+                        "查詢失敗,格式:\ntype 或是 type 種類(記得空格)\ntype 種類 2025-01 或 type 種類 2025-01-01~2025-01-15"
+                    )))
+            case "month":
+                lst = self.msg.split()
+                if len(lst) == 1:
+                    self.month()
+                elif len(lst) == 2 and self._period_arg(lst[1]):
+                    self.month(self._period_arg(lst[1]), lst[1])
+                else:
+                    self.api.reply_message(self.tk, TextSendMessage(text="格式錯誤\n格式：month 或 month 2025-01"))
+                print("計算月份摘要")
+            case "report":
+                lst = self.msg.split()
+                if len(lst) == 1:
+                    self.report()
+                elif len(lst) == 2 and self._period_arg(lst[1]):
+                    self.report(self._period_arg(lst[1]), lst[1])
+                else:
+                    self.api.reply_message(self.tk, TextSendMessage(text="格式錯誤\n格式：report 或 report 2025-01"))
+                print("產生報表")
+            case "export":
+                options = self._export_args(self.msg.split()[1:])
+                if options is None:
+                    self.api.reply_message(self.tk, TextSendMessage(text=(
+                        "格式錯誤\n格式：export [csv|xlsx] [日期區間] [name=名字] [type=分類]\n"
+                        "例如：export xlsx 2025-01 name=小美"
+                    )))
+                else:
+                    self.export(**options)
+                print("匯出資料")
             case "delete":
-                lst = self.msg.split(' ')
+                lst = self.msg.split()
                 if len(lst) == 1:
                     self.delete()  # 沒有參數，刪除最後一筆
-                elif len(lst) == 2:
-                    try:
-                        index = int(lst[1])
-                        self.delete(index)
-                    except ValueError:
-                        self.api.reply_message(self.tk, TextSendMessage(text="索引必須是數字\n格式：delete 或 delete 索引"))
+                elif all(arg.isdigit() for arg in lst[1:]):
+                    self.delete(*(int(arg) for arg in lst[1:]))
                 else:
-                    self.api.reply_message(self.tk, TextSendMessage(text="格式錯誤\n格式：delete 或 delete 索引"))
+                    self.api.reply_message(self.tk, TextSendMessage(text="索引必須是數字\n格式：delete 或 delete 索引1 索引2 ..."))
                 print("清除項目")
             case "clear":
                 self.clear()
                 print("清除資料")
             case "revert":
-                self.revert()
+                lst = self.msg.split()
+                arg = lst[1] if len(lst) == 2 else ""
+                if len(lst) == 1:
+                    self.revert()
+                elif arg == "list":
+                    self.list_snapshots()
+                elif arg.isdigit() and int(arg) > 0:
+                    self.revert(int(arg))
+                else:
+                    self.api.reply_message(self.tk, TextSendMessage(text="格式錯誤\n格式：revert、revert 編號 或 revert list"))
                 print("還原備份資料")
             case "update":
                 lst = self.msg.split(' ', 2)
@@ -508,6 +954,13 @@ class BotOperation:
                 self.api.reply_message(self.tk, TextSendMessage(text="不支援的指令"))
 
 
+if registry.config.PREWARM_CLIENTS:
+    registry.prewarm()
+if registry.config.ASYNC_ACK:
+    # SIGTERM handler 只能在主執行緒安裝，import 時先註冊，不等第一個請求啟動 worker
+    background.install_hooks()
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=port)
\ No newline at end of file
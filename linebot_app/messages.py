@@ -0,0 +1,42 @@
+# LINE Messaging API 的限制：單則文字 5000 字、一次回覆最多 5 則
+TEXT_LIMIT = 5000
+MAX_MESSAGES = 5
+
+
+class TextSendMessage:
+    """建立 linebot.models.TextSendMessage，linebot SDK 在第一次回覆時才載入（縮短 cold start）"""
+
+    def __new__(cls, *args, **kwargs):
+        from linebot.models import TextSendMessage
+
+        return TextSendMessage(*args, **kwargs)
+
+
+def split_text(lines, overflow_hint="", limit=TEXT_LIMIT, max_messages=MAX_MESSAGES):
+    """把多行文字切成不超過 limit 字的區塊，最多 max_messages 則
+
+    放不下的部分會被捨棄，並在最後一則結尾加上 overflow_hint。
+    """
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        line = line[:limit]
+        extra = len(line) + (1 if current else 0)
+        if current and size + extra > limit:
+            chunks.append(current)
+            current, size = [], 0
+            extra = len(line)
+        current.append(line)
+        size += extra
+    if current:
+        chunks.append(current)
+
+    if len(chunks) > max_messages:
+        chunks = chunks[:max_messages]
+        last = chunks[-1]
+        # 刪掉最後幾行，讓提示文字放得下
+        while last and len("\n".join(last + [overflow_hint])) > limit:
+            last.pop()
+        last.append(overflow_hint)
+    return ["\n".join(chunk) for chunk in chunks] or [""]
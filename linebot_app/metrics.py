@@ -0,0 +1,325 @@
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from linebot_app.config import Config
+
+# 延遲 histogram 的上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 外部呼叫計入的處理階段：Sheets 讀寫算 fetch、LINE 回覆算 reply
+PHASE_BY_SERVICE = {"sheets": "fetch", "line": "reply"}
+
+# pygsheets 物件中也要記錄的屬性，以及回傳值也要記錄的方法（備份工作表、batch_update）
+SHEETS_WRAP = {
+    "attrs": ("spreadsheet", "client", "sheet"),
+    "results": ("worksheet_by_title", "add_worksheet"),
+}
+
+HELP = {
+    "linebot_api_calls_total": "Sheets / LINE API 呼叫次數",
+    "linebot_api_errors_total": "Sheets / LINE API 呼叫失敗次數",
+    "linebot_api_bytes_total": "Sheets / LINE API 傳輸量（JSON 估計的位元組數）",
+    "linebot_api_call_seconds": "Sheets / LINE API 單次呼叫延遲",
+    "linebot_commands_total": "指令執行次數",
+    "linebot_duplicate_events_total": "略過的重送 webhook 事件數",
+    "linebot_command_seconds": "指令從開始到回覆完成的時間",
+    "linebot_phase_seconds": "webhook 各處理階段的時間",
+}
+
+_current = ContextVar("linebot_trace", default=None)
+_trace_ids = itertools.count(1)
+
+
+# payload_size 計算長 list 時取樣的項目數
+_SAMPLE = 16
+
+
+def _json_default(value):
+    # LINE 訊息物件只取有值的欄位（as_json_string 會觸發 SDK 的 deprecation warning）
+    from linebot.models.base import Base
+
+    if isinstance(value, Base):
+        return {k: v for k, v in vars(value).items() if v is not None}
+    return str(value)
+
+
+def payload_size(value):
+    """以 JSON 長度估計傳輸的位元組數
+
+    每次 API 呼叫都會計算，所以不序列化整個參數或結果：
+    超過 _SAMPLE 項的 list 只計算前 _SAMPLE 項，再依項目數等比例放大（例如整份帳本）。
+    """
+    if value is None:
+        return 0
+    return _json_size(value)
+
+
+def _json_size(value):
+    """json.dumps(value, ensure_ascii=False) 的 UTF-8 長度，長 list 以取樣估計"""
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return 2
+        size = sum(_json_size(item) for item in value[:_SAMPLE])
+        if len(value) > _SAMPLE:
+            size = size * len(value) // _SAMPLE
+        # 項目之間的 ", " 與前後的括號
+        return size + 2 * len(value)
+    if isinstance(value, dict):
+        if not value:
+            return 2
+        return sum(_json_size(str(key)) + 2 + _json_size(item) for key, item in value.items()) + 2 * len(value)
+    if value is None or isinstance(value, (str, int, float)):
+        try:
+            return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        except ValueError:
+            return 0
+    return _json_size(_json_default(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Trace:
+    """單一 webhook 請求或單一指令的處理紀錄"""
+
+    def __init__(self, kind, command, parent=None):
+        self.id = next(_trace_ids)
+        self.kind = kind
+        self.command = command
+        self.parent = parent
+        self.status = "ok"
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.phases = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_call(self, service, method, seconds, sent, received, error):
+        with self._lock:
+            self.calls.append({
+                "service": service,
+                "method": method,
+                "ms": round(seconds * 1000, 3),
+                "sent": sent,
+                "received": received,
+                "error": error,
+            })
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "trace": self.id,
+                "kind": self.kind,
+                "request": self.parent.id if self.parent else None,
+                "command": self.command,
+                "status": self.status,
+                "duration_ms": round(self.duration * 1000, 3),
+                "phases_ms": {k: round(v * 1000, 3) for k, v in self.phases.items()},
+                "calls": list(self.calls),
+            }
+
+
+class InstrumentedProxy:
+    """包住 worksheet 或 LineBotApi，記錄每次方法呼叫的次數、延遲、傳輸量與錯誤"""
+
+    def __init__(self, target, service, metrics, attrs=(), results=()):
+        self._target = target
+        self._service = service
+        self._metrics = metrics
+        self._attrs = attrs
+        self._results = results
+
+    def _nested(self, value):
+        return InstrumentedProxy(value, self._service, self._metrics, self._attrs, self._results)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in self._attrs:
+            return self._nested(value)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            error = None
+            result = None
+            try:
+                result = value(*args, **kwargs)
+            except Exception as ex:
+                error = type(ex).__name__
+                raise
+            finally:
+                self._metrics.record_call(
+                    self._service, name, time.perf_counter() - start,
+                    payload_size([args, kwargs] if kwargs else list(args)),
+                    payload_size(result), error,
+                )
+            if name in self._results:
+                return self._nested(result)
+            return result
+
+        return call
+
+
+class Metrics:
+    """process 內的 counter 與 histogram，輸出 Prometheus text 格式"""
+
+    def __init__(self, enabled=True, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (名稱, labels) -> [各 bucket 次數..., 總秒數, 總次數]
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            data = self._histograms.get(key)
+            if data is None:
+                data = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    data[i] += 1
+            data[-2] += seconds
+            data[-1] += 1
+
+    def value(self, name, **labels):
+        """counter 目前的值（測試與除錯用）"""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def instrument(self, target, service, attrs=(), results=()):
+        """回傳記錄呼叫的 proxy，停用時直接回傳原物件"""
+        if not self.enabled or target is None:
+            return target
+        return InstrumentedProxy(target, service, self, attrs, results)
+
+    def record_call(self, service, method, seconds, sent, received, error=None):
+        trace = _current.get()
+        command = trace.command if trace is not None else "none"
+        self.inc("linebot_api_calls_total", service=service, method=method, command=command)
+        self.observe("linebot_api_call_seconds", seconds, service=service, method=method)
+        self.inc("linebot_api_bytes_total", sent, service=service, direction="sent", command=command)
+        self.inc("linebot_api_bytes_total", received, service=service, direction="received", command=command)
+        if error:
+            self.inc("linebot_api_errors_total", service=service, method=method, command=command, error=error)
+        if trace is not None:
+            trace.add_call(service, method, seconds, sent, received, error)
+            trace.add_phase(PHASE_BY_SERVICE.get(service, service), seconds)
+
+    @contextmanager
+    def phase(self, name):
+        """計時一個處理階段（verify、auth），記到目前的 trace"""
+        trace = _current.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - start, trace)
+
+    def record_phase(self, name, seconds, trace=None):
+        """把已量好的時間記為一個處理階段（例如等待 Sheets 配額的 throttle）"""
+        trace = trace or _current.get()
+        if trace is not None and trace.kind == "command":
+            # 指令結束時由 command() 一起記到 linebot_phase_seconds，這裡只累加到 trace
+            trace.add_phase(name, seconds)
+            return
+        command = trace.command if trace is not None else "none"
+        self.observe("linebot_phase_seconds", seconds, phase=name, command=command)
+        if trace is not None:
+            trace.add_phase(name, seconds)
+
+    @contextmanager
+    def request(self, trace_log=False):
+        """一次 webhook 請求，trace_log 時結束後輸出一行 JSON"""
+        trace = Trace("request", "webhook")
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            if trace_log:
+                print(json.dumps(trace.as_dict(), ensure_ascii=False))
+
+    @contextmanager
+    def command(self, command, parent=None, trace_log=False):
+        """一個指令的處理，結束時把扣除 fetch、reply 的時間記為 compute"""
+        trace = Trace("command", command, parent)
+        token = _current.set(trace)
+        try:
+            yield trace
+        except Exception:
+            trace.status = "error"
+            raise
+        finally:
+            _current.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            io_seconds = sum(trace.phases.values())
+            trace.add_phase("compute", max(0.0, trace.duration - io_seconds))
+            for phase, seconds in trace.phases.items():
+                self.observe("linebot_phase_seconds", seconds, phase=phase, command=command)
+            self.observe("linebot_command_seconds", trace.duration, command=command)
+            self.inc("linebot_commands_total", command=command, status=trace.status)
+            if trace_log:
+                print(json.dumps(trace.as_dict(), ensure_ascii=False))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), data in histograms:
+            header(name, "histogram")
+            for bound, count in zip(self.buckets, data):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {data[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {data[-2]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {data[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(enabled=Config.METRICS_ENABLED)
@@ -0,0 +1,224 @@
+import functools
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from linebot_app.config import Config
+from linebot_app.metrics import SHEETS_WRAP, metrics
+
+# 排隊的優先順序，數字小的先取得配額
+INTERACTIVE = 0
+BULK = 1
+
+# 可以重試的 HTTP 狀態：配額用完與暫時性的伺服器錯誤
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 重送可能重複套用的方法（新增、刪除列，batchUpdate），連線中斷或 5xx 後只有 429 可以重試
+NON_IDEMPOTENT = {"append_table", "insert_rows", "add_rows", "delete_rows", "batch_update", "add_worksheet"}
+
+_priority = ContextVar("sheets_priority", default=INTERACTIVE)
+
+
+class QuotaExceeded(Exception):
+    """在期限內等不到配額，或重試到期限仍失敗"""
+
+
+class WriteUncertain(Exception):
+    """非冪等的寫入遇到連線中斷、逾時或 5xx，無法確定試算表是否已套用，所以不重試"""
+
+
+@contextmanager
+def bulk():
+    """區塊內的 Sheets 呼叫以低優先順序排隊（備份、同步等大量寫入）"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def bulk_priority(func):
+    """整個方法都以 bulk() 執行的 decorator"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with bulk():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _status(ex):
+    """HttpError 的 HTTP 狀態，其他例外回傳 None"""
+    # googleapiclient 只有在例外發生時才載入（縮短 cold start）
+    from googleapiclient.errors import HttpError
+
+    return int(ex.resp.status) if isinstance(ex, HttpError) else None
+
+
+def is_retryable(ex):
+    status = _status(ex)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(ex, (ConnectionError, TimeoutError))
+
+
+def _retry_after(ex):
+    """429 回應的 Retry-After 秒數，沒有則回傳 0"""
+    if _status(ex) is None:
+        return 0.0
+    try:
+        return float(ex.resp.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    """每分鐘 rate 個 token、最多累積 burst 個的 token bucket
+
+    等待的呼叫依 (priority, 到達順序) 排隊，只有排在最前面的可以取用 token，
+    所以低優先順序的大量工作不會搶走互動指令的配額。
+    """
+
+    def __init__(self, rate_per_minute, burst=10):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=INTERACTIVE, deadline=None):
+        """取得一個 token，超過 deadline（time.monotonic）仍拿不到則回傳 False"""
+        if self.rate <= 0:
+            return True
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = None
+                    if self._waiters[0] == entry:
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                            return True
+                        wait = (1 - self.tokens) / self.rate
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    # 不是排在最前面的，等前面的呼叫離開時被喚醒
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def drain(self):
+        """收到 429 時清空 token，讓其他呼叫也一起放慢"""
+        with self._cond:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0)
+
+
+class SheetsScheduler:
+    """所有 worksheet 呼叫的排程：依配額間隔送出，429 / 5xx 以 jitter 指數退避重試
+
+    每次呼叫從開始算起 deadline 秒內必須完成，否則拋出 QuotaExceeded。
+    rate_per_minute 為 0 時不限制速率，只做重試。
+    """
+
+    def __init__(self, rate_per_minute=60, burst=10, deadline=30.0, base_delay=0.5, max_delay=16.0,
+                 sleep=time.sleep, rng=None):
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._random = rng or random.Random()
+
+    def backoff(self, attempt, ex=None):
+        """第 attempt 次重試前的等待秒數（equal jitter），不少於 Retry-After"""
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return max(self._random.uniform(cap / 2, cap), _retry_after(ex))
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        """依配額送出 func(*args, **kwargs)，失敗時重試
+
+        idempotent 為 False 的寫入只在 429（請求被拒絕，確定沒有套用）時重試，
+        其他可重試的錯誤改為拋出 WriteUncertain，避免重複新增或多刪一列。
+        """
+        priority = _priority.get()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            acquired = self.bucket.acquire(priority, deadline)
+            waited = time.perf_counter() - start
+            if waited > 0.001:
+                metrics.record_phase("throttle", waited)
+            if not acquired:
+                raise QuotaExceeded("等待 Sheets 配額逾時")
+            try:
+                return func(*args, **kwargs)
+            except Exception as ex:
+                if not is_retryable(ex):
+                    raise
+                if not idempotent and _status(ex) != 429:
+                    raise WriteUncertain(f"寫入結果不確定: {ex}") from ex
+                if _status(ex) == 429:
+                    self.bucket.drain()
+                delay = self.backoff(attempt, ex)
+                attempt += 1
+                if time.monotonic() + delay >= deadline:
+                    raise QuotaExceeded(f"Sheets 重試 {attempt} 次仍失敗: {ex}") from ex
+                metrics.record_phase("throttle", delay)
+                self._sleep(delay)
+
+    def wrap(self, wks):
+        """回傳所有方法呼叫都經過排程的 worksheet"""
+        return ScheduledProxy(wks, self, **SHEETS_WRAP)
+
+
+class ScheduledProxy:
+    """把 worksheet（以及備份工作表、batch_update client）的方法呼叫交給 SheetsScheduler"""
+
+    def __init__(self, target, scheduler, attrs=(), results=()):
+        self._target = target
+        self._scheduler = scheduler
+        self._attrs = attrs
+        self._results = results
+
+    def _nested(self, value):
+        return ScheduledProxy(value, self._scheduler, self._attrs, self._results)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in self._attrs:
+            return self._nested(value)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            result = self._scheduler.call(value, *args, idempotent=name not in NON_IDEMPOTENT, **kwargs)
+            if name in self._results:
+                return self._nested(result)
+            return result
+
+        return call
+
+
+scheduler = SheetsScheduler(
+    rate_per_minute=Config.SHEETS_QUOTA_PER_MINUTE,
+    burst=Config.SHEETS_QUOTA_BURST,
+    deadline=Config.SHEETS_RETRY_DEADLINE,
+)
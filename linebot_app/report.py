@@ -0,0 +1,157 @@
+from array import array
+from datetime import date
+from heapq import nlargest
+
+from linebot_app.columns import COL_AMOUNT, COL_NAME, COL_TIME, COL_TYPE, to_cents
+from linebot_app.compact import EPOCH_DAY, MISSING, CompactLedger
+from linebot_app.store import format_total
+from linebot_app.timeindex import day_key
+
+
+def month_code(day):
+    """date 轉成月份代碼（year * 12 + month - 1）"""
+    return day.year * 12 + day.month - 1
+
+
+def month_label(month):
+    """月份代碼（year * 12 + month - 1）轉成 YYYY-MM"""
+    return f"{month // 12}-{month % 12 + 1:02d}"
+
+
+class LedgerColumns:
+    """帳本的欄式表示，供 report 做 group by
+
+    人名、分類轉成整數代碼，日期、月份、金額（分）放在 array 裡，
+    建立時只解析一次字串，之後的加總只在整數欄位上運算。
+    日期與金額的種類遠少於列數，解析結果以字串為 key 重複使用。
+    時間或金額無法解析的列不計入。
+    """
+
+    __slots__ = ("names", "types", "name_codes", "type_codes", "days", "months", "cents")
+
+    def __init__(self):
+        self.names = []
+        self.types = []
+        self.name_codes = array("l")
+        self.type_codes = array("l")
+        self.days = array("l")
+        self.months = array("l")
+        self.cents = array("q")
+
+    @classmethod
+    def build(cls, rows):
+        if isinstance(rows, CompactLedger):
+            return cls.from_compact(rows)
+        columns = cls()
+        name_ids, type_ids = {}, {}
+        # "YYYY-MM-DD" -> (日期序號, 月份代碼)、金額字串 -> 分
+        dates, amounts = {}, {}
+        for row in rows[1:]:  # 跳過標題列
+            if len(row) <= COL_AMOUNT:
+                continue
+            day_text = row[COL_TIME][:10]
+            parsed = dates.get(day_text)
+            if parsed is None:
+                day = day_key(day_text)
+                month = int(day_text[0:4]) * 12 + int(day_text[5:7]) - 1 if day is not None else None
+                parsed = dates[day_text] = (day, month) if day is not None else ()
+            cents = amounts.get(row[COL_AMOUNT])
+            if cents is None:
+                cents = to_cents(row[COL_AMOUNT])
+                if cents is None:
+                    cents = False
+                amounts[row[COL_AMOUNT]] = cents
+            if not parsed or cents is False:
+                continue
+            name, kind = row[COL_NAME], row[COL_TYPE]
+            name_code = name_ids.get(name)
+            if name_code is None:
+                name_code = name_ids[name] = len(columns.names)
+                columns.names.append(name)
+            type_code = type_ids.get(kind)
+            if type_code is None:
+                type_code = type_ids[kind] = len(columns.types)
+                columns.types.append(kind)
+            columns.name_codes.append(name_code)
+            columns.type_codes.append(type_code)
+            columns.days.append(parsed[0])
+            columns.months.append(parsed[1])
+            columns.cents.append(cents)
+        return columns
+
+    @classmethod
+    def from_compact(cls, ledger):
+        """由 CompactLedger 的整數欄位篩出可計算的列，人名、分類沿用帳本的字串代碼"""
+        columns = cls()
+        columns.names = columns.types = ledger.table.strings
+        stamps, cents = ledger.stamps, ledger.cents
+        # 時間或金額無法解析的列很少，有的時候才逐列篩選
+        keep = None
+        if MISSING in stamps or MISSING in cents:
+            keep = [j for j, (stamp, amount) in enumerate(zip(stamps, cents)) if MISSING not in (stamp, amount)]
+
+        def pick(column):
+            return column if keep is None else [column[j] for j in keep]
+
+        days = columns.days = array("l", (stamp // 86400 + EPOCH_DAY for stamp in pick(stamps)))
+        # 日期序號 -> 月份代碼，只對出現過的日期計算
+        months = {day: month_code(date.fromordinal(day)) for day in set(days)}
+        columns.name_codes = array("l", pick(ledger.names))
+        columns.type_codes = array("l", pick(ledger.kinds))
+        columns.months = array("l", map(months.__getitem__, days))
+        columns.cents = array("q", pick(cents))
+        return columns
+
+    def __len__(self):
+        return len(self.cents)
+
+    def group_by(self, start, end):
+        """start 到 end（日期序號，含）之間依 (月份, 人名代碼, 分類代碼) 加總金額（分）"""
+        totals = {}
+        get = totals.get
+        for day, month, name, kind, cents in zip(
+            self.days, self.months, self.name_codes, self.type_codes, self.cents
+        ):
+            if start <= day <= end:
+                key = (month, name, kind)
+                totals[key] = get(key, 0) + cents
+        return totals
+
+
+def _amount(cents):
+    return format_total(cents / 100)
+
+
+def render_report(columns, period, label, top_n=5):
+    """依人名 × 分類 × 月份的表格與分類、人名排行，回傳要回覆的文字行"""
+    groups = columns.group_by(period[0].toordinal(), period[1].toordinal())
+    # 月份 -> 人名代碼 -> 分類代碼 -> 金額
+    table = {}
+    name_totals, type_totals = {}, {}
+    for (month, name, kind), cents in groups.items():
+        if not cents:
+            continue
+        table.setdefault(month, {}).setdefault(name, {})[kind] = cents
+        name_totals[name] = name_totals.get(name, 0) + cents
+        type_totals[kind] = type_totals.get(kind, 0) + cents
+    if not table:
+        return [f"{label} 沒有記錄"]
+
+    lines = [f"報表 {label}（共 {_amount(sum(name_totals.values()))} 元）"]
+    for month in sorted(table):
+        if len(table) > 1:
+            lines += ["", f"【{month_label(month)}】"]
+        rows = table[month]
+        for name in sorted(rows, key=lambda code: -sum(rows[code].values())):
+            kinds = rows[name]
+            cells = "、".join(
+                f"{columns.types[kind]} {_amount(cents)}"
+                for kind, cents in sorted(kinds.items(), key=lambda kv: -kv[1])
+            )
+            lines.append(f"{columns.names[name]}：{cells}（小計 {_amount(sum(kinds.values()))}）")
+
+    for title, totals, labels in (("分類", type_totals, columns.types), ("人名", name_totals, columns.names)):
+        lines += ["", f"{title}前 {top_n} 名："]
+        top = nlargest(top_n, totals.items(), key=lambda kv: kv[1])
+        lines += [f"{rank}. {labels[code]} {_amount(cents)} 元" for rank, (code, cents) in enumerate(top, start=1)]
+    return lines
@@ -0,0 +1,28 @@
+class SourceConfig:
+    """事件來源專用的設定：GWORKSHEET 換成該來源的工作表，其餘沿用原本的 Config
+
+    帳本的 key、備份工作表名稱、SQLite 的帳本名稱都由 GWORKSHEET 推導，
+    所以每個來源的資料、G1 總和與門檻檢查自然分開。
+    """
+
+    def __init__(self, config, worksheet):
+        self._config = config
+        self.GWORKSHEET = worksheet
+
+    def __getattr__(self, name):
+        return getattr(self._config, name)
+
+
+def worksheet_title(config, source_id):
+    """來源的工作表名稱，LEDGER_SCOPE 不是 source 或沒有來源時為 GWORKSHEET"""
+    if config.LEDGER_SCOPE != "source" or not source_id:
+        return config.GWORKSHEET
+    return f"{config.GWORKSHEET}_{source_id}"
+
+
+def config_for(event, config):
+    """回傳處理此事件使用的設定"""
+    title = worksheet_title(config, event.source_id)
+    if title == config.GWORKSHEET:
+        return config
+    return SourceConfig(config, title)
@@ -0,0 +1,1053 @@
+import atexit
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from linebot_app.columns import COL_AMOUNT, COL_NAME, COL_TIME, COL_TYPE, to_cents
+from linebot_app.quota import bulk, bulk_priority
+from linebot_app.timeindex import day_key, period_bounds
+from linebot_app.totals import (
+    TOTAL_FORMULA, FormulaTotals, append_request, delete_request, row_data, total_request, update_request,
+)
+
+HEADER = ["時間", "人名", "品項", "分類", "費用", "總和"]
+
+
+class BackupNotFound(Exception):
+    """找不到可還原的備份"""
+
+
+class UnsupportedOperation(Exception):
+    """儲存層不支援的操作"""
+
+
+class PartialImport(Exception):
+    """import 中途失敗，前 rows 筆已寫入；total 為已寫入部分計入後的總和（總和也更新失敗時為 None）"""
+
+    def __init__(self, rows, amount, total):
+        super().__init__(f"只匯入前 {rows} 筆")
+        self.rows = rows
+        self.amount = amount
+        self.total = total
+
+
+def format_total(total):
+    """與試算表顯示一致：整數不帶小數點"""
+    total = float(total)
+    return str(int(total)) if total.is_integer() else str(total)
+
+
+class LedgerStore(ABC):
+    """帳本儲存介面，BotOperation 只透過這些方法讀寫資料
+
+    列索引與 read 顯示的索引相同：0 是標題列，1 開始是資料。
+    修改總和的方法回傳新的總和，沒有更新總和時回傳 None。
+    """
+
+    @abstractmethod
+    def all_values(self):
+        """回傳含標題列的所有列"""
+
+    @abstractmethod
+    def row_count(self):
+        """回傳含標題列的列數"""
+
+    @abstractmethod
+    def get_rows(self, start, end):
+        """回傳索引 [start, end) 的列"""
+
+    def iter_pages(self, page_size):
+        """依序產生不含標題列的資料列，每次最多 page_size 列，不會一次讀入整份帳本"""
+        start = 1
+        while True:
+            page = self.get_rows(start, start + page_size)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            start += page_size
+
+    def get_rows_at(self, indices):
+        """回傳各索引的列，不存在的索引為空 list"""
+        rows = []
+        for index in indices:
+            found = self.get_rows(index, index + 1)
+            rows.append(found[0] if found else [])
+        return rows
+
+    @abstractmethod
+    def append_rows(self, rows, amount):
+        """在末端新增多列，amount 為這些列的金額合計"""
+
+    @abstractmethod
+    def import_rows(self, chunks):
+        """依序新增每一批列，總和只在最後更新一次並回傳；沒有任何列時回傳 None"""
+
+    def delete_row(self, index, amount):
+        """刪除索引 index 的列，amount 為該列金額（無法解析時為 None）"""
+        return self.delete_rows([index], [amount])
+
+    @abstractmethod
+    def delete_rows(self, indices, amounts):
+        """在同一次修改中刪除多列，amounts 為各列金額（無法解析時為 None），都沒有金額時不更新總和"""
+
+    @abstractmethod
+    def update_row(self, index, row, old_amount, new_amount):
+        """以 row 取代索引 index 的列"""
+
+    @abstractmethod
+    def clear(self, header):
+        """建立備份快照後清空帳本只留下標題列，回傳快照名稱"""
+
+    @abstractmethod
+    def revert(self, n=1):
+        """還原第 n 新的快照並回傳快照名稱；快照為空時回傳 None，沒有該快照時拋出 BackupNotFound"""
+
+    @abstractmethod
+    def snapshots(self):
+        """回傳備份快照名稱，新的在前"""
+
+    @abstractmethod
+    def replace_all(self, rows):
+        """以 rows（含標題列）覆寫整份帳本"""
+
+    @staticmethod
+    def _in_period(row, period):
+        if period is None:
+            return True
+        day = day_key(row[COL_TIME])
+        return day is not None and period[0].toordinal() <= day <= period[1].toordinal()
+
+    def sum_by(self, kind, target, period=None):
+        """回傳 (總金額, 是否有金額格式錯誤的列)，kind 為 sum（人名）或 type（分類）
+
+        period 為含頭尾的 (start, end) date 時只加總該日期區間。
+        """
+        idx = COL_NAME if kind == "sum" else COL_TYPE
+        total = 0
+        for row in self.all_values()[1:]:  # 跳過標題列
+            if row and len(row) > idx and row[idx] == target and self._in_period(row, period):
+                try:
+                    total += float(row[COL_AMOUNT])
+                except (ValueError, IndexError):
+                    print(f"金額格式錯誤: {row[COL_AMOUNT]}")
+                    return total, True
+        return total, False
+
+    def summary(self, period):
+        """日期區間內每個人名與每個分類的合計，回傳兩個 {名稱: 金額} dict"""
+        by_name, by_type = {}, {}
+        for row in self.all_values()[1:]:  # 跳過標題列
+            if len(row) <= COL_AMOUNT or not self._in_period(row, period):
+                continue
+            cents = to_cents(row[COL_AMOUNT])
+            if cents is None:
+                continue
+            by_name[row[COL_NAME]] = by_name.get(row[COL_NAME], 0) + cents
+            by_type[row[COL_TYPE]] = by_type.get(row[COL_TYPE], 0) + cents
+        return (
+            {k: v / 100 for k, v in by_name.items() if v},
+            {k: v / 100 for k, v in by_type.items() if v},
+        )
+
+    def categories(self):
+        """回傳排序後的分類清單"""
+        types = set()
+        for row in self.all_values()[1:]:  # 跳過標題列
+            if row and len(row) > COL_TYPE:
+                types.add(row[COL_TYPE])
+        return sorted(types)
+
+    def release(self):
+        """指令用完 open_store 取得的 store 時呼叫"""
+
+
+class SheetsLedgerStore(LedgerStore):
+    """直接讀寫 Google Sheets 工作表"""
+
+    def __init__(self, wks, totals=None, backup_title=None, keep=5):
+        self.wks = wks
+        # FormulaTotals：由試算表公式計算 G1，None 表示讀取後寫回
+        self.totals = totals
+        self.backup_title = backup_title
+        # 保留的備份快照數量
+        self.keep = max(1, keep)
+
+    def all_values(self):
+        return self.wks.get_all_values(
+            include_tailing_empty_rows=False,
+            include_tailing_empty=False
+        )
+
+    def row_count(self):
+        # 只讀取 A 欄來計算列數
+        return len(self.wks.get_col(1, include_tailing_empty=False))
+
+    def get_rows(self, start, end):
+        if start >= end:
+            return []
+        # pygsheets 使用 1-based row number
+        return self.wks.get_values(
+            (start + 1, 1), (end, 5),
+            include_tailing_empty=False,
+            include_tailing_empty_rows=False
+        )
+
+    def get_rows_at(self, indices):
+        if len(indices) <= 1:
+            return super().get_rows_at(indices)
+        # 多列在同一次 batchGet 讀取
+        values = self.wks.get_values_batch([f"A{i + 1}:E{i + 1}" for i in indices])
+        return [rows[0] if rows and any(rows[0]) else [] for rows in values]
+
+    def _add_to_total(self, delta):
+        current_total = float(self.wks.cell("G1").value or 0)
+        new_total = current_total + delta
+        self.wks.update_value("G1", new_total)
+        return new_total
+
+    def _batch_update(self, requests):
+        return self.wks.client.sheet.batch_update(self.wks.spreadsheet.id, requests)
+
+    def _commit_with_total(self, requests, delta):
+        """列的修改與 G1 的新總和在同一次 batchUpdate 送出，回傳新的總和"""
+        try:
+            new_total = float(self.wks.cell("G1").value or 0) + delta
+        except ValueError:
+            # G1 不是數字時只修改列
+            self._batch_update(requests)
+            return None
+        self._batch_update(requests + [total_request(self.wks.id, new_total)])
+        return new_total
+
+    def append_rows(self, rows, amount):
+        if self.totals is not None:
+            # 新增列與總和在同一次請求完成
+            return self.totals.append(rows)
+        self.wks.append_table(values=rows)
+        return self._add_to_total(amount)
+
+    @bulk_priority
+    def import_rows(self, chunks):
+        amount = 0.0
+        count = 0
+        try:
+            for chunk in chunks:
+                # 每一批是一次 append 請求，總和留到最後
+                if self.totals is not None:
+                    self._batch_update([append_request(self.wks.id, chunk)])
+                else:
+                    self.wks.append_table(values=chunk)
+                amount += sum(float(row[COL_AMOUNT]) for row in chunk)
+                count += len(chunk)
+        except Exception as ex:
+            if not count:
+                raise
+            # 已寫入的批次留在試算表上，總和仍要計入它們的金額
+            try:
+                total = self._import_total(amount)
+            except Exception as total_ex:
+                print("匯入中斷後更新總和失敗", total_ex)
+                total = None
+            raise PartialImport(count, amount, total) from ex
+        if not count:
+            return None
+        return self._import_total(amount)
+
+    def _import_total(self, amount):
+        if self.totals is not None:
+            return self.totals.install()
+        return self._add_to_total(amount)
+
+    def delete_rows(self, indices, amounts):
+        # 由下往上刪除，前面的刪除不會讓後面的索引錯位
+        indices = sorted(indices, reverse=True)
+        if self.totals is not None:
+            return self.totals.delete_many(indices)
+        requests = [delete_request(self.wks.id, index) for index in indices]
+        known = [amount for amount in amounts if amount is not None]
+        if not known:
+            self._batch_update(requests)
+            return None
+        return self._commit_with_total(requests, -sum(known))
+
+    def update_row(self, index, row, old_amount, new_amount):
+        if self.totals is not None:
+            # 更新該行與總和在同一次請求完成
+            return self.totals.update(index, row)
+        requests = [update_request(self.wks.id, index, row)]
+        if old_amount == 0 and new_amount == 0:
+            self._batch_update(requests)
+            return None
+        # 減去舊金額，加上新金額
+        return self._commit_with_total(requests, new_amount - old_amount)
+
+    def _backup_title(self):
+        return self.backup_title or f"{self.wks.title}_backup"
+
+    def _sheet_properties(self):
+        """一次讀取試算表內所有工作表的 properties（不含儲存格資料）"""
+        meta = self.wks.client.sheet.get(self.wks.spreadsheet.id, fields="sheets.properties")
+        return [sheet["properties"] for sheet in meta.get("sheets", [])]
+
+    def _snapshots(self, sheets):
+        """備份快照的 properties，新的在前；舊版的單一備份工作表視為最舊的一份"""
+        base = self._backup_title()
+        snapshots = sorted(
+            (p for p in sheets if p["title"].startswith(f"{base}_")),
+            key=lambda p: p["title"], reverse=True,
+        )
+        return snapshots + [p for p in sheets if p["title"] == base]
+
+    def snapshots(self):
+        """回傳備份快照名稱，新的在前"""
+        return [p["title"] for p in self._snapshots(self._sheet_properties())]
+
+    @bulk_priority
+    def clear(self, header):
+        # 只讀取工作表清單，資料由試算表在伺服器端複製
+        sheets = self._sheet_properties()
+        titles = {p["title"] for p in sheets}
+        now = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
+        name = f"{self._backup_title()}_{now:%Y%m%d-%H%M%S}"
+        suffix = 1
+        while name in titles:
+            suffix += 1
+            name = f"{self._backup_title()}_{now:%Y%m%d-%H%M%S}-{suffix}"
+
+        header = list(header)
+        if self.totals is not None:
+            # 由試算表自行計算總和
+            header[-1] = TOTAL_FORMULA
+        requests = [
+            {"duplicateSheet": {"sourceSheetId": self.wks.id, "newSheetName": name, "insertSheetIndex": len(sheets)}},
+            {"updateCells": {"range": {"sheetId": self.wks.id}, "fields": "userEnteredValue"}},
+            {"updateCells": {
+                "rows": [row_data(header)],
+                "fields": "userEnteredValue",
+                "start": {"sheetId": self.wks.id, "rowIndex": 0, "columnIndex": 0},
+            }},
+        ]
+        # 加上這次的快照最多保留 keep 份，刪除較舊的
+        for old in self._snapshots(sheets)[max(0, self.keep - 1):]:
+            requests.append({"deleteSheet": {"sheetId": old["sheetId"]}})
+        self._batch_update(requests)
+        return name
+
+    @bulk_priority
+    def revert(self, n=1):
+        sheets = self._sheet_properties()
+        snapshots = self._snapshots(sheets)
+        if n < 1 or len(snapshots) < n:
+            raise BackupNotFound(self._backup_title())
+        snapshot = snapshots[n - 1]
+        current = next(p for p in sheets if p["sheetId"] == self.wks.id)
+
+        requests = []
+        # 目前工作表的大小要容納得下快照才能貼上
+        grid = current.get("gridProperties", {})
+        source = snapshot.get("gridProperties", {})
+        rows = max(grid.get("rowCount", 0), source.get("rowCount", 0))
+        cols = max(grid.get("columnCount", 0), source.get("columnCount", 0))
+        if (rows, cols) != (grid.get("rowCount"), grid.get("columnCount")):
+            requests.append({"updateSheetProperties": {
+                "properties": {"sheetId": self.wks.id, "gridProperties": {"rowCount": rows, "columnCount": cols}},
+                "fields": "gridProperties.rowCount,gridProperties.columnCount",
+            }})
+        requests += [
+            {"updateCells": {"range": {"sheetId": self.wks.id}, "fields": "userEnteredValue"}},
+            {"copyPaste": {
+                "source": {"sheetId": snapshot["sheetId"]},
+                "destination": {"sheetId": self.wks.id},
+                "pasteType": "PASTE_NORMAL",
+            }},
+        ]
+        if self.totals is not None:
+            # 快照的 G1 可能是數值，與貼上在同一次請求重新寫入公式
+            self.totals.commit(requests)
+        else:
+            self._batch_update(requests)
+        return snapshot["title"]
+
+    @bulk_priority
+    def replace_all(self, rows):
+        self.wks.clear()
+        self.wks.update_values("A1", rows)
+        if self.totals is not None:
+            # 覆寫後 G1 是數值，重新寫入公式
+            self.totals.install()
+
+
+class SnapshotLedgerStore(LedgerStore):
+    """由一次讀取的工作表內容回答查詢，修改只記錄成 batchUpdate 請求
+
+    async 模式下 BotOperation 在記憶體中執行，結束後由呼叫端把 requests
+    以一次 batchUpdate 送出，列的修改與 G1 總和一起寫入。
+    需要備份工作表或分批寫入的指令（UNSUPPORTED）由呼叫端改用同步流程，
+    誤送到這裡時拋出 UnsupportedOperation。
+    """
+
+    UNSUPPORTED = frozenset({"import", "clear", "revert"})
+
+    def __init__(self, values, sheet_id, total=None):
+        self.values = values
+        self.sheet_id = sheet_id
+        # 剛讀取的 G1 內容；None 時使用 values 標題列的 G1（快取可能較舊）
+        self.total = total
+        self.requests = []
+
+    def all_values(self):
+        return self.values
+
+    def row_count(self):
+        return len(self.values)
+
+    def get_rows(self, start, end):
+        return [list(row) for row in self.values[max(start, 0):end]]
+
+    def _total(self):
+        if self.total is not None:
+            return float(self.total or 0)
+        header = self.values[0] if self.values else []
+        return float(header[6] or 0) if len(header) > 6 else 0.0
+
+    def _commit(self, requests, delta):
+        """記錄列的修改與新的總和，回傳新的總和；G1 不是數字時只記錄列的修改"""
+        try:
+            new_total = self._total() + delta
+        except ValueError:
+            self.requests += requests
+            return None
+        self.requests += requests + [total_request(self.sheet_id, new_total)]
+        return new_total
+
+    def append_rows(self, rows, amount):
+        # 與 SheetsLedgerStore 相同，G1 不是數字時拋出 ValueError
+        self._total()
+        return self._commit([append_request(self.sheet_id, rows)], amount)
+
+    def import_rows(self, chunks):
+        raise UnsupportedOperation("import")
+
+    def delete_rows(self, indices, amounts):
+        # 由下往上刪除，前面的刪除不會讓後面的索引錯位
+        requests = [delete_request(self.sheet_id, index) for index in sorted(indices, reverse=True)]
+        known = [amount for amount in amounts if amount is not None]
+        if not known:
+            self.requests += requests
+            return None
+        return self._commit(requests, -sum(known))
+
+    def update_row(self, index, row, old_amount, new_amount):
+        requests = [update_request(self.sheet_id, index, row)]
+        if old_amount == 0 and new_amount == 0:
+            self.requests += requests
+            return None
+        return self._commit(requests, new_amount - old_amount)
+
+    def clear(self, header):
+        raise UnsupportedOperation("clear")
+
+    def revert(self, n=1):
+        raise UnsupportedOperation("revert")
+
+    def snapshots(self):
+        raise UnsupportedOperation("revert list")
+
+    def replace_all(self, rows):
+        raise UnsupportedOperation("replace_all")
+
+
+class SQLiteLedgerStore(LedgerStore):
+    """本機 SQLite 帳本，人名、分類、時間都有索引
+
+    同一個檔案可存放多本帳本，以 ledger 欄位區分。
+    總和在同一個 transaction 中增量維護，查詢不需掃描資料。
+    clear 不複製資料：目前的 segment 直接成為快照，帳本改用新的空 segment。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ledger TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            name TEXT NOT NULL,
+            item TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount TEXT NOT NULL,
+            cents INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS ledgers (
+            ledger TEXT PRIMARY KEY,
+            total_cents INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ledger TEXT NOT NULL,
+            segment INTEGER NOT NULL,
+            created TEXT NOT NULL,
+            total_cents INTEGER NOT NULL,
+            rows INTEGER NOT NULL
+        );
+    """
+    # 舊版資料庫沒有 segment 欄位，建立索引前先補上
+    MIGRATIONS = (
+        ("entries", "segment", "ALTER TABLE entries ADD COLUMN segment INTEGER NOT NULL DEFAULT 0"),
+        ("ledgers", "segment", "ALTER TABLE ledgers ADD COLUMN segment INTEGER NOT NULL DEFAULT 0"),
+    )
+    INDEXES = """
+        DROP INDEX IF EXISTS idx_entries_name;
+        DROP INDEX IF EXISTS idx_entries_category;
+        DROP INDEX IF EXISTS idx_entries_ts;
+        CREATE INDEX IF NOT EXISTS idx_entries_segment_name ON entries (ledger, segment, name);
+        CREATE INDEX IF NOT EXISTS idx_entries_segment_category ON entries (ledger, segment, category);
+        CREATE INDEX IF NOT EXISTS idx_entries_segment_ts ON entries (ledger, segment, ts);
+        CREATE INDEX IF NOT EXISTS idx_snapshots_ledger ON snapshots (ledger, id);
+    """
+    COLUMNS = "ts, name, item, category, amount"
+
+    def __init__(self, path, ledger="expense", keep=5):
+        self.path = path
+        self.ledger = ledger
+        # 保留的備份快照數量
+        self.keep = max(1, keep)
+        self._lock = threading.RLock()
+        self._db = self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if self.path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+        for table, column, sql in self.MIGRATIONS:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(sql)
+        conn.executescript(self.INDEXES)
+        conn.execute("INSERT OR IGNORE INTO ledgers (ledger) VALUES (?)", (self.ledger,))
+        return conn
+
+    @property
+    def _conn(self):
+        """SQLite 連線，close() 之後又被使用時重新開啟"""
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._connect()
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _record(self, row, segment):
+        row = [str(value) for value in row] + [""] * (5 - len(row))
+        return (self.ledger, segment, *row[:5], to_cents(row[COL_AMOUNT]))
+
+    def _segment(self):
+        """目前帳本資料所在的 segment"""
+        return self._conn.execute(
+            "SELECT segment FROM ledgers WHERE ledger = ?", (self.ledger,)
+        ).fetchone()[0]
+
+    def _scope(self):
+        return (self.ledger, self._segment())
+
+    def _total_cents(self):
+        return self._conn.execute(
+            "SELECT total_cents FROM ledgers WHERE ledger = ?", (self.ledger,)
+        ).fetchone()[0]
+
+    def _add_cents(self, delta):
+        self._conn.execute(
+            "UPDATE ledgers SET total_cents = total_cents + ? WHERE ledger = ?", (delta, self.ledger)
+        )
+        return self._total_cents() / 100
+
+    def _id_at(self, index):
+        row = self._conn.execute(
+            "SELECT id FROM entries WHERE ledger = ? AND segment = ? ORDER BY id LIMIT 1 OFFSET ?",
+            (*self._scope(), index - 1),
+        ).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return row[0]
+
+    def header(self):
+        return HEADER + [format_total(self._total_cents() / 100)]
+
+    def all_values(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self.COLUMNS} FROM entries WHERE ledger = ? AND segment = ? ORDER BY id", self._scope()
+            ).fetchall()
+            return [self.header()] + [list(row) for row in rows]
+
+    def row_count(self):
+        with self._lock:
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE ledger = ? AND segment = ?", self._scope()
+            ).fetchone()[0]
+            return count + 1
+
+    def get_rows(self, start, end):
+        with self._lock:
+            rows = []
+            if start == 0:
+                rows.append(self.header())
+                start = 1
+            if end > start:
+                rows.extend(list(row) for row in self._conn.execute(
+                    f"SELECT {self.COLUMNS} FROM entries WHERE ledger = ? AND segment = ? ORDER BY id LIMIT ? OFFSET ?",
+                    (*self._scope(), end - start, start - 1),
+                ))
+            return rows
+
+    def iter_pages(self, page_size):
+        # 以 id 接續查詢（keyset），每頁的成本不隨 OFFSET 增加
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, {self.COLUMNS} FROM entries WHERE ledger = ? AND segment = ? AND id > ? "
+                    f"ORDER BY id LIMIT ?",
+                    (*self._scope(), last_id, page_size),
+                ).fetchall()
+            if rows:
+                last_id = rows[-1][0]
+                yield [list(row[1:]) for row in rows]
+            if len(rows) < page_size:
+                return
+
+    def append_rows(self, rows, amount):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            segment = self._segment()
+            records = [self._record(row, segment) for row in rows]
+            self._conn.executemany(
+                f"INSERT INTO entries (ledger, segment, {self.COLUMNS}, cents) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            return self._add_cents(sum(record[-1] or 0 for record in records))
+
+    def import_rows(self, chunks):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            segment = self._segment()
+            cents = 0
+            imported = False
+            for chunk in chunks:
+                records = [self._record(row, segment) for row in chunk]
+                self._conn.executemany(
+                    f"INSERT INTO entries (ledger, segment, {self.COLUMNS}, cents) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    records,
+                )
+                cents += sum(record[-1] or 0 for record in records)
+                imported = True
+            if not imported:
+                return None
+            return self._add_cents(cents)
+
+    def delete_rows(self, indices, amounts):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            # 先取得所有 id 再刪除，避免索引錯位
+            entry_ids = [self._id_at(index) for index in indices]
+            known = []
+            for entry_id in entry_ids:
+                cents = self._conn.execute("SELECT cents FROM entries WHERE id = ?", (entry_id,)).fetchone()[0]
+                if cents is not None:
+                    known.append(cents)
+                self._conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+            if not known:
+                return None
+            return self._add_cents(-sum(known))
+
+    def update_row(self, index, row, old_amount, new_amount):
+        record = self._record(row, None)
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            entry_id = self._id_at(index)
+            old_cents = self._conn.execute("SELECT cents FROM entries WHERE id = ?", (entry_id,)).fetchone()[0]
+            self._conn.execute(
+                "UPDATE entries SET ts = ?, name = ?, item = ?, category = ?, amount = ?, cents = ? WHERE id = ?",
+                (*record[2:], entry_id),
+            )
+            return self._add_cents((record[-1] or 0) - (old_cents or 0))
+
+    def clear(self, header):
+        now = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
+        created = f"{now:%Y%m%d-%H%M%S}"
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            segment = self._segment()
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE ledger = ? AND segment = ?", (self.ledger, segment)
+            ).fetchone()[0]
+            # 目前的 segment 原地成為快照，不複製任何列
+            snapshot_id = self._conn.execute(
+                "INSERT INTO snapshots (ledger, segment, created, total_cents, rows) VALUES (?, ?, ?, ?, ?)",
+                (self.ledger, segment, created, self._total_cents(), count),
+            ).lastrowid
+            # 快照 id 遞增，可直接當作新的 segment 編號
+            self._conn.execute(
+                "UPDATE ledgers SET total_cents = 0, segment = ? WHERE ledger = ?", (snapshot_id, self.ledger)
+            )
+            for old_id, old_segment in self._conn.execute(
+                "SELECT id, segment FROM snapshots WHERE ledger = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+                (self.ledger, self.keep),
+            ).fetchall():
+                self._conn.execute("DELETE FROM entries WHERE ledger = ? AND segment = ?", (self.ledger, old_segment))
+                self._conn.execute("DELETE FROM snapshots WHERE id = ?", (old_id,))
+        return f"entries_backup_{created}"
+
+    def revert(self, n=1):
+        with self._lock, self._conn:
+            snapshot = self._conn.execute(
+                "SELECT segment, created, total_cents, rows FROM snapshots "
+                "WHERE ledger = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (self.ledger, n - 1),
+            ).fetchone() if n >= 1 else None
+            if snapshot is None:
+                raise BackupNotFound("entries_backup")
+            source, created, total_cents, count = snapshot
+            if count == 0:
+                return None
+            self._conn.execute("BEGIN")
+            segment = self._segment()
+            self._conn.execute("DELETE FROM entries WHERE ledger = ? AND segment = ?", (self.ledger, segment))
+            # 快照保持不變，之後仍可再次還原
+            self._conn.execute(
+                f"INSERT INTO entries (ledger, segment, {self.COLUMNS}, cents) "
+                f"SELECT ledger, ?, {self.COLUMNS}, cents FROM entries WHERE ledger = ? AND segment = ? ORDER BY id",
+                (segment, self.ledger, source),
+            )
+            self._conn.execute(
+                "UPDATE ledgers SET total_cents = ? WHERE ledger = ?", (total_cents, self.ledger)
+            )
+        return f"entries_backup_{created}"
+
+    def snapshots(self):
+        with self._lock:
+            return [f"entries_backup_{row[0]}" for row in self._conn.execute(
+                "SELECT created FROM snapshots WHERE ledger = ? ORDER BY id DESC", (self.ledger,)
+            )]
+
+    def _recompute_total(self):
+        self._conn.execute(
+            "UPDATE ledgers SET total_cents = "
+            "(SELECT COALESCE(SUM(cents), 0) FROM entries WHERE ledger = ? AND segment = ?) WHERE ledger = ?",
+            (*self._scope(), self.ledger),
+        )
+
+    def replace_all(self, rows):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            segment = self._segment()
+            records = [self._record(row, segment) for row in rows[1:]]  # 跳過標題列
+            self._conn.execute("DELETE FROM entries WHERE ledger = ? AND segment = ?", (self.ledger, segment))
+            self._conn.executemany(
+                f"INSERT INTO entries (ledger, segment, {self.COLUMNS}, cents) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            self._recompute_total()
+
+    def is_empty(self):
+        return self.row_count() == 1
+
+    def sum_by(self, kind, target, period=None):
+        column = "name" if kind == "sum" else "category"
+        # 時間欄是 YYYY-MM-DD HH:MM:SS，可以直接以字串比較區間
+        low, high = period_bounds(*period) if period else ("", "\uffff")
+        with self._lock:
+            cents, invalid = self._conn.execute(
+                f"SELECT COALESCE(SUM(cents), 0), SUM(cents IS NULL) FROM entries "
+                f"WHERE ledger = ? AND segment = ? AND {column} = ? AND ts >= ? AND ts < ?",
+                (*self._scope(), target, low, high),
+            ).fetchone()
+        if invalid:
+            return cents / 100, True
+        # 與試算表版本一致：沒有符合的資料時為整數 0
+        return (cents / 100 if cents else 0), False
+
+    def summary(self, period):
+        low, high = period_bounds(*period)
+        result = []
+        with self._lock:
+            for column in ("name", "category"):
+                rows = self._conn.execute(
+                    f"SELECT {column}, SUM(cents) FROM entries WHERE ledger = ? AND segment = ? "
+                    f"AND ts >= ? AND ts < ? AND cents IS NOT NULL GROUP BY {column}",
+                    (*self._scope(), low, high),
+                )
+                result.append({key: cents / 100 for key, cents in rows if cents})
+        return tuple(result)
+
+    def categories(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT category FROM entries WHERE ledger = ? AND segment = ? ORDER BY category",
+                self._scope(),
+            )]
+
+
+class MirroredLedgerStore(LedgerStore):
+    """以 primary 為主要儲存，修改依序在背景同步到 mirror
+
+    例如 primary 是 SQLiteLedgerStore、mirror 是 SheetsLedgerStore 時，
+    指令只等待本機資料庫，試算表變成非同步更新的檢視。
+    同步失敗時會以 primary 的內容整份覆寫 mirror。
+    """
+
+    def __init__(self, primary, mirror):
+        self.primary = primary
+        self.mirror = mirror
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._close_lock = threading.Lock()
+        self._needs_resync = False
+        # 使用中的指令數，由 open_store 在 _sqlite_lock 內增減；大於 0 時不會被關閉
+        self._users = 0
+
+    def bootstrap(self):
+        """primary 還沒有資料時，先從 mirror 匯入一次"""
+        if self.primary.is_empty():
+            rows = self.mirror.all_values()
+            if len(rows) > 1:
+                self.primary.replace_all(rows)
+        return self
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _enqueue(self, method, *args):
+        self._start()
+        self._queue.put((method, args))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            method, args = item
+            try:
+                with bulk():
+                    self._sync(method, args)
+            except Exception as ex:
+                print("同步試算表失敗", ex)
+                # 後續的索引可能已經錯位，下一次改為整份覆寫
+                self._needs_resync = True
+            finally:
+                self._queue.task_done()
+
+    def _sync(self, method, args):
+        if self._needs_resync:
+            self._needs_resync = False
+            self.mirror.replace_all(self.primary.all_values())
+        else:
+            getattr(self.mirror, method)(*args)
+
+    def flush(self):
+        """等待所有修改同步完成"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """同步完剩下的修改後停止背景執行緒，並關閉 primary
+
+        同時呼叫時都會等到同步完成才回傳。
+        """
+        with self._close_lock:
+            with self._lock:
+                thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+                thread.join()
+                atexit.unregister(self.flush)
+            self.primary.close()
+
+    def release(self):
+        with _sqlite_lock:
+            self._users -= 1
+
+    def all_values(self):
+        return self.primary.all_values()
+
+    def row_count(self):
+        return self.primary.row_count()
+
+    def get_rows(self, start, end):
+        return self.primary.get_rows(start, end)
+
+    def sum_by(self, kind, target, period=None):
+        return self.primary.sum_by(kind, target, period)
+
+    def summary(self, period):
+        return self.primary.summary(period)
+
+    def categories(self):
+        return self.primary.categories()
+
+    def append_rows(self, rows, amount):
+        total = self.primary.append_rows(rows, amount)
+        self._enqueue("append_rows", rows, amount)
+        return total
+
+    def get_rows_at(self, indices):
+        return self.primary.get_rows_at(indices)
+
+    def iter_pages(self, page_size):
+        return self.primary.iter_pages(page_size)
+
+    def import_rows(self, chunks):
+        chunks = [list(chunk) for chunk in chunks]
+        total = self.primary.import_rows(chunks)
+        if total is not None:
+            self._enqueue("import_rows", chunks)
+        return total
+
+    def delete_row(self, index, amount):
+        total = self.primary.delete_row(index, amount)
+        self._enqueue("delete_row", index, amount)
+        return total
+
+    def delete_rows(self, indices, amounts):
+        total = self.primary.delete_rows(indices, amounts)
+        self._enqueue("delete_rows", indices, amounts)
+        return total
+
+    def update_row(self, index, row, old_amount, new_amount):
+        total = self.primary.update_row(index, row, old_amount, new_amount)
+        self._enqueue("update_row", index, row, old_amount, new_amount)
+        return total
+
+    def clear(self, header):
+        backup = self.primary.clear(header)
+        # mirror 也在自己的伺服器端建立快照
+        self._enqueue("clear", header)
+        return backup
+
+    def revert(self, n=1):
+        snapshot = self.primary.revert(n)
+        if snapshot is not None:
+            # 兩邊的快照可能因同步失敗而不一致，以 primary 還原後的內容為準
+            self._enqueue("replace_all", self.primary.all_values())
+        return snapshot
+
+    def snapshots(self):
+        return self.primary.snapshots()
+
+    def replace_all(self, rows):
+        self.primary.replace_all(rows)
+        self._enqueue("replace_all", rows)
+
+
+# 最近使用的在最後，超過 SQLITE_STORE_CACHE_SIZE 時關閉最久沒用且沒有指令使用中的
+_sqlite_stores = OrderedDict()
+# 正在開啟的 key -> [開啟鎖, 等待中的執行緒數]，同一個 key 只有一個執行緒執行 bootstrap
+_sqlite_opening = {}
+# 已移出快取、還在同步剩餘修改的 store，同一個 key 重新開啟前要等它關閉
+_sqlite_closing = {}
+_sqlite_lock = threading.Lock()
+
+
+def _cached_store(key, sheets, limit):
+    """回傳 (快取中的 store 或 None, 移出快取的 store)"""
+    with _sqlite_lock:
+        store = _sqlite_stores.get(key)
+        if store is None:
+            return None, []
+        # worksheet handle 可能已重新開啟
+        store.mirror = sheets
+        store._users += 1
+        _sqlite_stores.move_to_end(key)
+        # 先前使用中而留下的 store 可能已經用完
+        return store, _evict(limit)
+
+
+def _evict(limit):
+    """移出超過上限且沒有使用中的 store，需持有 _sqlite_lock"""
+    evicted = []
+    for key in list(_sqlite_stores):
+        if len(_sqlite_stores) <= limit:
+            break
+        if not _sqlite_stores[key]._users:
+            evicted.append((key, _sqlite_stores.pop(key)))
+            _sqlite_closing[key] = evicted[-1][1]
+    return evicted
+
+
+def _close_evicted(evicted):
+    # 等待背景同步結束，不佔用 _sqlite_lock
+    for key, store in evicted:
+        store.close()
+        with _sqlite_lock:
+            if _sqlite_closing.get(key) is store:
+                del _sqlite_closing[key]
+
+
+def _bootstrap(key, sheets, config, limit):
+    """建立並加入快取，呼叫端持有 key 的開啟鎖"""
+    with _sqlite_lock:
+        closing = _sqlite_closing.get(key)
+    if closing is not None:
+        # 舊的 store 同步完剩下的修改後才開始新的同步順序
+        closing.close()
+    # 下載整份工作表可能需要數秒，不佔用 _sqlite_lock，其他帳本的指令照常執行
+    primary = SQLiteLedgerStore(
+        config.SQLITE_PATH, ledger=f"{config.GSPREADSHEET}/{config.GWORKSHEET}", keep=config.BACKUP_KEEP
+    )
+    store = MirroredLedgerStore(primary, sheets).bootstrap()
+    with _sqlite_lock:
+        store._users += 1
+        _sqlite_stores[key] = store
+        return store, _evict(limit)
+
+
+def open_store(wks, config):
+    """依 LEDGER_BACKEND 建立 BotOperation 使用的 LedgerStore
+
+    指令結束時要呼叫 store.release()，使用中的 store 不會被關閉，
+    同一個工作表不會有兩個背景執行緒各自同步。
+    """
+    totals = FormulaTotals(wks) if config.TOTAL_MODE == "formula" else None
+    sheets = SheetsLedgerStore(
+        wks, totals=totals, backup_title=f"{config.GWORKSHEET}_backup", keep=config.BACKUP_KEEP
+    )
+    if config.LEDGER_BACKEND != "sqlite":
+        return sheets
+    key = (config.SQLITE_PATH, config.GSPREADSHEET, config.GWORKSHEET)
+    limit = max(1, config.SQLITE_STORE_CACHE_SIZE)
+    store, evicted = _cached_store(key, sheets, limit)
+    if store is not None:
+        _close_evicted(evicted)
+        return store
+    with _sqlite_lock:
+        opening = _sqlite_opening.get(key)
+        if opening is None:
+            opening = _sqlite_opening[key] = [threading.Lock(), 0]
+        opening[1] += 1
+    try:
+        with opening[0]:
+            store, evicted = _cached_store(key, sheets, limit)
+            if store is None:
+                store, evicted = _bootstrap(key, sheets, config, limit)
+    finally:
+        with _sqlite_lock:
+            opening[1] -= 1
+            if not opening[1]:
+                del _sqlite_opening[key]
+    _close_evicted(evicted)
+    return store
+
@@ -0,0 +1,101 @@
+import calendar
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+
+def day_key(timestamp):
+    """把 "YYYY-MM-DD HH:MM:SS" 轉成日期序號（date.toordinal），無法解析時回傳 None"""
+    try:
+        return date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_bound(text, end=False):
+    """YYYY-MM 或 YYYY-MM-DD，end 為 True 時取該月的最後一天"""
+    parts = text.split("-")
+    if len(parts) == 2:
+        year, month = int(parts[0]), int(parts[1])
+        day = calendar.monthrange(year, month)[1] if end else 1
+        return date(year, month, day)
+    if len(parts) == 3:
+        return date(int(parts[0]), int(parts[1]), int(parts[2]))
+    raise ValueError(text)
+
+
+def parse_period(text):
+    """解析 2025-01、2025-01-05 或 2025-01-01~2025-01-15，回傳含頭尾的 (start, end) date
+
+    格式錯誤時拋出 ValueError。
+    """
+    start, sep, end = text.partition("~")
+    start_date = _parse_bound(start.strip())
+    end_date = _parse_bound((end if sep else start).strip(), end=True)
+    if end_date < start_date:
+        raise ValueError(text)
+    return start_date, end_date
+
+
+def period_bounds(start, end):
+    """轉成時間字串的 [下限, 上限)，用於字串比較（例如 SQL 的 ts 欄位）"""
+    return start.isoformat(), (end + timedelta(days=1)).isoformat()
+
+
+def month_period(day):
+    """day 所在月份的 (start, end)"""
+    last = calendar.monthrange(day.year, day.month)[1]
+    return day.replace(day=1), day.replace(day=last)
+
+
+class DaySeries:
+    """單一人名或分類每天的金額（分），依日期排序
+
+    查詢區間時以 bisect 找出頭尾再用前綴和相減，不需要掃描每一列；
+    修改只影響一天的值，前綴和在下次查詢時才重算（天數遠少於列數）。
+    """
+
+    __slots__ = ("days", "cents", "_prefix")
+
+    def __init__(self):
+        self.days = []
+        self.cents = []
+        self._prefix = None
+
+    @classmethod
+    def from_totals(cls, totals):
+        """由 {日期序號: 金額} 一次建立，略過合計為 0 的日期"""
+        series = cls()
+        for day in sorted(totals):
+            if totals[day]:
+                series.days.append(day)
+                series.cents.append(totals[day])
+        return series
+
+    def add(self, day, cents):
+        i = bisect_left(self.days, day)
+        if i < len(self.days) and self.days[i] == day:
+            self.cents[i] += cents
+            if self.cents[i] == 0:
+                del self.days[i]
+                del self.cents[i]
+        elif cents:
+            self.days.insert(i, day)
+            self.cents.insert(i, cents)
+        self._prefix = None
+
+    def total(self, start, end):
+        """start 到 end（含）的合計，參數為日期序號"""
+        if self._prefix is None:
+            prefix = [0]
+            for cents in self.cents:
+                prefix.append(prefix[-1] + cents)
+            self._prefix = prefix
+        lo = bisect_left(self.days, start)
+        hi = bisect_right(self.days, end)
+        return self._prefix[hi] - self._prefix[lo]
+
+    def __eq__(self, other):
+        return isinstance(other, DaySeries) and self.days == other.days and self.cents == other.cents
+
+    def __repr__(self):
+        return f"DaySeries({dict(zip(self.days, self.cents))})"
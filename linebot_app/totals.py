@@ -0,0 +1,148 @@
+import math
+import re
+from datetime import datetime
+
+# 總和所在儲存格與公式（E 欄為費用，第 1 列是標題）
+TOTAL_ROW = 0
+TOTAL_COL = 6
+TOTAL_FORMULA = "=SUM(E2:E)"
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Google Sheets 日期序號的起點
+SHEETS_EPOCH = datetime(1899, 12, 30)
+# 只有十進位數字（可含指數）存成數值；nan、inf、1_000 等 float() 也接受的文字仍是字串
+NUMBER = re.compile(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?")
+
+
+def cell_data(value):
+    """把字串轉成與 USER_ENTERED 相同解析結果的 CellData"""
+    text = str(value)
+    if text.startswith("="):
+        return {"userEnteredValue": {"formulaValue": text}}
+    if NUMBER.fullmatch(text) and math.isfinite(float(text)):
+        return {"userEnteredValue": {"numberValue": float(text)}}
+    try:
+        dt = datetime.strptime(text, TIMESTAMP_FORMAT)
+    except ValueError:
+        return {"userEnteredValue": {"stringValue": text}}
+    serial = (dt - SHEETS_EPOCH).total_seconds() / 86400
+    return {
+        "userEnteredValue": {"numberValue": serial},
+        "userEnteredFormat": {
+            "numberFormat": {"type": "DATE_TIME", "pattern": "yyyy-mm-dd hh:mm:ss"}
+        },
+    }
+
+
+def row_data(row):
+    return {"values": [cell_data(value) for value in row]}
+
+
+def append_request(sheet_id, rows):
+    return {
+        "appendCells": {
+            "sheetId": sheet_id,
+            "rows": [row_data(row) for row in rows],
+            "fields": "userEnteredValue,userEnteredFormat.numberFormat",
+        }
+    }
+
+
+def delete_request(sheet_id, index):
+    """index 為 0-based 的列索引（與 read 顯示的索引相同）"""
+    return {
+        "deleteDimension": {
+            "range": {
+                "sheetId": sheet_id,
+                "dimension": "ROWS",
+                "startIndex": index,
+                "endIndex": index + 1,
+            }
+        }
+    }
+
+
+def update_request(sheet_id, index, row):
+    return {
+        "updateCells": {
+            "rows": [row_data(row)],
+            "fields": "userEnteredValue,userEnteredFormat.numberFormat",
+            "start": {"sheetId": sheet_id, "rowIndex": index, "columnIndex": 0},
+        }
+    }
+
+
+def total_request(sheet_id, value):
+    """把 G1 設為 value（數值或公式）"""
+    return {
+        "updateCells": {
+            "rows": [row_data([value])],
+            "fields": "userEnteredValue",
+            "start": {"sheetId": sheet_id, "rowIndex": TOTAL_ROW, "columnIndex": TOTAL_COL},
+        }
+    }
+
+
+class FormulaTotals:
+    """以試算表公式維護 G1 總和
+
+    G1 存放 =SUM(E2:E)，由試算表自行計算；每次修改列的請求與重新寫入公式
+    放在同一個 batchUpdate，並要求回傳 G1 的計算結果，
+    所以不需要另外讀取 G1，同時修改的指令也不會互相覆蓋總和。
+    """
+
+    FIELDS = "updatedSpreadsheet.sheets.data.rowData.values.effectiveValue"
+
+    def __init__(self, wks):
+        self.wks = wks
+
+    def _total_request(self):
+        return total_request(self.wks.id, TOTAL_FORMULA)
+
+    def commit(self, requests):
+        """送出列的修改並回傳同一次請求計算出的新總和"""
+        response = self.wks.client.sheet.batch_update(
+            self.wks.spreadsheet.id,
+            list(requests) + [self._total_request()],
+            includeSpreadsheetInResponse=True,
+            responseRanges=[f"'{self.wks.title}'!G1"],
+            responseIncludeGridData=True,
+            fields=self.FIELDS,
+        )
+        return self._parse_total(response)
+
+    @staticmethod
+    def _parse_total(response):
+        try:
+            sheet = response["updatedSpreadsheet"]["sheets"][0]
+            cell = sheet["data"][0]["rowData"][0]["values"][0]
+            return float(cell["effectiveValue"]["numberValue"])
+        except (KeyError, IndexError, TypeError):
+            # 公式結果為空（表單沒有任何金額）
+            return 0.0
+
+    def install(self):
+        """寫入 G1 公式並回傳目前總和"""
+        return self.commit([])
+
+    def append_request(self, rows):
+        return append_request(self.wks.id, rows)
+
+    def delete_request(self, index):
+        return delete_request(self.wks.id, index)
+
+    def update_request(self, index, row):
+        return update_request(self.wks.id, index, row)
+
+    def append(self, rows):
+        return self.commit([self.append_request(rows)])
+
+    def delete(self, index):
+        return self.commit([self.delete_request(index)])
+
+    def delete_many(self, indices):
+        """indices 需由大到小排列，前面的刪除才不會讓後面的索引錯位"""
+        return self.commit([self.delete_request(index) for index in indices])
+
+    def update(self, index, row):
+        return self.commit([self.update_request(index, row)])
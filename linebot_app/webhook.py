@@ -0,0 +1,90 @@
+import base64
+import hashlib
+import hmac
+import json
+from collections import namedtuple
+
+# 只保留指令處理需要的欄位，取代 linebot.models 的完整物件
+LineEvent = namedtuple(
+    "LineEvent",
+    [
+        "type",
+        "reply_token",
+        "message_type",
+        "text",
+        "message_id",
+        "source_type",
+        "source_id",
+        "user_id",
+        "webhook_event_id",
+        "is_redelivery",
+        "timestamp",
+        "file_name",
+    ],
+    defaults=(None,),
+)
+
+# 可以用 import 匯入的上傳檔案
+IMPORT_EXTENSIONS = (".csv", ".tsv", ".txt")
+
+
+def is_text(event):
+    """是否為非空白的文字訊息事件"""
+    return event.type == "message" and event.message_type == "text" and event.text != ""
+
+
+def is_import_file(event):
+    """是否為可匯入的檔案訊息事件（CSV 或純文字）"""
+    return (
+        event.type == "message"
+        and event.message_type == "file"
+        and (event.file_name or "").lower().endswith(IMPORT_EXTENSIONS)
+    )
+
+
+def to_event(raw):
+    """把 webhook JSON 中的單一事件轉成 LineEvent"""
+    message = raw.get("message") or {}
+    source = raw.get("source") or {}
+    delivery = raw.get("deliveryContext") or {}
+    return LineEvent(
+        type=raw.get("type"),
+        reply_token=raw.get("replyToken"),
+        message_type=message.get("type"),
+        text=message.get("text", ""),
+        message_id=message.get("id"),
+        source_type=source.get("type"),
+        # 群組、多人聊天室、一對一聊天依序取 groupId、roomId、userId
+        source_id=source.get("groupId") or source.get("roomId") or source.get("userId"),
+        user_id=source.get("userId"),
+        webhook_event_id=raw.get("webhookEventId"),
+        is_redelivery=bool(delivery.get("isRedelivery", False)),
+        timestamp=raw.get("timestamp"),
+        file_name=message.get("fileName"),
+    )
+
+
+class WebhookParser:
+    """以原始 bytes 驗證簽章並只解析一次 webhook"""
+
+    def __init__(self, channel_secret):
+        self._secret = (channel_secret or "").encode("utf-8")
+
+    def signature_for(self, body):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        digest = hmac.new(self._secret, body, hashlib.sha256).digest()
+        return base64.b64encode(digest).decode("utf-8")
+
+    def verify(self, body, signature):
+        return hmac.compare_digest(self.signature_for(body), signature or "")
+
+    def parse(self, body, signature):
+        """驗證 X-Line-Signature 並回傳 LineEvent list，簽章錯誤時拋出 InvalidSignatureError"""
+        if not self.verify(body, signature):
+            # linebot.v3 載入很慢，只有簽章錯誤時才需要
+            from linebot.v3.exceptions import InvalidSignatureError
+
+            raise InvalidSignatureError("Invalid signature. signature=" + str(signature))
+        payload = json.loads(body)
+        return [to_event(raw) for raw in payload.get("events", [])]
@@ -3,6 +3,8 @@ from unittest.mock import Mock
 
 import pytest
 
+from linebot_app.webhook import WebhookParser
+
 
 @pytest.fixture
 def mock_config():
@@ -15,6 +17,38 @@ def mock_config():
     config.GWORKSHEET = "test_worksheet"
     config.GOOGLE_SHEET_URL = "https://test.com"
     config.THRESHOLD_AMOUNT = 6000
+    config.LEDGER_SCOPE = "shared"
+    config.WORKSHEET_CACHE_SIZE = 128
+    config.WORKSHEET_IDLE_SECONDS = 1800
+    config.PREWARM_CLIENTS = False
+    config.GOOGLE_API_ENDPOINT = ""
+    config.LINE_API_ENDPOINT = "https://api.line.me"
+    config.LINE_DATA_ENDPOINT = "https://api-data.line.me"
+    config.IMPORT_CHUNK_SIZE = 500
+    config.BACKUP_KEEP = 5
+    config.LEDGER_CACHE_MAX_AGE = 300
+    config.LEDGER_CACHE_SIZE = 128
+    config.LEDGER_CACHE_IDLE_SECONDS = 1800
+    config.WRITE_BATCH_WINDOW_MS = 0
+    config.TOTAL_MODE = "read_write"
+    config.ASYNC_ACK = False
+    config.ASYNC_HTTP_POOL_SIZE = 100
+    config.ASYNC_HTTP_TIMEOUT = 30
+    config.DEDUP_TTL_SECONDS = 86400
+    config.DEDUP_MAX_EVENTS = 100000
+    config.DEDUP_PATH = ""
+    config.READ_PAGE_SIZE = 50
+    config.REPORT_TOP_N = 5
+    config.EXPORT_DIR = "/tmp/linebot_exports_test"
+    config.EXPORT_BASE_URL = "https://bot.test"
+    config.EXPORT_BUCKET = ""
+    config.EXPORT_PAGE_SIZE = 5000
+    config.EXPORT_MAX_AGE = 3600
+    config.LEDGER_BACKEND = "sheets"
+    config.SQLITE_PATH = ":memory:"
+    config.SQLITE_STORE_CACHE_SIZE = 32
+    config.METRICS_ENABLED = True
+    config.TRACE_LOG = False
     return config
 
 @pytest.fixture
@@ -88,3 +122,24 @@ def mock_flask_request(sample_webhook_data):
     request.args = {}
     return request
 
+@pytest.fixture
+def signed_request(mock_config):
+    """依 webhook 資料產生簽章正確的 Flask request mock"""
+    def _make(data):
+        body = json.dumps(data).encode("utf-8")
+        request = Mock()
+        request.headers = {
+            "X-Line-Signature": WebhookParser(mock_config.LINE_CHANNEL_SECRET).signature_for(body)
+        }
+        request.get_data.return_value = body
+        request.args = {}
+        return request
+    return _make
+
+@pytest.fixture
+def mock_registry(mock_config):
+    """模擬 ClientRegistry，使用真正的 WebhookParser 驗證簽章"""
+    registry = Mock()
+    registry.config = mock_config
+    registry.parser = WebhookParser(mock_config.LINE_CHANNEL_SECRET)
+    return registry
@@ -0,0 +1,211 @@
+import asyncio
+import itertools
+import json
+from unittest.mock import patch
+
+import pytest
+
+from benchmarks.fake_server import FakeApiServer
+from benchmarks.fake_sheets import make_rows
+from benchmarks.run import bench_config
+from linebot_app import asgi
+from linebot_app.async_http import AsyncApiError, AsyncSheetsApi
+from linebot_app.clients import ClientRegistry
+from linebot_app.dedup import EventDeduplicator
+from linebot_app.ledger import LedgerCache
+from linebot_app.quota import SheetsScheduler
+from linebot_app.store import SnapshotLedgerStore, UnsupportedOperation
+from linebot_app.webhook import WebhookParser
+
+ROWS = [
+    ["時間", "人名", "品項", "分類", "費用", "總和", "150"],
+    ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"],
+    ["2025-01-02 12:00:00", "小華", "捷運", "交通", "50"],
+]
+
+_event_ids = itertools.count()
+
+
+class TestSnapshotLedgerStore:
+    def test_records_requests(self):
+        """測試修改只記錄成 batchUpdate 請求，總和由讀取時的 G1 計算"""
+        store = SnapshotLedgerStore(ROWS, 7)
+
+        assert store.append_rows([["2025-01-03 12:00:00", "小美", "晚餐", "餐飲", "30"]], 30) == 180
+        assert store.delete_rows([1, 2], [100, 50]) == 0
+        assert store.update_row(1, ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "0"], 0, 0) is None
+
+        kinds = [next(iter(request)) for request in store.requests]
+        assert kinds == ["appendCells", "updateCells", "deleteDimension", "deleteDimension", "updateCells", "updateCells"]
+        assert store.requests[2]["deleteDimension"]["range"]["startIndex"] == 2
+        assert store.all_values() is ROWS
+
+    def test_unsupported(self):
+        """測試需要備份或分批寫入的操作拋出 UnsupportedOperation，不會記錄任何請求"""
+        store = SnapshotLedgerStore(ROWS, 7)
+        for call in (
+            lambda: store.clear(ROWS[0]), store.revert, store.snapshots,
+            lambda: store.import_rows([]), lambda: store.replace_all(ROWS),
+        ):
+            with pytest.raises(UnsupportedOperation):
+                call()
+        assert store.requests == []
+
+
+@pytest.fixture
+def server():
+    with FakeApiServer() as server:
+        server.add_spreadsheet("linebot_expense", {"expense": make_rows(3)})
+        yield server
+
+
+@pytest.fixture
+def registry(server):
+    config = bench_config(
+        GOOGLE_API_ENDPOINT=server.url, LINE_API_ENDPOINT=server.url, LINE_DATA_ENDPOINT=server.url,
+        GSPREADSHEET="linebot_expense", GWORKSHEET="expense", LEDGER_SCOPE="shared",
+        LINE_CHANNEL_SECRET="secret", LINE_CHANNEL_ACCESS_TOKEN="token", ASYNC_ACK=False,
+    )
+    registry = ClientRegistry(config)
+    with patch("linebot_app.asgi.registry", registry), \
+            patch("linebot_app.linebot_app_gcp.registry", registry), \
+            patch("linebot_app.asgi.ledger_cache", LedgerCache()), \
+            patch("linebot_app.async_http.scheduler", SheetsScheduler(rate_per_minute=0)), \
+            patch("linebot_app.linebot_app_gcp.deduplicator", EventDeduplicator()):
+        yield registry
+
+
+async def post(texts, path="/", secret="secret"):
+    """以 ASGI 介面送出一次 webhook，回傳 (狀態碼, 內容)"""
+    events = [
+        {
+            "type": "message", "replyToken": f"tk-{text}", "webhookEventId": f"asgi-{next(_event_ids)}",
+            "source": {"type": "user", "userId": "U1"},
+            "message": {"type": "text", "id": "1", "text": text},
+        }
+        for text in texts
+    ]
+    body = json.dumps({"events": events}, ensure_ascii=False).encode("utf-8")
+    signature = WebhookParser(secret).signature_for(body).encode("latin-1")
+    return await request("POST", path, body, [(b"x-line-signature", signature)])
+
+
+async def request(method, path, body=b"", headers=()):
+    messages = [{"type": "http.request", "body": body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.app({"type": "http", "method": method, "path": path, "headers": list(headers)}, receive, send)
+    return sent[0]["status"], sent[1]["body"]
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await asgi.async_http.close()
+    return asyncio.run(main())
+
+
+def texts(server):
+    return {reply["replyToken"]: reply["messages"][0]["text"] for reply in server.replies}
+
+
+class TestAsgiApp:
+    def test_commands(self, server, registry):
+        """測試 async 路徑讀取一次工作表，修改以一次 batchUpdate 寫入後才回覆"""
+        status, body = run(post(["write 小美 午餐 餐飲 100", "sum 小美", "指令"]))
+
+        assert (status, body) == (200, b"OK")
+        replies = texts(server)
+        assert replies["tk-write 小美 午餐 餐飲 100"].startswith("記錄成功")
+        assert replies["tk-sum 小美"].startswith("小美 已花費")
+        assert replies["tk-指令"].startswith("read:")
+        # 同一個帳本的 write、sum 共用快取，只讀取一次
+        assert server.stats["GET /v4/spreadsheets/{id}/values/{range}"] == 1
+        assert server.stats["POST /v4/spreadsheets/{id}:batchUpdate"] == 1
+        spreadsheet = next(iter(server.spreadsheets.values()))
+        assert spreadsheet.by_title("expense").cells[4][1] == "小美"
+
+    def test_concurrent_writes(self, server, registry):
+        """測試同時送出的多個 webhook 依序寫入同一個帳本，總和不會互相覆蓋"""
+        async def burst():
+            return await asyncio.gather(*(post([f"write 小美 午餐{i} 餐飲 10"]) for i in range(10)))
+
+        total = float(make_rows(3)[0][6])
+        assert all(status == 200 for status, _ in run(burst()))
+
+        sheet = next(iter(server.spreadsheets.values())).by_title("expense")
+        assert len(sheet.cells) == 14
+        assert float(sheet.evaluate(sheet.raw(0, 6))) == total + 100
+
+    def test_thread_commands(self, server, registry):
+        """測試 clear 等指令沿用同步流程，之後的 async 指令讀到新的內容"""
+        run(post(["clear"]))
+        run(post(["read"]))
+
+        replies = texts(server)
+        assert replies["tk-clear"].startswith("全部清除成功")
+        assert replies["tk-read"].startswith("0  時間")
+
+    def test_formula_total_read_back(self, server, registry):
+        """測試 formula 模式的 write 走同步流程，總和取自試算表計算的 G1，而不是快取中較舊的內容"""
+        registry.config.TOTAL_MODE = "formula"
+        total = float(make_rows(3)[0][6])
+        registry.config.THRESHOLD_AMOUNT = total + 1000
+        run(post(["read"]))
+        # 快取之後有人直接在試算表上新增一筆
+        sheet = next(iter(server.spreadsheets.values())).by_title("expense")
+        sheet.cells.append(["2025-01-05 12:00:00", "小華", "家電", "家用", "1000"])
+
+        run(post(["write 小美 午餐 餐飲 100"]))
+        messages = server.replies[-1]["messages"]
+        assert messages[0]["text"].startswith("記錄成功")
+        assert messages[1]["text"] == f"目前已消費 {total + 1100} 元已超過預期"
+
+    def test_chat_skips_ledger(self, server, registry):
+        """測試一般聊天訊息不開啟工作表也不讀取帳本，直接回覆不支援"""
+        run(post(["今天天氣真好"]))
+
+        assert texts(server) == {"tk-今天天氣真好": "不支援的指令"}
+        assert server.stats["GET /v4/spreadsheets/{id}/values/{range}"] == 0
+
+    def test_write_reads_live_total(self, server, registry):
+        """測試快取中的帳本寫入前先讀取最新的 G1，不覆蓋其他地方修改過的總和"""
+        run(post(["read"]))
+        sheet = next(iter(server.spreadsheets.values())).by_title("expense")
+        sheet.cells[0][6] = "1000"
+
+        run(post(["write 小美 午餐 餐飲 100"]))
+        assert float(sheet.evaluate(sheet.raw(0, 6))) == 1100
+        assert server.stats["GET /v4/spreadsheets/{id}/values/{range}"] == 2
+
+    def test_unsupported_operation_replied(self, server, registry):
+        """測試誤送到 async 流程的不支援操作回覆使用者，而不是未處理的例外"""
+        with patch("linebot_app.asgi.THREAD_COMMANDS", set()):
+            run(post(["revert list"]))
+
+        assert texts(server) == {"tk-revert list": "此指令目前無法使用，請稍後再試"}
+
+    def test_write_failure_not_replied_as_success(self, server, registry):
+        """測試寫入失敗時回覆錯誤，不送出成功訊息"""
+        error = AsyncApiError(403, "forbidden")
+        with patch.object(AsyncSheetsApi, "batch_update", side_effect=error):
+            run(post(["write 小美 午餐 餐飲 100"]))
+
+        assert texts(server) == {"tk-write 小美 午餐 餐飲 100": "指令執行失敗"}
+
+    def test_routes(self, server, registry):
+        """測試簽章錯誤、/metrics 與不存在的路徑"""
+        assert run(post(["read"], secret="wrong"))[0] == 400
+        assert run(request("GET", "/exports/../secret"))[0] == 404
+        assert run(request("GET", "/unknown"))[0] == 404
+
+        status, body = run(request("GET", "/metrics"))
+        assert status == 200 and b"linebot_api_calls_total" in body
@@ -0,0 +1,79 @@
+import signal
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+
+from linebot_app.background import BackgroundProcessor
+from linebot_app.linebot_app_gcp import linebot
+
+
+class TestBackgroundProcessor:
+    def test_same_key_keeps_order(self):
+        """測試同一個帳本的事件依序處理"""
+        processor = BackgroundProcessor(workers=3)
+        handled = []
+
+        processor.submit([1, 2, 3], lambda e: "ledger", handled.append)
+        processor.submit([4, 5], lambda e: "ledger", handled.append)
+        processor.shutdown()
+
+        assert handled == [1, 2, 3, 4, 5]
+
+    def test_shutdown_drains_queue(self):
+        """測試關閉時先處理完佇列中的事件"""
+        processor = BackgroundProcessor(workers=1)
+        release = threading.Event()
+        handled = []
+
+        def handle(event):
+            release.wait(timeout=5)
+            handled.append(event)
+
+        processor.submit(["a", "b", "c"], lambda e: None, handle)
+        assert processor.stats()["queue_depth"] >= 2
+        release.set()
+        processor.shutdown()
+
+        assert handled == ["a", "b", "c"]
+        stats = processor.stats()
+        assert stats["queue_depth"] == 0
+        assert stats["processed"] == 3
+        assert stats["max_lag_seconds"] >= 0
+
+    def test_sigterm_hooks(self, capsys):
+        """測試 SIGTERM handler 只能在主執行緒安裝，收到 SIGTERM 時先處理完佇列"""
+        processor = BackgroundProcessor(workers=1)
+        installed = []
+        thread = threading.Thread(target=lambda: installed.append(processor.install_hooks()))
+        thread.start()
+        thread.join()
+        assert installed == [False]
+        assert "SIGTERM" in capsys.readouterr().out
+
+        previous = signal.getsignal(signal.SIGTERM)
+        try:
+            with patch("atexit.register"):
+                assert processor.install_hooks()
+            handled = []
+            processor.submit(["a", "b"], lambda e: None, handled.append)
+            with pytest.raises(SystemExit):
+                signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+            assert handled == ["a", "b"]
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+
+class TestAsyncAck:
+    def test_returns_before_processing(self, signed_request, sample_webhook_data, mock_registry):
+        """測試 async-ack 模式把事件交給背景處理並立即回覆"""
+        mock_registry.config.ASYNC_ACK = True
+        background = Mock()
+
+        with patch("linebot_app.linebot_app_gcp.registry", mock_registry), \
+                patch("linebot_app.linebot_app_gcp.background", background):
+            assert linebot(signed_request(sample_webhook_data)) == "OK"
+
+        events = background.submit.call_args[0][0]
+        assert [event.reply_token for event in events] == ["test_reply_token"]
+        assert not mock_registry.worksheet.called
@@ -0,0 +1,60 @@
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from linebot_app.batching import WriteBatcher
+from linebot_app.linebot_app_gcp import BotOperation
+
+
+class TestWriteBatcher:
+    def test_concurrent_writes_share_one_flush(self):
+        """測試同一時間窗內的 write 只呼叫一次 flush"""
+        batcher = WriteBatcher(window=0.2)
+        flush = Mock(side_effect=lambda rows, amount: 1000 + amount)
+        results = {}
+
+        def submit(i):
+            results[i] = batcher.submit("key", [[f"row{i}"]], 10, flush)
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert flush.call_count == 1
+        rows, amount = flush.call_args[0]
+        assert len(rows) == 5
+        assert amount == 50
+        # 每個請求拿到寫入自己那筆之後的累計總和
+        assert sorted(results.values()) == [1010, 1020, 1030, 1040, 1050]
+
+    def test_max_rows_flushes_early(self):
+        """測試累積到 max_rows 時不等時間窗結束"""
+        batcher = WriteBatcher(window=10, max_rows=1)
+        flush = Mock(return_value=10)
+
+        assert batcher.submit("key", [["row"]], 10, flush) == 10
+
+    def test_error_propagates(self):
+        """測試 flush 失敗時呼叫端收到例外"""
+        batcher = WriteBatcher(window=0)
+        flush = Mock(side_effect=RuntimeError("quota"))
+
+        with pytest.raises(RuntimeError):
+            batcher.submit("key", [["row"]], 10, flush)
+
+    def test_bot_write_uses_batcher(self, mock_wks, mock_line_api, mock_config):
+        """測試 BotOperation.write 經由 batcher 寫入並回覆門檻提醒"""
+        mock_wks.cell.return_value.value = "5950"
+        bot_op = BotOperation(
+            mock_wks, mock_line_api, "write 小美 午餐 餐飲 100", "test_token",
+            mock_config, batcher=WriteBatcher(window=0)
+        )
+        bot_op.write()
+
+        assert mock_wks.append_table.call_count == 1
+        args, _ = mock_line_api.reply_message.call_args
+        assert len(args[1]) == 2
+        assert "6050.0" in args[1][1].text
@@ -0,0 +1,103 @@
+import subprocess
+import sys
+
+from benchmarks.coldstart import MARKER, compare as compare_coldstart, parse_importtime
+from benchmarks.fake_sheets import fake_worksheet, make_rows
+from benchmarks.run import COMMANDS, compare, run_suite
+from linebot_app.store import HEADER, SheetsLedgerStore
+
+
+class TestFakeWorksheet:
+    def test_store_round_trip(self):
+        """測試假工作表支援 SheetsLedgerStore 的讀寫"""
+        wks = fake_worksheet(make_rows(3))
+        store = SheetsLedgerStore(wks)
+        total = float(store.all_values()[0][6])
+
+        new_total = store.append_rows([["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]], 100)
+        store.delete_row(1, None)
+
+        assert new_total == total + 100
+        assert store.row_count() == 4
+        assert store.get_rows(3, 4) == [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]]
+        assert wks.spreadsheet.calls["append_table"] == 1
+
+    def test_batch_updates_keep_header(self):
+        """測試 G1 總和寫在 G 欄、不覆蓋 A1 的標題，日期格式的儲存格還原成時間字串"""
+        wks = fake_worksheet(make_rows(3))
+        store = SheetsLedgerStore(wks)
+        total = float(wks.rows[0][6])
+        first = wks.rows[1]
+
+        assert store.delete_rows([1], [float(first[4])]) == total - float(first[4])
+        old = float(wks.rows[1][4])
+        new_total = store.update_row(1, ["2025-01-01 12:00:00", "小華", "晚餐", "餐飲", "1"], old, 1.0)
+
+        assert new_total == total - float(first[4]) - old + 1
+        assert wks.rows[0][:6] == HEADER
+        assert float(wks.rows[0][6]) == new_total
+        assert wks.rows[1] == ["2025-01-01 12:00:00", "小華", "晚餐", "餐飲", "1"]
+
+    def test_template_not_modified(self):
+        """測試修改假工作表不會影響共用的範本列"""
+        template = make_rows(2)
+        snapshot = [list(row) for row in template]
+        store = SheetsLedgerStore(fake_worksheet(template))
+
+        store.update_row(1, ["2025-01-01", "小華", "晚餐", "餐飲", "1"], 0, 1)
+        store.clear(["時間"])
+
+        assert template == snapshot
+
+
+class TestBenchmarkSuite:
+    def test_run_all_commands(self):
+        """測試每個指令都有結果，且都回覆一次"""
+        report = run_suite(sizes=[20], repeat=1)
+        results = {r["command"]: r for r in report["results"]}
+
+        assert set(results) == {name for name, _, _ in COMMANDS}
+        assert all(r["replies"] == 1 for r in results.values())
+        assert results["sum"]["sheets_calls_by_method"] == {"get_all_values": 1}
+
+    def test_compare_flags_regressions(self):
+        """測試呼叫次數增加或變慢時回報退步"""
+        old = {"results": [{"command": "sum", "rows": 10, "cache": False, "sheets_calls": 1, "wall_ms": 1.0, "peak_kib": 10.0}]}
+        new = {"results": [{"command": "sum", "rows": 10, "cache": False, "sheets_calls": 2, "wall_ms": 5.0, "peak_kib": 10.0}]}
+
+        assert len(compare(old, new)) == 2
+        assert compare(old, old) == []
+
+
+class TestColdStart:
+    def test_heavy_packages_deferred(self):
+        """測試載入 entry point 時不會載入 pygsheets、flask 與 LINE SDK"""
+        code = (
+            "import sys, linebot_app.linebot_app_gcp; "
+            "print(sorted(m for m in ('pygsheets', 'flask', 'linebot', 'googleapiclient') if m in sys.modules))"
+        )
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+
+        assert output.strip() == "[]"
+
+    def test_parse_importtime(self):
+        """測試依階段分開，只保留頂層模組並依累計時間排序"""
+        text = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 |   json.decoder",
+            "import time:       200 |        300 | json",
+            "import time:      1000 |       5000 | linebot_app",
+            MARKER,
+            "import time:      7000 |       9000 | pygsheets",
+        ])
+        phases = parse_importtime(text, top=1)
+
+        assert phases == [[{"module": "linebot_app", "cumulative_ms": 5.0}], [{"module": "pygsheets", "cumulative_ms": 9.0}]]
+
+    def test_compare(self):
+        """測試 cold start 變慢時回報退步"""
+        old = {"median": {"import_ms": 100.0, "first_request_ms": 600.0, "second_request_ms": 40.0}}
+        new = {"median": {"import_ms": 150.0, "first_request_ms": 600.0, "second_request_ms": 40.0}}
+
+        assert compare_coldstart(old, new) == ["import_ms: 100.0 -> 150.0 ms"]
+        assert compare_coldstart(old, old) == []
@@ -3,6 +3,7 @@ from unittest.mock import Mock
 import pytest
 from linebot.models import TextSendMessage
 
+from linebot_app.ledger import LedgerCache
 from linebot_app.linebot_app_gcp import BotOperation
 
 
@@ -29,6 +30,54 @@ class TestBotOperation:
         args, _ = mock_line_api.reply_message.call_args
         assert isinstance(args[1], TextSendMessage)
 
+    def test_read_last_n(self, bot_op, mock_wks, mock_line_api):
+        """測試讀取最後 N 筆只讀取該範圍"""
+        mock_wks.get_col.return_value = ["時間", "t1", "t2"]
+        mock_wks.get_values.return_value = [["2025-01-01 13:00:00", "小華", "交通", "交通", "50"]]
+        bot_op.read(last=1)
+
+        assert not mock_wks.get_all_values.called
+        args, _ = mock_wks.get_values.call_args
+        assert args == ((3, 1), (3, 5))
+        args, _ = mock_line_api.reply_message.call_args
+        assert args[1].text.startswith("2  ")
+
+    def test_read_page(self, bot_op, mock_wks, mock_line_api, mock_config):
+        """測試分頁讀取"""
+        mock_config.READ_PAGE_SIZE = 10
+        mock_wks.get_values.return_value = []
+        bot_op.read(page=2)
+
+        args, _ = mock_wks.get_values.call_args
+        assert args == ((12, 1), (21, 5))
+        args, _ = mock_line_api.reply_message.call_args
+        assert args[1].text == "沒有第 2 頁"
+
+    def test_read_large_ledger_splits_messages(self, bot_op, mock_wks, mock_line_api):
+        """測試大量資料分成多則訊息且不超過 LINE 的限制"""
+        mock_wks.get_all_values.return_value = [["時間", "人名", "品項", "分類", "費用"]] + [
+            ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]
+        ] * 2000
+        bot_op.read()
+
+        args, _ = mock_line_api.reply_message.call_args
+        assert isinstance(args[1], list)
+        assert len(args[1]) == 5
+        assert all(len(message.text) <= 5000 for message in args[1])
+
+    def test_execute_read_arguments(self, bot_op, mock_line_api):
+        """測試 read 指令的參數解析"""
+        bot_op.read = Mock()
+        for msg, kwargs in [("read", {}), ("read 20", {"last": 20}), ("read p3", {"page": 3})]:
+            bot_op.msg = msg
+            bot_op.execute_command("read")
+            assert bot_op.read.call_args.kwargs == kwargs
+
+        bot_op.msg = "read abc"
+        bot_op.execute_command("read")
+        assert bot_op.read.call_count == 3
+        assert mock_line_api.reply_message.called
+
     def test_display(self, bot_op, mock_line_api, mock_config):
         """測試顯示完整表單"""
         url = "https://test.com"
@@ -98,36 +147,79 @@ class TestBotOperation:
         assert mock_wks.get_all_values.called
         assert mock_line_api.reply_message.called
 
+    @staticmethod
+    def _requests(mock_wks):
+        """最後一次 batchUpdate 送出的請求種類"""
+        args, _ = mock_wks.client.sheet.batch_update.call_args
+        return args[1]
+
     def test_delete_last(self, bot_op, mock_wks, mock_line_api):
-        """測試刪除最後一筆"""
+        """測試刪除最後一筆只讀取列數與最後一列"""
+        mock_wks.get_col.return_value = ["時間", "t1", "t2"]
+        mock_wks.get_values.return_value = [["2025-01-01 13:00:00", "小華", "交通", "交通", "50"]]
+        mock_wks.cell.return_value.value = "150"
         bot_op.delete()
         
-        assert mock_wks.get_all_values.called
-        assert mock_wks.delete_rows.called
+        assert not mock_wks.get_all_values.called
+        requests = self._requests(mock_wks)
+        assert requests[0]["deleteDimension"]["range"]["startIndex"] == 2
+        # 刪除與新的總和在同一次請求
+        assert requests[1]["updateCells"]["rows"][0]["values"][0]["userEnteredValue"] == {"numberValue": 100.0}
         assert mock_line_api.reply_message.called
 
     def test_delete_by_index(self, bot_op, mock_wks, mock_line_api):
-        """測試按索引刪除"""
+        """測試按索引刪除只讀取目標列"""
+        mock_wks.get_values.return_value = [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]]
         bot_op.delete(1)
         
-        assert mock_wks.get_all_values.called
-        assert mock_wks.delete_rows.called
-        assert mock_line_api.reply_message.called
+        assert not mock_wks.get_all_values.called
+        assert self._requests(mock_wks)[0]["deleteDimension"]["range"]["startIndex"] == 1
+        assert mock_line_api.reply_message.call_args[0][1].text.startswith("已刪除第 #1 筆")
+
+    def test_delete_multiple(self, bot_op, mock_wks, mock_line_api):
+        """測試一次刪除多筆時由下往上在同一次請求刪除"""
+        mock_wks.get_values_batch.return_value = [
+            [["2025-01-01 13:00:00", "小華", "交通", "交通", "50"]],
+            [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]],
+        ]
+        mock_wks.cell.return_value.value = "150"
+        bot_op.msg = "delete 1 2"
+        bot_op.execute_command("delete")
+
+        assert mock_wks.get_values_batch.call_args[0][0] == ["A3:E3", "A2:E2"]
+        requests = self._requests(mock_wks)
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests[:2]] == [2, 1]
+        assert requests[2]["updateCells"]["rows"][0]["values"][0]["userEnteredValue"] == {"numberValue": 0.0}
+        assert mock_wks.client.sheet.batch_update.call_count == 1
+        assert mock_line_api.reply_message.call_args[0][1].text.startswith("已刪除 2 筆")
+
+    def test_delete_out_of_range(self, bot_op, mock_wks, mock_line_api):
+        """測試索引超出範圍時不刪除任何列"""
+        mock_wks.get_values_batch.return_value = [[[""]], [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]]]
+        mock_wks.get_col.return_value = ["時間", "t1", "t2"]
+        bot_op.delete(1, 9)
+
+        assert not mock_wks.client.sheet.batch_update.called
+        assert mock_line_api.reply_message.call_args[0][1].text == "索引錯誤，請輸入 0 到 2 之間的數字"
 
     def test_delete_empty_sheet(self, bot_op, mock_wks, mock_line_api):
         """測試刪除空表單"""
-        mock_wks.get_all_values.return_value = [["時間", "人名", "品項", "分類", "費用"]]
+        mock_wks.get_col.return_value = ["時間"]
         bot_op.delete()
         
-        assert mock_line_api.reply_message.called
-        assert not mock_wks.delete_rows.called
+        assert mock_line_api.reply_message.call_args[0][1].text == "表單為空"
+        assert not mock_wks.client.sheet.batch_update.called
 
     def test_update_success(self, bot_op, mock_wks, mock_line_api):
-        """測試更新資料"""
+        """測試更新資料與總和在同一次請求"""
+        mock_wks.get_values.return_value = [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]]
+        mock_wks.cell.return_value.value = "150"
         bot_op.update(1, "2024-01-01 12:00:00 小美 早餐 餐飲 80")
         
-        assert mock_wks.get_all_values.called
-        assert mock_wks.update_values.called
+        assert not mock_wks.get_all_values.called
+        requests = self._requests(mock_wks)
+        assert requests[0]["updateCells"]["start"]["rowIndex"] == 1
+        assert requests[1]["updateCells"]["rows"][0]["values"][0]["userEnteredValue"] == {"numberValue": 130.0}
         assert mock_line_api.reply_message.called
 
     def test_update_invalid_format(self, bot_op, mock_wks, mock_line_api):
@@ -136,43 +228,69 @@ class TestBotOperation:
         
         assert mock_line_api.reply_message.called
 
+    @staticmethod
+    def _sheets(mock_wks, *titles):
+        """讓 client.sheet.get 回傳帳本工作表與指定的備份快照"""
+        mock_wks.id = 0
+        mock_wks.spreadsheet = Mock(id="sid")
+        sheets = [{"properties": {"sheetId": 0, "title": "expense", "gridProperties": {"rowCount": 1000}}}]
+        sheets += [{"properties": {"sheetId": i, "title": t, "gridProperties": {"rowCount": 1000}}}
+                   for i, t in enumerate(titles, start=1)]
+        mock_wks.client.sheet.get.return_value = {"sheets": sheets}
+
     def test_clear(self, bot_op, mock_wks, mock_line_api):
-        """測試清除資料"""
-        mock_spreadsheet = Mock()
-        mock_wks.spreadsheet = mock_spreadsheet
-        mock_backup_wks = Mock()
-        mock_spreadsheet.worksheet_by_title.return_value = mock_backup_wks
-        
+        """測試清除資料：在伺服器端複製工作表，不讀取資料"""
+        self._sheets(mock_wks)
+
+        bot_op.clear()
+
+        assert not mock_wks.get_all_values.called
+        args, _ = mock_wks.client.sheet.batch_update.call_args
+        assert args[1][0]["duplicateSheet"]["newSheetName"].startswith("test_worksheet_backup_")
+        assert "備份工作表：test_worksheet_backup_" in mock_line_api.reply_message.call_args[0][1].text
+
+    def test_clear_prunes_old_snapshots(self, bot_op, mock_wks, mock_config):
+        """測試超過 BACKUP_KEEP 的舊快照與清除在同一次請求刪除"""
+        mock_config.BACKUP_KEEP = 2
+        bot_op.store.keep = 2
+        self._sheets(mock_wks, "test_worksheet_backup_20250101-000000", "test_worksheet_backup_20250102-000000", "test_worksheet_backup")
+
         bot_op.clear()
-        
-        assert mock_wks.get_all_values.called
-        assert mock_wks.clear.called
-        assert mock_line_api.reply_message.called
+
+        args, _ = mock_wks.client.sheet.batch_update.call_args
+        deleted = [r["deleteSheet"]["sheetId"] for r in args[1] if "deleteSheet" in r]
+        # 保留最新的一份，加上這次共兩份
+        assert deleted == [1, 3]
 
     def test_revert_success(self, bot_op, mock_wks, mock_line_api):
-        """測試還原備份"""
-        mock_spreadsheet = Mock()
-        mock_wks.spreadsheet = mock_spreadsheet
-        mock_backup_wks = Mock()
-        mock_backup_wks.get_all_values.return_value = [
-            ["時間", "人名", "品項", "分類", "費用"],
-            ["2024-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]
-        ]
-        mock_spreadsheet.worksheet_by_title.return_value = mock_backup_wks
-        
-        bot_op.revert()
-        
-        assert mock_line_api.reply_message.called
+        """測試還原備份：由試算表在伺服器端貼上快照"""
+        self._sheets(mock_wks, "test_worksheet_backup_20250101-000000", "test_worksheet_backup_20250102-000000")
+
+        bot_op.revert(2)
+
+        args, _ = mock_wks.client.sheet.batch_update.call_args
+        assert args[1][-1]["copyPaste"]["source"] == {"sheetId": 1}
+        assert not mock_wks.get_all_values.called
+        text = mock_line_api.reply_message.call_args[0][1].text
+        assert text == "備份資料還原成功\n還原自：test_worksheet_backup_20250101-000000"
 
     def test_revert_no_backup(self, bot_op, mock_wks, mock_line_api):
         """測試還原無備份"""
-        mock_spreadsheet = Mock()
-        mock_wks.spreadsheet = mock_spreadsheet
-        mock_spreadsheet.worksheet_by_title.side_effect = Exception("NotFound")
-        
+        self._sheets(mock_wks)
+
         bot_op.revert()
-        
-        assert mock_line_api.reply_message.called
+
+        assert mock_line_api.reply_message.call_args[0][1].text == "找不到備份工作表"
+
+    def test_revert_list(self, bot_op, mock_wks, mock_line_api):
+        """測試列出備份快照，新的在前"""
+        self._sheets(mock_wks, "test_worksheet_backup", "test_worksheet_backup_20250101-000000")
+        bot_op.msg = "revert list"
+
+        bot_op.execute_command("revert")
+
+        text = mock_line_api.reply_message.call_args[0][1].text
+        assert text.splitlines()[1:] == ["1  test_worksheet_backup_20250101-000000", "2  test_worksheet_backup"]
 
     def test_method(self, bot_op, mock_line_api):
         """測試查詢指令"""
@@ -182,3 +300,73 @@ class TestBotOperation:
         args, _ = mock_line_api.reply_message.call_args
         assert isinstance(args[1], TextSendMessage)
 
+
+
+class TestBotOperationWithCache:
+    @pytest.fixture
+    def cache(self):
+        return LedgerCache(max_age=300)
+
+    def make_bot_op(self, wks, api, config, cache, msg="test message"):
+        return BotOperation(wks, api, msg, "test_token", config, cache=cache)
+
+    def test_read_uses_cache(self, mock_wks, mock_line_api, mock_config, cache):
+        """測試第二次讀取不再呼叫 Sheets API"""
+        self.make_bot_op(mock_wks, mock_line_api, mock_config, cache).read()
+        self.make_bot_op(mock_wks, mock_line_api, mock_config, cache).ssum("小美", "sum")
+        self.make_bot_op(mock_wks, mock_line_api, mock_config, cache).get_type()
+
+        assert mock_wks.get_all_values.call_count == 1
+
+    def test_write_updates_cache(self, mock_wks, mock_line_api, mock_config, cache):
+        """測試寫入後快取同步更新"""
+        self.make_bot_op(mock_wks, mock_line_api, mock_config, cache).read()
+        self.make_bot_op(
+            mock_wks, mock_line_api, mock_config, cache, "write 小美 晚餐 餐飲 200"
+        ).write()
+        self.make_bot_op(mock_wks, mock_line_api, mock_config, cache).ssum("小美", "sum")
+
+        assert mock_wks.get_all_values.call_count == 1
+        args, _ = mock_line_api.reply_message.call_args
+        assert args[1].text == "小美 已花費 300.0 元"
+
+    def test_read_render_cached_until_change(self, mock_wks, mock_line_api, mock_config, cache):
+        """測試 read 的渲染結果在帳本變動前重複使用"""
+        bot_op = self.make_bot_op(mock_wks, mock_line_api, mock_config, cache)
+        bot_op._render_read = Mock(wraps=bot_op._render_read)
+        bot_op.read(page=1)
+        bot_op.read(page=1)
+        bot_op.read(page=1)
+        assert bot_op._render_read.call_count == 2
+
+        cache.append(bot_op.ledger_key, [["2025-01-02 08:00:00", "小美", "早餐", "餐飲", "60"]])
+        bot_op.read(page=1)
+        assert bot_op._render_read.call_count == 3
+        args, _ = mock_line_api.reply_message.call_args
+        assert "早餐" in args[1].text
+
+    def test_delete_updates_cache(self, mock_wks, mock_line_api, mock_config, cache):
+        """測試刪除後快取同步更新"""
+        self.make_bot_op(mock_wks, mock_line_api, mock_config, cache).delete(1)
+        self.make_bot_op(mock_wks, mock_line_api, mock_config, cache).ssum("小美", "sum")
+
+        assert mock_wks.get_all_values.call_count == 1
+        args, _ = mock_line_api.reply_message.call_args
+        assert args[1].text == "小美 已花費 0 元"
+
+    def test_period_queries(self, mock_wks, mock_line_api, mock_config, cache):
+        """測試日期區間加總與 month 摘要只讀取一次試算表"""
+        def run(msg):
+            bot_op = self.make_bot_op(mock_wks, mock_line_api, mock_config, cache, msg)
+            bot_op.execute_command(msg.split()[0])
+            args, _ = mock_line_api.reply_message.call_args
+            return args[1].text
+
+        assert run("sum 小美 2025-01") == "小美 在 2025-01 已花費 100.0 元"
+        assert run("type 餐飲 2025-01-02~2025-01-31") == "餐飲 在 2025-01-02~2025-01-31 已花費 0 元"
+        assert run("month 2025-01") == (
+            "2025-01 共花費 150 元\n\n依人名：\n小美: 100 元\n小華: 50 元\n\n依分類：\n餐飲: 100 元\n交通: 50 元"
+        )
+        assert run("month 2024-12") == "2024-12 沒有記錄"
+        assert run("month 2025/01").startswith("格式錯誤")
+        assert mock_wks.get_all_values.call_count == 1
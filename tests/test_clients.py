@@ -0,0 +1,138 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+import pygsheets
+import pytest
+
+from linebot_app.clients import ClientRegistry, WorksheetCache, is_invalid_handle
+
+
+class TestClientRegistry:
+    @pytest.fixture
+    def gc(self):
+        """模擬已授權的 pygsheets client"""
+        gc = Mock()
+        gc.oauth.token = "token"
+        gc.oauth.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+        return gc
+
+    @pytest.fixture
+    def registry(self, mock_config):
+        return ClientRegistry(mock_config)
+
+    def test_authorize_once(self, registry, gc):
+        """測試多次取得 worksheet 只授權與開啟一次"""
+        with patch("pygsheets.authorize", return_value=gc) as authorize:
+            first = registry.worksheet()
+            second = registry.worksheet()
+
+        assert first is second
+        assert authorize.call_count == 1
+        assert gc.open.call_count == 1
+        assert not gc.oauth.refresh.called
+
+    def test_refresh_token_before_expiry(self, registry, gc):
+        """測試 token 快到期時提前更新"""
+        gc.oauth.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=1)
+        with patch("pygsheets.authorize", return_value=gc):
+            registry.worksheet()
+
+        assert gc.oauth.refresh.called
+
+    def test_invalidate_worksheet_reopens(self, registry, gc):
+        """測試 worksheet 失效後才重新開啟"""
+        with patch("pygsheets.authorize", return_value=gc) as authorize:
+            registry.worksheet()
+            registry.invalidate_worksheet()
+            registry.worksheet()
+
+        assert authorize.call_count == 1
+        assert gc.open.call_count == 2
+
+    def test_worksheet_per_source(self, registry, gc):
+        """測試來源專用的工作表不存在時建立並寫入標題列，試算表只開啟一次"""
+        spreadsheet = gc.open.return_value
+        spreadsheet.worksheet_by_title.side_effect = [Mock(), pygsheets.WorksheetNotFound()]
+        with patch("pygsheets.authorize", return_value=gc):
+            registry.worksheet()
+            created = registry.worksheet("test_worksheet_Cgroup")
+            assert registry.worksheet("test_worksheet_Cgroup") is created
+
+        assert gc.open.call_count == 1
+        spreadsheet.add_worksheet.assert_called_once_with("test_worksheet_Cgroup", rows=1000, cols=7)
+        created.update_row.assert_called_once_with(1, ["時間", "人名", "品項", "分類", "費用", "總和", 0])
+
+    def test_line_clients_reused(self, registry):
+        """測試 LineBotApi 與 WebhookParser 只建立一次"""
+        assert registry.line_bot_api is registry.line_bot_api
+        assert registry.parser is registry.parser
+
+    def test_prewarm(self, registry, gc):
+        """測試背景預先建立客戶端後，webhook 直接使用已開啟的 worksheet"""
+        with patch("pygsheets.authorize", return_value=gc) as authorize:
+            registry.prewarm().join(timeout=5)
+            registry.worksheet()
+
+        assert authorize.call_count == 1
+        assert gc.open.call_count == 1
+        assert registry._line_bot_api is not None
+
+    def test_is_invalid_handle(self):
+        """測試失效 handle 的判斷"""
+        assert is_invalid_handle(pygsheets.WorksheetNotFound())
+        assert not is_invalid_handle(ValueError("x"))
+
+
+class TestWorksheetCache:
+    def test_lru_eviction(self):
+        """測試超過上限時丟棄最久沒用的 handle"""
+        cache = WorksheetCache(max_size=2)
+        opener = Mock(side_effect=lambda: object())
+        a = cache.get("a", opener)
+        cache.get("b", opener)
+        assert cache.get("a", opener) is a
+        cache.get("c", opener)  # b 最久沒用
+
+        assert len(cache) == 2
+        assert cache.get("a", opener) is a
+        cache.get("b", opener)
+        assert opener.call_count == 4
+
+    def test_idle_eviction(self):
+        """測試閒置太久的 handle 被丟棄"""
+        now = [0.0]
+        cache = WorksheetCache(idle_seconds=60, clock=lambda: now[0])
+        opener = Mock(side_effect=lambda: object())
+        first = cache.get("a", opener)
+        now[0] = 30
+        assert cache.get("a", opener) is first
+        now[0] = 100
+
+        assert cache.get("a", opener) is not first
+        assert opener.call_count == 2
+
+    def test_concurrent_open_once(self):
+        """測試同一個 key 同時被要求時只開啟一次"""
+        cache = WorksheetCache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def opener():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("a", opener))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        assert started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert len(calls) == 1
+        assert len(results) == 3 and all(handle is results[0] for handle in results)
+        assert cache._opening == {}
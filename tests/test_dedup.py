@@ -0,0 +1,103 @@
+from unittest.mock import patch
+
+import pytest
+
+from linebot_app.dedup import EventDeduplicator
+from linebot_app.linebot_app_gcp import linebot
+from linebot_app.metrics import Metrics
+
+
+def redelivered(event_id, text="write 小美 午餐 餐飲 100", redelivery=False):
+    return {
+        "type": "message",
+        "replyToken": f"tk-{event_id}-{redelivery}",
+        "webhookEventId": event_id,
+        "deliveryContext": {"isRedelivery": redelivery},
+        "message": {"type": "text", "text": text},
+    }
+
+
+class TestEventDeduplicator:
+    def test_ttl(self):
+        """測試 TTL 內的重複 id 被略過，過期後視為新事件"""
+        now = [0.0]
+        dedup = EventDeduplicator(ttl=60, clock=lambda: now[0])
+
+        assert dedup.claim("e1")
+        assert not dedup.claim("e1")
+        assert dedup.claim(None) and dedup.claim(None)
+        now[0] = 61
+        assert dedup.claim("e1")
+
+    def test_bounded(self):
+        """測試記憶體中最多保留 max_size 個 id"""
+        dedup = EventDeduplicator(max_size=2)
+        for event_id in ("e1", "e2", "e3"):
+            assert dedup.claim(event_id)
+
+        assert len(dedup) == 2
+        assert not dedup.claim("e3")
+
+    def test_persisted(self, tmp_path):
+        """測試存到 SQLite 後，重新啟動（新的實例）仍能辨識重送"""
+        path = str(tmp_path / "events.sqlite3")
+        assert EventDeduplicator(path=path).claim("e1")
+
+        restarted = EventDeduplicator(path=path)
+        assert not restarted.claim("e1")
+        assert restarted.claim("e2")
+
+        now = [10.0 ** 10]
+        assert EventDeduplicator(path=path, clock=lambda: now[0]).claim("e1")
+
+    def test_release(self, tmp_path):
+        """測試 release 後同一個 id 可以再 claim（記憶體與 SQLite）"""
+        dedup = EventDeduplicator(path=str(tmp_path / "events.sqlite3"))
+        assert dedup.claim("e1")
+        dedup.release("e1")
+        dedup.release(None)
+
+        assert dedup.claim("e1")
+        assert not dedup.claim("e1")
+
+
+class TestRedelivery:
+    def test_redelivered_event_skipped(self, signed_request, mock_registry):
+        """測試重送的事件只回覆 OK，不再執行指令"""
+        metrics = Metrics()
+        with patch("linebot_app.linebot_app_gcp.registry", mock_registry), \
+                patch("linebot_app.linebot_app_gcp.deduplicator", EventDeduplicator()), \
+                patch("linebot_app.linebot_app_gcp.metrics", metrics), \
+                patch("linebot_app.linebot_app_gcp.handle_event") as handle_event:
+            assert linebot(signed_request({"events": [redelivered("e1"), redelivered("e2")]})) == "OK"
+            assert linebot(signed_request({"events": [redelivered("e1", redelivery=True)]})) == "OK"
+
+        assert handle_event.call_count == 2
+        assert mock_registry.worksheet.call_count == 1
+        assert metrics.value("linebot_duplicate_events_total", redelivery="true") == 1
+
+    def test_redelivered_after_failure(self, signed_request, mock_registry):
+        """測試無法開啟工作表而回覆錯誤時，LINE 重送的事件仍會處理"""
+        mock_registry.worksheet.side_effect = [Exception("timeout"), mock_registry.worksheet.return_value]
+        with patch("linebot_app.linebot_app_gcp.registry", mock_registry), \
+                patch("linebot_app.linebot_app_gcp.deduplicator", EventDeduplicator()), \
+                patch("linebot_app.linebot_app_gcp.handle_event") as handle_event:
+            with pytest.raises(SystemExit):
+                linebot(signed_request({"events": [redelivered("e1")]}))
+            assert not handle_event.called
+
+            assert linebot(signed_request({"events": [redelivered("e1", redelivery=True)]})) == "OK"
+
+        assert handle_event.call_count == 1
+
+    def test_failed_command_released(self, signed_request, mock_registry):
+        """測試指令執行失敗時取消記錄，重送的事件會再執行一次"""
+        mock_registry.worksheet.return_value.get_all_values.side_effect = Exception("boom")
+        dedup = EventDeduplicator()
+        with patch("linebot_app.linebot_app_gcp.registry", mock_registry), \
+                patch("linebot_app.linebot_app_gcp.deduplicator", dedup), \
+                patch("linebot_app.linebot_app_gcp.ledger_cache", None):
+            mock_registry.config.LEDGER_CACHE_MAX_AGE = 0
+            assert linebot(signed_request({"events": [redelivered("e1", "read")]})) == "OK"
+
+        assert dedup.claim("e1")
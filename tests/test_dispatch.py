@@ -0,0 +1,89 @@
+import threading
+from unittest.mock import patch
+
+from linebot_app.dispatch import EventDispatcher
+from linebot_app.linebot_app_gcp import ledger_key_for, linebot
+from linebot_app.webhook import to_event
+
+
+def text_event(text, token, source=None):
+    event = {"type": "message", "replyToken": token, "message": {"type": "text", "text": text}}
+    if source:
+        event["source"] = {"type": "group", "groupId": source, "userId": "U1"}
+    return event
+
+
+class TestEventDispatcher:
+    def test_group_keeps_order(self):
+        """測試同一個 key 的事件保持原本順序，key 為 None 的事件各自一組"""
+        events = ["a1", "b1", "a2", "x", "b2"]
+        groups = EventDispatcher.group(events, lambda e: None if e == "x" else e[0])
+
+        assert groups == [["a1", "a2"], ["b1", "b2"], ["x"]]
+
+    def test_independent_groups_run_concurrently(self):
+        """測試不同 key 的事件平行處理"""
+        dispatcher = EventDispatcher(max_workers=2)
+        barrier = threading.Barrier(2, timeout=5)
+        handled = []
+
+        def handle(event):
+            # 兩組必須同時執行才能通過 barrier
+            barrier.wait()
+            handled.append(event)
+
+        dispatcher.dispatch(["a", "b"], lambda e: e, handle)
+        dispatcher.shutdown()
+
+        assert sorted(handled) == ["a", "b"]
+
+    def test_failed_event_does_not_stop_group(self):
+        """測試單一事件失敗不影響同組後續事件"""
+        handled = []
+
+        def handle(event):
+            if event == 1:
+                raise RuntimeError("boom")
+            handled.append(event)
+
+        EventDispatcher(max_workers=1).dispatch([1, 2], lambda e: "key", handle)
+
+        assert handled == [2]
+
+
+class TestLinebotEvents:
+    def test_every_text_event_is_handled(self, signed_request, mock_registry):
+        """測試一次 webhook 的所有文字事件都會處理，非文字事件略過"""
+        body = {
+            "events": [
+                text_event("read", "tk1"),
+                {"type": "follow", "replyToken": "tk2"},
+                {"type": "message", "replyToken": "tk3", "message": {"type": "sticker"}},
+                text_event("指令", "tk4"),
+            ]
+        }
+
+        with patch("linebot_app.linebot_app_gcp.registry", mock_registry), \
+                patch("linebot_app.linebot_app_gcp.handle_event") as handle_event:
+            assert linebot(signed_request(body)) == "OK"
+
+        tokens = sorted(call.args[0].reply_token for call in handle_event.call_args_list)
+        assert tokens == ["tk1", "tk4"]
+        assert mock_registry.worksheet.call_count == 1
+
+    def test_ledger_per_source(self, signed_request, mock_registry):
+        """測試每個來源各自一個帳本時，依來源分組且不預先開啟共用工作表"""
+        config = mock_registry.config
+        config.LEDGER_SCOPE = "source"
+        events = [to_event(text_event("read", "tk1", "C1")), to_event(text_event("sum 小美", "tk2", "C2"))]
+        assert ledger_key_for(events[0], config) == ("test_spreadsheet", "test_worksheet_C1")
+        assert ledger_key_for(events[1], config) == ("test_spreadsheet", "test_worksheet_C2")
+
+        body = {"events": [text_event("read", "tk1", "C1"), text_event("read", "tk2", "C2")]}
+        with patch("linebot_app.linebot_app_gcp.registry", mock_registry), \
+                patch("linebot_app.linebot_app_gcp.handle_event") as handle_event:
+            assert linebot(signed_request(body)) == "OK"
+
+        assert handle_event.call_count == 2
+        assert all(call.args[1] is None for call in handle_event.call_args_list)
+        assert not mock_registry.worksheet.called
@@ -0,0 +1,187 @@
+import csv
+import zipfile
+from datetime import date, datetime, timezone
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qs, urlsplit
+
+from linebot_app.export import export_rows, row_filter, write_csv, write_xlsx
+from linebot_app.gcs import ExportBucket, signed_url
+from linebot_app.linebot_app_gcp import BotOperation, app, linebot
+from linebot_app.store import SheetsLedgerStore, SQLiteLedgerStore
+
+ROWS = [
+    ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"],
+    ["2025-01-03 13:00:00", "小華", "捷運", "交通", "30"],
+    ["2025-02-01 08:00:00", "小美", "早餐<&>", "餐飲", "40.5"],
+]
+
+
+class TestWriters:
+    def test_csv(self, tmp_path):
+        """測試 CSV 含標題列且可由 Excel 開啟（UTF-8 BOM）"""
+        path = tmp_path / "out.csv"
+        assert write_csv(path, iter(ROWS)) == 3
+
+        assert path.read_bytes().startswith(b"\xef\xbb\xbf")
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            assert list(csv.reader(f)) == [["時間", "人名", "品項", "分類", "費用"]] + ROWS
+
+    def test_xlsx(self, tmp_path):
+        """測試 XLSX 的結構、跳脫字元與數字儲存格"""
+        path = tmp_path / "out.xlsx"
+        assert write_xlsx(path, iter(ROWS)) == 3
+
+        with zipfile.ZipFile(path) as archive:
+            assert "xl/workbook.xml" in archive.namelist()
+            sheet = archive.read("xl/worksheets/sheet1.xml").decode("utf-8")
+        assert '<row r="4">' in sheet
+        assert "早餐&lt;&amp;&gt;" in sheet
+        assert '<c r="E4"><v>40.5</v></c>' in sheet
+        assert '<c r="E1" t="inlineStr"><is><t>費用</t></is></c>' in sheet
+
+    def test_row_filter(self):
+        """測試日期區間、人名與分類篩選"""
+        assert row_filter() is None
+        january = (date(2025, 1, 1), date(2025, 1, 31))
+        assert list(filter(row_filter(period=january), ROWS)) == ROWS[:2]
+        assert list(filter(row_filter(name="小美", kind="餐飲"), ROWS)) == [ROWS[0], ROWS[2]]
+        assert list(filter(row_filter(period=january, name="小美"), ROWS)) == [ROWS[0]]
+
+    def test_export_rows_cleans_up(self, tmp_path):
+        """測試匯出檔名不可猜測，並刪除過期的舊檔"""
+        old = tmp_path / "ledger-old.csv"
+        old.write_text("old")
+        name, count = export_rows(iter(ROWS), str(tmp_path), "xlsx", max_age=-1)
+
+        assert count == 3
+        assert name.startswith("ledger-") and name.endswith(".xlsx")
+        assert not old.exists()
+        assert (tmp_path / name).exists()
+
+
+class TestIterPages:
+    def test_sheets_pages(self):
+        """測試試算表分頁讀取，最後一頁不足時停止"""
+        wks = Mock()
+        wks.get_values.side_effect = [ROWS[:2], ROWS[2:]]
+        pages = list(SheetsLedgerStore(wks).iter_pages(2))
+
+        assert pages == [ROWS[:2], ROWS[2:]]
+        assert wks.get_values.call_args_list[1].args[:2] == ((4, 1), (5, 5))
+
+    def test_sqlite_pages(self):
+        """測試 SQLite 以 id 接續分頁"""
+        store = SQLiteLedgerStore(":memory:")
+        store.append_rows(ROWS, 170.5)
+        store.delete_row(1, 100)
+
+        assert list(store.iter_pages(1)) == [[ROWS[1]], [ROWS[2]]]
+        assert list(store.iter_pages(5)) == [ROWS[1:]]
+
+
+class TestExportCommand:
+    def test_export(self, tmp_path, mock_line_api, mock_config):
+        """測試 export 依條件匯出並回覆下載連結"""
+        mock_config.EXPORT_DIR = str(tmp_path)
+        store = SQLiteLedgerStore(":memory:")
+        store.append_rows(ROWS, 170.5)
+
+        BotOperation(store, mock_line_api, "export 2025-01 name=小美", "tk", mock_config).execute_command("export")
+        args, _ = mock_line_api.reply_message.call_args
+        text = args[1].text
+        assert text.startswith("匯出完成，共 1 筆\nhttps://bot.test/exports/ledger-")
+        name = text.split("\n")[1].rsplit("/", 1)[1]
+        with open(tmp_path / name, encoding="utf-8-sig", newline="") as f:
+            assert list(csv.reader(f))[1:] == [ROWS[0]]
+
+        with patch("linebot_app.linebot_app_gcp.registry", Mock(config=mock_config)):
+            response = app.test_client().get(f"/exports/{name}")
+        assert response.status_code == 200
+        assert "小美".encode("utf-8") in response.data
+
+    def test_linebot_serves_exports(self, tmp_path, mock_config):
+        """測試 Cloud Functions 的 linebot 進入點也能下載匯出檔案"""
+        mock_config.EXPORT_DIR = str(tmp_path)
+        name, _ = export_rows(iter(ROWS), str(tmp_path))
+        request = Mock(method="GET", path=f"/exports/{name}")
+
+        with patch("linebot_app.linebot_app_gcp.registry", Mock(config=mock_config)):
+            data, status, headers = linebot(request)
+            missing = linebot(Mock(method="GET", path="/exports/ledger-missing.csv"))
+        assert status == 200
+        assert "小美".encode("utf-8") in data
+        assert headers["Content-Disposition"] == f'attachment; filename="{name}"'
+        assert missing == ("Not Found", 404)
+
+    def test_export_to_bucket(self, tmp_path, mock_line_api, mock_config):
+        """測試設定 EXPORT_BUCKET 時上傳檔案、回覆 signed URL 並刪除本機檔案"""
+        mock_config.EXPORT_DIR = str(tmp_path)
+        mock_config.EXPORT_BUCKET = "ledger-exports"
+        store = SQLiteLedgerStore(":memory:")
+        store.append_rows(ROWS, 170.5)
+        bucket = Mock()
+        bucket.publish.return_value = "https://storage.googleapis.com/ledger-exports/signed"
+
+        with patch("linebot_app.linebot_app_gcp.registry", Mock(export_bucket=Mock(return_value=bucket))):
+            BotOperation(store, mock_line_api, "export xlsx", "tk", mock_config).execute_command("export")
+        path, name, expires, media = bucket.publish.call_args.args
+        assert name.startswith("ledger-") and name.endswith(".xlsx")
+        assert expires == mock_config.EXPORT_MAX_AGE
+        assert media == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        assert list(tmp_path.iterdir()) == []
+        args, _ = mock_line_api.reply_message.call_args
+        assert args[1].text.startswith("匯出完成，共 3 筆\nhttps://storage.googleapis.com/ledger-exports/signed\n")
+
+    def test_invalid_args(self, mock_wks, mock_line_api, mock_config):
+        """測試參數格式錯誤"""
+        BotOperation(mock_wks, mock_line_api, "export pdf", "tk", mock_config).execute_command("export")
+        args, _ = mock_line_api.reply_message.call_args
+
+        assert args[1].text.startswith("格式錯誤")
+        assert not mock_wks.get_values.called
+
+
+class TestExportBucket:
+    def test_signed_url(self):
+        """測試 V4 signed URL 的參數與簽章內容"""
+        credentials = Mock(service_account_email="bot@project.iam.gserviceaccount.com")
+        credentials.sign_bytes.return_value = b"\x01\xab"
+        now = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+        url = signed_url(credentials, "ledger-exports", "ledger-1 2.csv", 3600, now=now)
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        assert parts.netloc == "storage.googleapis.com"
+        assert parts.path == "/ledger-exports/ledger-1%202.csv"
+        assert query["X-Goog-Credential"] == [
+            "bot@project.iam.gserviceaccount.com/20250102/auto/storage/goog4_request"
+        ]
+        assert query["X-Goog-Date"] == ["20250102T030405Z"]
+        assert query["X-Goog-Expires"] == ["3600"]
+        assert query["X-Goog-Signature"] == ["01ab"]
+        signed = credentials.sign_bytes.call_args.args[0].decode().split("\n")
+        assert signed[:3] == ["GOOG4-RSA-SHA256", "20250102T030405Z", "20250102/auto/storage/goog4_request"]
+
+    def test_signed_url_expiry_capped(self):
+        """測試有效時間不超過 V4 signed URL 的 7 天上限"""
+        credentials = Mock(service_account_email="bot@project.iam.gserviceaccount.com")
+        credentials.sign_bytes.return_value = b"\x00"
+        url = signed_url(credentials, "b", "n.csv", 30 * 24 * 3600)
+        assert parse_qs(urlsplit(url).query)["X-Goog-Expires"] == ["604800"]
+
+    def test_publish_uploads(self, tmp_path):
+        """測試 publish 以 media upload 上傳檔案後回傳 signed URL"""
+        path = tmp_path / "ledger-a.csv"
+        path.write_bytes(b"data")
+        session = Mock()
+        credentials = Mock(service_account_email="bot@project.iam.gserviceaccount.com")
+        credentials.sign_bytes.return_value = b"\x00"
+        bucket = ExportBucket("ledger-exports", "unused.json", session=session, credentials=credentials)
+
+        url = bucket.publish(str(path), "ledger-a.csv", 600, "text/csv")
+        call = session.post.call_args
+        assert call.args[0] == "https://storage.googleapis.com/upload/storage/v1/b/ledger-exports/o"
+        assert call.kwargs["params"] == {"uploadType": "media", "name": "ledger-a.csv"}
+        assert call.kwargs["headers"] == {"Content-Type": "text/csv"}
+        session.post.return_value.raise_for_status.assert_called_once()
+        assert url.startswith("https://storage.googleapis.com/ledger-exports/ledger-a.csv?")
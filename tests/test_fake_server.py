@@ -0,0 +1,120 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.fake_server import FakeApiServer
+from benchmarks.fake_sheets import make_rows
+from benchmarks.run import bench_config
+from linebot_app.clients import ClientRegistry
+from linebot_app.linebot_app_gcp import BotOperation
+from linebot_app.sources import SourceConfig
+
+
+@pytest.fixture
+def server():
+    with FakeApiServer() as server:
+        server.add_spreadsheet("linebot_expense", {"expense": make_rows(3)})
+        yield server
+
+
+@pytest.fixture
+def registry(server):
+    config = bench_config(
+        GOOGLE_API_ENDPOINT=server.url, LINE_API_ENDPOINT=server.url, LINE_DATA_ENDPOINT=server.url,
+        GSPREADSHEET="linebot_expense", GWORKSHEET="expense",
+        LINE_CHANNEL_ACCESS_TOKEN="token",
+    )
+    return ClientRegistry(config)
+
+
+def run(registry, msg):
+    bo = BotOperation(registry.worksheet(), registry.line_bot_api, msg, "tk", registry.config)
+    bo.execute_command(msg.split(" ")[0])
+
+
+class TestFakeApiServer:
+    def test_commands_end_to_end(self, server, registry):
+        """測試透過 pygsheets 與 LineBotApi 對替身伺服器執行指令"""
+        run(registry, "write 小美 午餐 餐飲 100")
+        run(registry, "sum 小美")
+        run(registry, "clear")
+        run(registry, "revert")
+        run(registry, "read 1")
+
+        texts = [reply["messages"][0]["text"] for reply in server.replies]
+        assert texts[0].startswith("記錄成功")
+        assert texts[1].startswith("小美 已花費")
+        assert texts[3].startswith("備份資料還原成功")
+        assert "小美" in texts[4] and "100" in texts[4]
+        assert server.stats["POST /v4/spreadsheets/{id}/values/{range}:append"] == 1
+
+    def test_revert_older_snapshot(self, server, registry):
+        """測試 clear 以 duplicateSheet 建立快照，revert 編號以 copyPaste 還原"""
+        run(registry, "clear")
+        run(registry, "write 小美 午餐 餐飲 100")
+        run(registry, "clear")
+        run(registry, "revert list")
+        run(registry, "revert 2")
+        run(registry, "read")
+
+        texts = [reply["messages"][0]["text"] for reply in server.replies]
+        assert len(texts[3].splitlines()) == 3
+        assert texts[5].count("\n") == 3  # 標題與原本的 3 筆
+        assert "小美 午餐" not in texts[5]
+        # 只有 write 讀取 G1 與最後的 read 讀取資料，clear / revert 不讀取任何列
+        assert server.stats["GET /v4/spreadsheets/{id}/values/{range}"] == 2
+
+    def test_delete_and_update_targeted(self, server, registry):
+        """測試 delete / update 只讀取目標列，列與總和在同一次 batchUpdate 修改"""
+        run(registry, "delete 1 3")
+        run(registry, "update 1 2025-02-01 12:00:00 小美 午餐 餐飲 10")
+        run(registry, "read")
+
+        texts = [reply["messages"][0]["text"] for reply in server.replies]
+        assert texts[0].startswith("已刪除 2 筆")
+        assert texts[2].count("\n") == 1 and "小美" in texts[2]
+        assert "GET /v4/spreadsheets/{id}/values:batchGet" in server.stats
+        assert server.stats["POST /v4/spreadsheets/{id}:batchUpdate"] == 2
+        spreadsheet = next(iter(server.spreadsheets.values()))
+        assert spreadsheet.by_title("expense").read(0, 6, 1, 7) == [["10"]]
+
+    def test_import_uploaded_file(self, server, registry):
+        """測試下載上傳的 CSV 後分批匯入，總和只更新一次"""
+        registry.config.IMPORT_CHUNK_SIZE = 2
+        server.add_content("f1", "小美,午餐,餐飲,100\n小華,捷運,交通,30\n小美,晚餐,餐飲,70\n".encode("utf-8"))
+        bo = BotOperation(registry.worksheet(), registry.line_bot_api, "import", "tk", registry.config, message_id="f1")
+        bo.execute_command("import")
+
+        assert server.replies[0]["messages"][0]["text"] == "匯入成功 3 筆，共 200 元"
+        assert server.stats["POST /v4/spreadsheets/{id}/values/{range}:append"] == 2
+        assert server.stats["PUT /v4/spreadsheets/{id}/values/{range}"] == 1
+        assert server.stats["GET /v2/bot/message/{id}/content"] == 1
+
+    def test_ledger_per_source(self, server, registry):
+        """測試每個群組第一次記帳時建立自己的工作表，總和與資料互不影響"""
+        registry.config.LEDGER_SCOPE = "source"
+        for source, amount in (("Cgroup1", 100), ("Cgroup2", 30), ("Cgroup1", 20)):
+            config = SourceConfig(registry.config, f"expense_{source}")
+            wks = registry.worksheet(config.GWORKSHEET)
+            BotOperation(wks, registry.line_bot_api, f"write 小美 午餐 餐飲 {amount}", "tk", config).execute_command("write")
+
+        spreadsheet = next(iter(server.spreadsheets.values()))
+        assert spreadsheet.by_title("expense_Cgroup1").read(0, 6, 1, 7) == [["120"]]
+        assert spreadsheet.by_title("expense_Cgroup2").read(0, 6, 1, 7) == [["30"]]
+        assert len(spreadsheet.by_title("expense").read(0, 0, 10, 5)) == 4
+        # 兩個新工作表各以一次 addSheet 建立
+        assert server.stats["POST /v4/spreadsheets/{id}:batchUpdate"] == 2
+
+    def test_quota_exceeded(self, server):
+        """測試超過每分鐘配額時回傳 429"""
+        server.quota_per_minute = 1
+        url = f"{server.url}/drive/v3/files"
+        urllib.request.urlopen(url).read()
+
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            urllib.request.urlopen(url)
+        assert exc.value.code == 429
+        assert json.loads(exc.value.read())["error"]["status"] == "RESOURCE_EXHAUSTED"
+        assert server.stats["429"] == 1
@@ -0,0 +1,122 @@
+from unittest.mock import Mock
+
+import pytest
+
+from linebot_app.importer import ImportParser, iter_lines
+from linebot_app.ledger import LedgerCache
+from linebot_app.linebot_app_gcp import BotOperation
+from linebot_app.quota import QuotaExceeded
+from linebot_app.store import SQLiteLedgerStore
+
+NOW = "2025-03-01 09:00:00"
+
+
+class TestImportParser:
+    def test_formats(self):
+        """測試空白、逗號、tab 分隔與可省略的時間"""
+        parser = ImportParser(NOW)
+        lines = [
+            "小美 午餐 餐飲 100",
+            "2025-01-02 12:30:00 小華 捷運 交通 30",
+            "2025-01-03,小明,電影,娛樂,250",
+            "2025-01-04 08:00\t小美\t早餐\t餐飲\t45.5",
+        ]
+        rows = [row for chunk in parser.chunks(lines) for row in chunk]
+
+        assert rows == [
+            [NOW, "小美", "午餐", "餐飲", "100"],
+            ["2025-01-02 12:30:00", "小華", "捷運", "交通", "30"],
+            ["2025-01-03 00:00:00", "小明", "電影", "娛樂", "250"],
+            ["2025-01-04 08:00:00", "小美", "早餐", "餐飲", "45.5"],
+        ]
+        assert parser.amount == 425.5
+        assert parser.errors == []
+
+    def test_errors_collected(self):
+        """測試所有格式錯誤的行一起回報，其餘資料照常解析"""
+        parser = ImportParser(NOW)
+        lines = ["時間,人名,品項,分類,費用", "小美 午餐 餐飲 abc", "", "小美 午餐 100", "小華 晚餐 餐飲 80"]
+        rows = [row for chunk in parser.chunks(lines) for row in chunk]
+
+        assert [row[1] for row in rows] == ["小華"]
+        assert [(number, reason.split(":")[0]) for number, _, reason in parser.errors] == [
+            (2, "金額格式錯誤"), (4, "欄位數量錯誤，格式：[時間] 名字 品項 分類 金額"),
+        ]
+
+    def test_chunked(self):
+        """測試每 chunk_size 筆產生一批"""
+        parser = ImportParser(NOW, chunk_size=2)
+        chunks = list(parser.chunks([f"小美 午餐 餐飲 {i}" for i in range(5)]))
+
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert parser.count == 5
+
+    def test_iter_lines(self):
+        """測試跨區塊的 UTF-8 字元與換行都能正確解碼"""
+        data = "﻿小美 午餐 餐飲 100\r\n小華 晚餐 餐飲 80".encode("utf-8")
+        chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+
+        assert list(iter_lines(chunks)) == ["小美 午餐 餐飲 100", "小華 晚餐 餐飲 80"]
+
+
+class TestBulkImport:
+    def test_single_total_update(self, mock_wks, mock_line_api, mock_config):
+        """測試分批 append，總和只讀寫一次"""
+        mock_config.IMPORT_CHUNK_SIZE = 2
+        msg = "import\n小美 午餐 餐飲 100\n小美 晚餐 餐飲 50\n小華 捷運 交通 30\n壞資料"
+        BotOperation(mock_wks, mock_line_api, msg, "tk", mock_config).execute_command("import")
+
+        assert mock_wks.append_table.call_count == 2
+        assert mock_wks.cell.call_count == 1
+        mock_wks.update_value.assert_called_once_with("G1", 180.0)
+        text = mock_line_api.reply_message.call_args[0][1].text
+        assert text.startswith("匯入成功 3 筆，共 180 元")
+        assert "第 4 行" in text
+
+    def test_uploaded_file(self, mock_line_api, mock_config):
+        """測試上傳的檔案逐行匯入 SQLite 帳本"""
+        store = SQLiteLedgerStore(":memory:")
+        mock_line_api.get_message_content.return_value.iter_content.return_value = [
+            "時間,人名,品項,分類,費用\n2025-01-01 12:00:00,小美,午餐,餐飲,100\n".encode("utf-8")
+        ]
+        BotOperation(store, mock_line_api, "import", "tk", mock_config, message_id="m1").execute_command("import")
+
+        mock_line_api.get_message_content.assert_called_once_with("m1")
+        assert store.all_values()[1:] == [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]]
+        assert store.all_values()[0][-1] == "100"
+
+    def test_partial_import_updates_total(self, mock_wks, mock_line_api, mock_config):
+        """測試中途失敗時已寫入的批次仍計入 G1，並告知使用者新增了幾筆"""
+        mock_config.IMPORT_CHUNK_SIZE = 2
+        mock_wks.append_table.side_effect = [None, QuotaExceeded("quota")]
+        msg = "import\n小美 午餐 餐飲 100\n小美 晚餐 餐飲 50\n小華 捷運 交通 30"
+        BotOperation(mock_wks, mock_line_api, msg, "tk", mock_config).execute_command("import")
+
+        mock_wks.update_value.assert_called_once_with("G1", 150.0)
+        text = mock_line_api.reply_message.call_args[0][1].text
+        assert text.startswith("匯入中斷：已新增前 2 筆，共 150 元，其餘未匯入\n目前總和 150 元")
+
+    def test_chunks_kept_only_for_cache(self, mock_wks, mock_line_api, mock_config):
+        """測試帳本不在快取時，匯入的批次不會留在記憶體中"""
+        mock_config.IMPORT_CHUNK_SIZE = 1
+        cache = Mock(spec=LedgerCache)
+        cache.version.return_value = None
+        msg = "import\n小美 午餐 餐飲 100\n小美 晚餐 餐飲 50"
+        BotOperation(mock_wks, mock_line_api, msg, "tk", mock_config, cache=cache).execute_command("import")
+
+        assert mock_wks.append_table.call_count == 2
+        assert not cache.append.called
+        cache.set_total.assert_called_once()
+
+    def test_sqlite_import_atomic(self):
+        """測試 SQLite 帳本匯入中途失敗時整批還原，總和與資料一致"""
+        store = SQLiteLedgerStore(":memory:")
+
+        def chunks():
+            yield [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]]
+            raise QuotaExceeded("quota")
+
+        with pytest.raises(QuotaExceeded):
+            store.import_rows(chunks())
+        assert store.all_values()[1:] == []
+        assert store.all_values()[0][-1] == "0"
@@ -0,0 +1,313 @@
+import threading
+from datetime import date
+from unittest.mock import Mock, patch
+
+import pytest
+
+from linebot_app.compact import CompactLedger
+from linebot_app.export import row_filter
+from linebot_app.ledger import LedgerCache, LedgerIndex
+from linebot_app.report import LedgerColumns
+from linebot_app.timeindex import DaySeries, parse_period
+
+KEY = ("test_spreadsheet", "test_worksheet")
+ROWS = [
+    ["時間", "人名", "品項", "分類", "費用", "總和", "150"],
+    ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"],
+    ["2025-01-01 13:00:00", "小華", "交通", "交通", "50"],
+]
+
+
+class TestLedgerCache:
+    @pytest.fixture
+    def loader(self):
+        return Mock(return_value=ROWS)
+
+    def test_load_once(self, loader):
+        """測試只在第一次讀取時載入"""
+        cache = LedgerCache(max_age=300)
+        cache.rows(KEY, loader)
+        rows = cache.rows(KEY, loader)
+
+        assert loader.call_count == 1
+        assert rows == ROWS
+
+    def test_stale_reload(self, loader):
+        """測試超過保存時間後重新載入"""
+        cache = LedgerCache(max_age=0)
+        cache.rows(KEY, loader)
+        cache.rows(KEY, loader)
+
+        assert loader.call_count == 2
+
+    def test_mutations(self, loader):
+        """測試新增、更新、刪除與總和同步"""
+        cache = LedgerCache()
+        cache.rows(KEY, loader)
+        version = cache.version(KEY)
+
+        cache.append(KEY, [["2025-01-02 08:00:00", "小美", "早餐", "餐飲", "60"]])
+        cache.update(KEY, 1, ["2025-01-01 12:00:00", "小美", "晚餐", "餐飲", "120"])
+        cache.delete(KEY, 2)
+        cache.set_total(KEY, 180)
+        rows = cache.rows(KEY, loader)
+
+        assert loader.call_count == 1
+        assert [row[2] for row in rows[1:]] == ["晚餐", "早餐"]
+        assert rows[0][6] == "180"
+        assert cache.version(KEY) != version
+
+    def test_mutation_before_load_is_ignored(self):
+        """測試尚未載入時的修改不會建立快取"""
+        cache = LedgerCache()
+        cache.append(KEY, [["x"]])
+
+        assert cache.version(KEY) is None
+
+    def test_replace_and_invalidate(self, loader):
+        """測試整份覆寫與丟棄快取"""
+        cache = LedgerCache()
+        cache.replace(KEY, [ROWS[0]])
+        assert cache.rows(KEY, loader) == [ROWS[0]]
+        assert not loader.called
+
+        cache.invalidate(KEY)
+        cache.rows(KEY, loader)
+        assert loader.call_count == 1
+
+    def test_lru_bound(self, loader):
+        """測試超過上限時丟棄最久沒用的帳本"""
+        cache = LedgerCache(max_size=2)
+        cache.rows("a", loader)
+        cache.rows("b", loader)
+        cache.rows("a", loader)
+        cache.rows("c", loader)  # b 最久沒用
+
+        assert cache.version("b") is None
+        assert cache.version("a") is not None and cache.version("c") is not None
+        assert loader.call_count == 3
+
+    def test_idle_eviction(self, loader):
+        """測試閒置太久的帳本被丟棄"""
+        now = [0.0]
+        cache = LedgerCache(max_age=None, idle_seconds=60)
+        with patch("linebot_app.ledger.time.monotonic", lambda: now[0]):
+            cache.rows(KEY, loader)
+            now[0] = 30
+            cache.rows(KEY, loader)
+            now[0] = 100
+            assert cache.peek(KEY) is None
+
+    def test_load_outside_lock(self, loader):
+        """測試載入一個帳本時，其他帳本的讀寫不必等待"""
+        cache = LedgerCache()
+        cache.rows("fast", loader)
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return ROWS
+
+        thread = threading.Thread(target=cache.rows, args=("slow", slow))
+        thread.start()
+        assert started.wait(5)
+        cache.append("fast", [["2025-01-02 08:00:00", "小美", "早餐", "餐飲", "60"]])
+        assert len(cache.rows("fast", loader)) == 4
+        release.set()
+        thread.join(5)
+        assert cache.version("slow") is not None
+
+    def test_newer_entry_kept(self, loader):
+        """測試載入期間帳本被覆寫時，不以較舊的載入結果取代"""
+        cache = LedgerCache()
+
+        def load():
+            cache.replace(KEY, [ROWS[0]])
+            return ROWS
+
+        assert cache.rows(KEY, load) == [ROWS[0]]
+        assert cache.rows(KEY, loader) == [ROWS[0]]
+
+    def test_invalidated_load_not_cached(self, loader):
+        """測試載入期間被 invalidate 或修改時，載入結果不放進快取"""
+        cache = LedgerCache()
+
+        def load():
+            cache.invalidate(KEY)
+            return ROWS
+
+        assert cache.rows(KEY, load) == ROWS
+        assert cache.version(KEY) is None
+        cache.rows(KEY, loader)
+        assert loader.call_count == 1
+
+
+class TestLedgerIndex:
+    def test_build(self):
+        """測試一次掃描建立索引"""
+        index = LedgerIndex.build(ROWS)
+
+        assert index.total("小美", "sum") == (100.0, False)
+        assert index.total("交通", "type") == (50.0, False)
+        assert index.total("不存在", "sum") == (0, False)
+        assert index.types() == ["交通", "餐飲"]
+
+    def test_incremental_updates(self):
+        """測試快取修改時索引同步更新"""
+        cache = LedgerCache()
+        loader = Mock(return_value=ROWS)
+        index = cache.index(KEY, loader)
+
+        cache.append(KEY, [["2025-01-02 08:00:00", "小美", "早餐", "早餐", "0.1"]])
+        cache.delete(KEY, 2)
+        cache.update(KEY, 1, ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "0.2"])
+
+        assert index.total("小美", "sum") == (0.3, False)
+        assert index.total("小華", "sum") == (0, False)
+        assert index.types() == ["早餐", "餐飲"]
+
+    def test_invalid_amount(self):
+        """測試金額格式錯誤會被標記"""
+        index = LedgerIndex.build(ROWS + [["2025-01-03", "小美", "午餐", "餐飲", "abc"]])
+
+        assert index.total("小美", "sum")[1]
+        assert not index.total("小華", "sum")[1]
+
+    def test_verify_index(self):
+        """測試與試算表比對並修正索引"""
+        cache = LedgerCache()
+        cache.index(KEY, Mock(return_value=ROWS))
+        assert cache.verify_index(KEY, Mock(return_value=ROWS)) == []
+
+        changed = ROWS + [["2025-01-03", "小華", "晚餐", "餐飲", "80"]]
+        assert "totals_by_name" in cache.verify_index(KEY, Mock(return_value=changed))
+        assert cache.index(KEY, Mock()).total("小華", "sum") == (130.0, False)
+
+    def test_period_total(self):
+        """測試日期區間的加總與刪除後的更新"""
+        cache = LedgerCache()
+        index = cache.index(KEY, Mock(return_value=ROWS))
+        cache.append(KEY, [
+            ["2025-01-15 08:00:00", "小美", "早餐", "餐飲", "60"],
+            ["2025-02-01 08:00:00", "小美", "早餐", "餐飲", "40"],
+        ])
+
+        assert index.total("小美", "sum", parse_period("2025-01")) == (160.0, False)
+        assert index.total("小美", "sum", parse_period("2025-01-02~2025-02-28")) == (100.0, False)
+        assert index.total("餐飲", "type", parse_period("2025-02")) == (40.0, False)
+        assert index.total("小華", "sum", parse_period("2025-02")) == (0, False)
+
+        cache.delete(KEY, 4)
+        assert index.total("小美", "sum", parse_period("2025-02")) == (0, False)
+        assert index.summary(parse_period("2025-01")) == ({"小美": 160.0, "小華": 50.0}, {"餐飲": 160.0, "交通": 50.0})
+        assert cache.verify_index(KEY, Mock(return_value=list(cache.rows(KEY, Mock())))) == []
+
+
+# 組不回原本文字的列：日期沒有時間、金額寫法不同、欄位數不是 5、無法解析
+IRREGULAR_ROWS = [
+    [],
+    ["2025-01-02", "小美", "早餐", "餐飲", "30"],
+    ["2025-01-02 08:00:00", "小美", "早餐", "餐飲", "30.50"],
+    ["2025-01-02 08:00:00", "小華", "早餐", "餐飲", "abc"],
+    ["昨天", "小華", "晚餐", "餐飲", "20"],
+    ["2025-01-03 08:00:00", "小華", "早餐"],
+    ["2025-01-03 08:00:00", "小美", "早餐", "餐飲", "10", "備註"],
+]
+
+
+class TestCompactLedger:
+    def test_amounts_parsed_alike(self):
+        """測試字串列與 CompactLedger 對 nan、inf、過大的金額有相同的判斷"""
+        rows = ROWS + [["2025-01-02 12:00:00", "小美", "午餐", "餐飲", amount] for amount in ("nan", "inf", "1e30", "x")]
+        by_rows, by_compact = LedgerIndex.build(rows), LedgerIndex.build(CompactLedger(rows))
+
+        assert by_rows.totals_by_name == by_compact.totals_by_name == {"小美": 10000, "小華": 5000}
+        assert by_rows.invalid_by_name == by_compact.invalid_by_name == {"小美": 4}
+        assert list(LedgerColumns.build(rows).cents) == list(LedgerColumns.build(CompactLedger(rows)).cents)
+
+    def test_round_trip(self):
+        """測試組回的列與原本的字串相同，只有不規則的列保留原始內容"""
+        rows = ROWS + [["2025-01-04 09:30:15", "小美", "咖啡", "餐飲", "-45.5"]] + IRREGULAR_ROWS
+        ledger = CompactLedger(rows)
+
+        assert ledger == rows
+        assert list(ledger) == rows
+        assert ledger[2:5] == rows[2:5] and ledger[-1] == rows[-1]
+        assert len(ledger._raw) == len(IRREGULAR_ROWS)
+        assert ledger.nbytes() == 32 * (len(rows) - 1)
+        assert CompactLedger() == [] and list(CompactLedger()) == []
+
+    def test_copy_on_write(self):
+        """測試副本與原本的物件互不影響，副本不存在時修改不必複製"""
+        ledger = CompactLedger(ROWS)
+        snapshot = ledger.copy()
+        assert snapshot.stamps is ledger.stamps
+
+        ledger.append(["2025-01-02 08:00:00", "小美", "早餐", "餐飲", "30"])
+        ledger.set_total(180)
+        assert snapshot == ROWS
+        assert len(ledger) == 4 and ledger[0][6] == "180"
+
+        del snapshot
+        stamps = ledger.stamps
+        ledger.pop(3)
+        assert ledger.stamps is stamps and ledger == [ROWS[0][:6] + ["180"]] + ROWS[1:]
+
+    def test_copies_do_not_accumulate(self):
+        """測試只讀取的帳本重複 copy 時，已回收的副本不會留在共用記錄中"""
+        cache = LedgerCache()
+        cache.rows(KEY, Mock(return_value=ROWS))
+        for _ in range(1000):
+            cache.rows(KEY, Mock())
+
+        ledger = cache._entries[KEY].rows
+        assert len(ledger._views) <= 2
+        kept = cache.rows(KEY, Mock())
+        ledger.append(["2025-01-02 08:00:00", "小美", "早餐", "餐飲", "30"])
+        assert kept == ROWS
+
+    def test_aggregations_match_strings(self):
+        """測試由整數欄位建立的索引、報表欄位與篩選，結果與逐列解析字串相同"""
+        rows = ROWS + IRREGULAR_ROWS
+        ledger = CompactLedger(rows)
+
+        assert LedgerIndex.build(ledger).diff(LedgerIndex.build(rows)) == []
+        january = parse_period("2025-01")
+        start, end = january[0].toordinal(), january[1].toordinal()
+        labelled = [
+            {(month, columns.names[name], columns.types[kind]): cents
+             for (month, name, kind), cents in columns.group_by(start, end).items()}
+            for columns in (LedgerColumns.build(ledger), LedgerColumns.build(rows))
+        ]
+        assert labelled[0] == labelled[1]
+
+        for args in [(january, None, None), (None, "小華", None), (january, "小美", "餐飲"), (None, "不存在", None)]:
+            match = row_filter(*args)
+            assert list(ledger.select(*args)) == [row for row in rows[1:] if row and match(row)]
+
+
+class TestTimeIndex:
+    def test_parse_period(self):
+        """測試月份、單日與區間格式"""
+        assert parse_period("2024-02") == (date(2024, 2, 1), date(2024, 2, 29))
+        assert parse_period("2025-01-05") == (date(2025, 1, 5), date(2025, 1, 5))
+        assert parse_period("2025-01-01~2025-01-15") == (date(2025, 1, 1), date(2025, 1, 15))
+        for text in ("2025", "2025-13", "2025-01-15~2025-01-01", "abc"):
+            with pytest.raises(ValueError):
+                parse_period(text)
+
+    def test_day_series(self):
+        """測試 DaySeries 的區間加總與歸零時移除日期"""
+        series = DaySeries()
+        for day, cents in ((3, 100), (1, 50), (3, 20), (7, 30)):
+            series.add(day, cents)
+
+        assert series.days == [1, 3, 7]
+        assert series.total(1, 7) == 200
+        assert series.total(2, 6) == 120
+        assert series.total(8, 9) == 0
+
+        series.add(3, -120)
+        assert series.days == [1, 7]
+        assert series.total(1, 7) == 80
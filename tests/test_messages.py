@@ -0,0 +1,22 @@
+from linebot_app.messages import split_text
+
+
+class TestSplitText:
+    def test_short_text_single_message(self):
+        """測試內容不長時只產生一則訊息"""
+        assert split_text(["a", "b"]) == ["a\nb"]
+
+    def test_split_within_limit(self):
+        """測試每則訊息不超過字數上限"""
+        chunks = split_text(["x" * 40] * 10, limit=100)
+
+        assert len(chunks) == 5
+        assert all(len(chunk) <= 100 for chunk in chunks)
+
+    def test_overflow_hint(self):
+        """測試超過則數上限時截斷並加上提示"""
+        chunks = split_text(["x" * 40] * 100, overflow_hint="more", limit=100, max_messages=2)
+
+        assert len(chunks) == 2
+        assert chunks[-1].endswith("more")
+        assert len(chunks[-1]) <= 100
@@ -0,0 +1,134 @@
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+
+from linebot_app.linebot_app_gcp import app, linebot
+from linebot_app.metrics import SHEETS_WRAP, Metrics, payload_size
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+
+class TestInstrumentedProxy:
+    def test_counts_calls_and_bytes(self, metrics):
+        """測試記錄呼叫次數與傳輸量"""
+        wks = Mock()
+        wks.get_all_values.return_value = [["a", "b"]]
+        proxy = metrics.instrument(wks, "sheets")
+
+        assert proxy.get_all_values() == [["a", "b"]]
+        assert metrics.value("linebot_api_calls_total", service="sheets", method="get_all_values", command="none") == 1
+        assert metrics.value("linebot_api_bytes_total", service="sheets", direction="received", command="none") == len('[["a", "b"]]')
+
+    def test_payload_size(self):
+        """測試短的內容與 JSON 長度相同，整份帳本只取樣估計，不逐列序列化"""
+        small = {"values": [["2025-01-01", "小美", 100, None, 1.5, True]], "range": "A1"}
+        assert payload_size(small) == len(json.dumps(small, ensure_ascii=False).encode("utf-8"))
+
+        row = ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]
+        ledger = [row] * 100_000
+        with patch("linebot_app.metrics.json.dumps", wraps=json.dumps) as dumps:
+            size = payload_size(ledger)
+        assert size == len(json.dumps(ledger, ensure_ascii=False).encode("utf-8"))
+        assert dumps.call_count < 100
+
+    def test_records_errors(self, metrics):
+        """測試呼叫失敗時記錄錯誤並拋出原例外"""
+        wks = Mock()
+        wks.delete_rows.side_effect = ValueError("bad")
+        proxy = metrics.instrument(wks, "sheets")
+
+        with pytest.raises(ValueError):
+            proxy.delete_rows(2)
+        assert metrics.value(
+            "linebot_api_errors_total", service="sheets", method="delete_rows", command="none", error="ValueError"
+        ) == 1
+
+    def test_wraps_nested_objects(self, metrics):
+        """測試備份工作表的呼叫也會被記錄"""
+        wks = Mock()
+        proxy = metrics.instrument(wks, "sheets", **SHEETS_WRAP)
+
+        proxy.spreadsheet.worksheet_by_title("backup").clear()
+        assert metrics.value("linebot_api_calls_total", service="sheets", method="clear", command="none") == 1
+
+    def test_disabled_returns_target(self):
+        """測試停用時不包裝"""
+        wks = Mock()
+        assert Metrics(enabled=False).instrument(wks, "sheets") is wks
+
+
+class TestMetrics:
+    def test_command_phases(self, metrics, capsys):
+        """測試指令的 fetch、reply、compute 階段與 trace log"""
+        api = metrics.instrument(Mock(), "line")
+        with metrics.command("sum", trace_log=True) as trace:
+            api.reply_message("tk", "hi")
+
+        assert set(trace.phases) == {"reply", "compute"}
+        assert metrics.value("linebot_commands_total", command="sum", status="ok") == 1
+        assert metrics.value("linebot_api_calls_total", service="line", method="reply_message", command="sum") == 1
+        record = json.loads(capsys.readouterr().out)
+        assert record["command"] == "sum"
+        assert record["calls"][0]["method"] == "reply_message"
+
+    def test_phase_recorded_once(self, metrics):
+        """測試指令中的 auth、throttle 等階段只記錄一次，指令外的階段直接記錄"""
+        with metrics.command("read"):
+            with metrics.phase("auth"):
+                pass
+            metrics.record_phase("throttle", 0.5)
+        with metrics.request():
+            with metrics.phase("verify"):
+                pass
+
+        text = metrics.render()
+        assert 'linebot_phase_seconds_count{command="read",phase="auth"} 1' in text
+        assert 'linebot_phase_seconds_count{command="read",phase="throttle"} 1' in text
+        assert 'linebot_phase_seconds_count{command="webhook",phase="verify"} 1' in text
+
+    def test_render_prometheus(self, metrics):
+        """測試輸出 Prometheus text 格式"""
+        metrics.inc("linebot_commands_total", command="read", status="ok")
+        metrics.observe("linebot_command_seconds", 0.02, command="read")
+        text = metrics.render()
+
+        assert "# TYPE linebot_commands_total counter" in text
+        assert 'linebot_commands_total{command="read",status="ok"} 1' in text
+        assert 'linebot_command_seconds_bucket{command="read",le="0.01"} 0' in text
+        assert 'linebot_command_seconds_bucket{command="read",le="0.025"} 1' in text
+        assert 'linebot_command_seconds_count{command="read"} 1' in text
+
+
+class TestWebhookMetrics:
+    def test_webhook_records_phases(self, metrics, signed_request, mock_registry, mock_wks, mock_line_api):
+        """測試 webhook 記錄 verify、auth 階段與指令的 Sheets、LINE 呼叫"""
+        mock_registry.worksheet.return_value = mock_wks
+        mock_registry.line_bot_api = mock_line_api
+        body = {"events": [{"type": "message", "replyToken": "tk", "message": {"type": "text", "text": "sum 小美"}}]}
+
+        with patch("linebot_app.linebot_app_gcp.registry", mock_registry), \
+                patch("linebot_app.linebot_app_gcp.metrics", metrics):
+            assert linebot(signed_request(body)) == "OK"
+
+        assert mock_line_api.reply_message.called
+        assert metrics.value("linebot_api_calls_total", service="sheets", method="get_all_values", command="sum") == 1
+        assert metrics.value("linebot_commands_total", command="sum", status="ok") == 1
+        text = metrics.render()
+        for phase in ("verify", "auth"):
+            assert f'linebot_phase_seconds_count{{command="webhook",phase="{phase}"}} 1' in text
+        for phase in ("fetch", "compute", "reply"):
+            assert f'linebot_phase_seconds_count{{command="sum",phase="{phase}"}} 1' in text
+
+    def test_metrics_route(self, metrics):
+        """測試 /metrics 路由"""
+        metrics.inc("linebot_commands_total", command="read", status="ok")
+        with patch("linebot_app.linebot_app_gcp.metrics", metrics):
+            response = app.test_client().get("/metrics")
+
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        assert b"linebot_commands_total" in response.data
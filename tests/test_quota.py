@@ -0,0 +1,161 @@
+import threading
+import time
+from unittest.mock import Mock
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from benchmarks.fake_sheets import fake_worksheet
+from linebot_app.quota import BULK, INTERACTIVE, QuotaExceeded, SheetsScheduler, TokenBucket, WriteUncertain, bulk
+
+
+def http_error(status, headers=None):
+    return HttpError(httplib2.Response({"status": status, **(headers or {})}), b"error")
+
+
+class TestTokenBucket:
+    def test_burst_then_wait(self):
+        """測試用完累積的 token 後需要等待"""
+        bucket = TokenBucket(rate_per_minute=600, burst=2)
+
+        assert bucket.acquire()
+        assert bucket.acquire()
+        assert not bucket.acquire(deadline=time.monotonic() + 0.01)
+        assert bucket.acquire(deadline=time.monotonic() + 1)
+
+    def test_interactive_before_bulk(self):
+        """測試互動指令優先於先排隊的大量工作"""
+        bucket = TokenBucket(rate_per_minute=600, burst=1)
+        bucket.acquire()
+        order = []
+
+        def take(name, priority):
+            bucket.acquire(priority)
+            order.append(name)
+
+        bulk_thread = threading.Thread(target=take, args=("bulk", BULK))
+        bulk_thread.start()
+        time.sleep(0.02)
+        interactive_thread = threading.Thread(target=take, args=("interactive", INTERACTIVE))
+        interactive_thread.start()
+        bulk_thread.join()
+        interactive_thread.join()
+
+        assert order == ["interactive", "bulk"]
+
+    def test_unlimited(self):
+        """測試 rate 為 0 時不限制"""
+        bucket = TokenBucket(rate_per_minute=0)
+        assert all(bucket.acquire() for _ in range(100))
+
+
+class TestSheetsScheduler:
+    @pytest.fixture
+    def sleeps(self):
+        return []
+
+    @pytest.fixture
+    def scheduler(self, sleeps):
+        return SheetsScheduler(rate_per_minute=0, deadline=60, sleep=sleeps.append)
+
+    def test_retry_with_backoff(self, scheduler, sleeps):
+        """測試 429、503 以指數退避重試後成功"""
+        func = Mock(side_effect=[http_error(429), http_error(503), "ok"])
+
+        assert scheduler.call(func, 1, key="v") == "ok"
+        func.assert_called_with(1, key="v")
+        assert len(sleeps) == 2
+        assert 0.25 <= sleeps[0] <= 0.5
+        assert 0.5 <= sleeps[1] <= 1.0
+
+    def test_retry_after_header(self, scheduler, sleeps):
+        """測試遵守 Retry-After"""
+        func = Mock(side_effect=[http_error(429, {"retry-after": "3"}), "ok"])
+
+        scheduler.call(func)
+        assert sleeps == [3.0]
+
+    def test_deadline(self, sleeps):
+        """測試超過期限時拋出 QuotaExceeded"""
+        scheduler = SheetsScheduler(rate_per_minute=0, deadline=2, sleep=sleeps.append)
+        func = Mock(side_effect=http_error(503))
+
+        with pytest.raises(QuotaExceeded):
+            scheduler.call(func)
+        assert func.call_count == len(sleeps) + 1
+        assert all(delay < 2 for delay in sleeps)
+
+    def test_non_retryable_error(self, scheduler):
+        """測試 404 等錯誤直接拋出"""
+        func = Mock(side_effect=http_error(404))
+
+        with pytest.raises(HttpError):
+            scheduler.call(func)
+        assert func.call_count == 1
+
+    def test_non_idempotent_retries_only_429(self, scheduler, sleeps):
+        """測試新增、刪除等寫入只在 429 重試，逾時與 5xx 不重送"""
+        func = Mock(side_effect=[http_error(429), TimeoutError("timed out")])
+        with pytest.raises(WriteUncertain):
+            scheduler.call(func, idempotent=False)
+        assert func.call_count == 2 and len(sleeps) == 1
+
+        proxy = scheduler.wrap(Mock(**{"append_table.side_effect": http_error(503)}))
+        with pytest.raises(WriteUncertain):
+            proxy.append_table(values=[["a"]])
+        assert proxy._target.append_table.call_count == 1
+
+    def test_wrap_uses_priority(self):
+        """測試 wrap 後的 worksheet 呼叫經過排程，bulk 區塊以低優先順序排隊"""
+        scheduler = SheetsScheduler(rate_per_minute=0)
+        scheduler.bucket = Mock()
+        scheduler.bucket.acquire.return_value = True
+        wks = Mock()
+        proxy = scheduler.wrap(wks)
+
+        proxy.get_all_values()
+        with bulk():
+            proxy.spreadsheet.worksheet_by_title("backup").clear()
+
+        priorities = [call.args[0] for call in scheduler.bucket.acquire.call_args_list]
+        assert priorities == [INTERACTIVE, BULK, BULK]
+        assert wks.spreadsheet.worksheet_by_title.return_value.clear.called
+
+
+class TestHandleEventThrottled:
+    def test_reply_when_quota_exceeded(self, mock_config, mock_wks, mock_line_api):
+        """測試配額等不到時回覆稍後再試"""
+        from linebot_app.linebot_app_gcp import handle_event
+        from linebot_app.webhook import to_event
+
+        mock_config.LEDGER_CACHE_MAX_AGE = 0
+        mock_wks.get_all_values.side_effect = QuotaExceeded("busy")
+        event = to_event({"type": "message", "replyToken": "tk", "message": {"type": "text", "text": "sum 小美"}})
+
+        handle_event(event, mock_wks, mock_line_api, mock_config)
+
+        args, _ = mock_line_api.reply_message.call_args
+        assert args[1].text == "試算表忙碌中，請稍後再試"
+
+    def test_timed_out_append_not_repeated(self, mock_config, mock_line_api):
+        """測試寫入後連線逾時不會重送而新增兩列，回覆請使用者確認"""
+        from linebot_app.linebot_app_gcp import WRITE_UNCERTAIN_TEXT, handle_event
+        from linebot_app.webhook import to_event
+
+        wks = fake_worksheet([["時間", "人名", "品項", "分類", "費用", "總和", "0"]], title=mock_config.GWORKSHEET)
+        append_table = wks.append_table
+
+        def append_then_timeout(values):
+            # 試算表已寫入，但回應在途中逾時
+            append_table(values=values)
+            raise TimeoutError("read timed out")
+
+        wks.append_table = append_then_timeout
+        event = to_event({"type": "message", "replyToken": "tk", "message": {"type": "text", "text": "write 小美 午餐 餐飲 100"}})
+
+        handle_event(event, wks, mock_line_api, mock_config)
+
+        assert len(wks.rows) == 2
+        args, _ = mock_line_api.reply_message.call_args
+        assert args[1].text == WRITE_UNCERTAIN_TEXT
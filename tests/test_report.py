@@ -0,0 +1,88 @@
+from datetime import date
+
+from linebot_app.ledger import LedgerCache
+from linebot_app.linebot_app_gcp import BotOperation
+from linebot_app.report import LedgerColumns, render_report
+
+ROWS = [
+    ["時間", "人名", "品項", "分類", "費用", "總和", "520"],
+    ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"],
+    ["2025-01-03 13:00:00", "小華", "捷運", "交通", "30"],
+    ["2025-01-05 19:00:00", "小美", "電影", "娛樂", "250"],
+    ["2025-02-01 08:00:00", "小美", "早餐", "餐飲", "40"],
+    ["2025-02-02 12:00:00", "小華", "午餐", "餐飲", "100"],
+    ["壞掉的時間", "小華", "午餐", "餐飲", "100"],
+    ["2025-02-03 12:00:00", "小華", "午餐", "餐飲", "abc"],
+]
+JANUARY = (date(2025, 1, 1), date(2025, 1, 31))
+
+
+class TestLedgerColumns:
+    def test_build(self):
+        """測試人名、分類轉成代碼，無法解析的列不計入"""
+        columns = LedgerColumns.build(ROWS)
+
+        assert len(columns) == 5
+        assert columns.names == ["小美", "小華"]
+        assert columns.types == ["餐飲", "交通", "娛樂"]
+        assert list(columns.cents) == [10000, 3000, 25000, 4000, 10000]
+
+    def test_group_by(self):
+        """測試依 (月份, 人名, 分類) 加總指定日期區間"""
+        groups = LedgerColumns.build(ROWS).group_by(date(2025, 1, 2).toordinal(), date(2025, 2, 1).toordinal())
+
+        assert groups == {
+            (2025 * 12, 1, 1): 3000,
+            (2025 * 12, 0, 2): 25000,
+            (2025 * 12 + 1, 0, 0): 4000,
+        }
+
+
+class TestRenderReport:
+    def test_single_month(self):
+        """測試單月的表格與排行"""
+        lines = render_report(LedgerColumns.build(ROWS), JANUARY, "2025-01", top_n=2)
+
+        assert lines == [
+            "報表 2025-01（共 380 元）",
+            "小美：娛樂 250、餐飲 100（小計 350）",
+            "小華：交通 30（小計 30）",
+            "",
+            "分類前 2 名：",
+            "1. 娛樂 250 元",
+            "2. 餐飲 100 元",
+            "",
+            "人名前 2 名：",
+            "1. 小美 350 元",
+            "2. 小華 30 元",
+        ]
+
+    def test_multiple_months(self):
+        """測試跨月時分月列出"""
+        lines = render_report(LedgerColumns.build(ROWS), (date(2025, 1, 1), date(2025, 2, 28)), "2025-01~2025-02")
+
+        assert lines[0] == "報表 2025-01~2025-02（共 520 元）"
+        assert "【2025-01】" in lines and "【2025-02】" in lines
+        assert lines[lines.index("【2025-02】") + 1] == "小華：餐飲 100（小計 100）"
+
+    def test_empty(self):
+        assert render_report(LedgerColumns.build(ROWS), (date(2024, 1, 1), date(2024, 1, 31)), "2024-01") == [
+            "2024-01 沒有記錄"
+        ]
+
+
+class TestReportCommand:
+    def test_report_uses_cache(self, mock_wks, mock_line_api, mock_config):
+        """測試 report 只讀取一次試算表，帳本未變動時重複使用欄式資料"""
+        mock_wks.get_all_values.return_value = ROWS
+        cache = LedgerCache(max_age=300)
+
+        def run(msg):
+            BotOperation(mock_wks, mock_line_api, msg, "tk", mock_config, cache=cache).execute_command("report")
+            args, _ = mock_line_api.reply_message.call_args
+            return args[1].text
+
+        assert run("report 2025-01").startswith("報表 2025-01（共 380 元）")
+        assert run("report 2025-02").startswith("報表 2025-02（共 140 元）")
+        assert run("report 2025/02").startswith("格式錯誤")
+        assert mock_wks.get_all_values.call_count == 1
@@ -0,0 +1,259 @@
+import copy
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date
+from unittest.mock import Mock, patch
+
+import pytest
+
+from linebot_app.linebot_app_gcp import BotOperation
+from linebot_app.store import BackupNotFound, MirroredLedgerStore, SQLiteLedgerStore, open_store
+
+ROWS = [
+    ["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"],
+    ["2025-01-01 13:00:00", "小華", "交通", "交通", "50"],
+]
+
+
+class TestSQLiteLedgerStore:
+    @pytest.fixture
+    def store(self):
+        store = SQLiteLedgerStore(":memory:")
+        store.append_rows(ROWS, 150)
+        return store
+
+    def test_append_and_read(self, store):
+        """測試新增後讀取與總和"""
+        values = store.all_values()
+
+        assert values[0][-1] == "150"
+        assert values[1:] == ROWS
+        assert store.row_count() == 3
+        assert store.get_rows(2, 3) == [ROWS[1]]
+
+    def test_delete_and_update(self, store):
+        """測試刪除與更新時總和同步變動"""
+        assert store.update_row(1, ["2025-01-01 12:00:00", "小美", "晚餐", "餐飲", "80"], 100, 80) == 130
+        assert store.delete_row(2, 50) == 80
+        assert store.all_values()[1:] == [["2025-01-01 12:00:00", "小美", "晚餐", "餐飲", "80"]]
+
+    def test_delete_rows(self, store):
+        """測試一次刪除多列只更新一次總和"""
+        store.append_rows([["2025-01-02 12:00:00", "小明", "電影", "娛樂", "300"]], 300)
+
+        assert store.delete_rows([3, 1], [300, 100]) == 50
+        assert store.all_values()[1:] == [ROWS[1]]
+
+    def test_indexed_aggregates(self, store):
+        """測試依人名、分類加總與分類清單"""
+        assert store.sum_by("sum", "小美") == (100.0, False)
+        assert store.sum_by("type", "交通") == (50.0, False)
+        assert store.sum_by("sum", "不存在") == (0, False)
+        assert store.categories() == ["交通", "餐飲"]
+
+    def test_period_aggregates(self, store):
+        """測試日期區間的加總與月份摘要"""
+        store.append_rows([["2025-02-03 09:00:00", "小美", "早餐", "餐飲", "40"]], 40)
+        january = (date(2025, 1, 1), date(2025, 1, 31))
+
+        assert store.sum_by("sum", "小美", january) == (100.0, False)
+        assert store.sum_by("type", "餐飲", (date(2025, 2, 3), date(2025, 2, 3))) == (40.0, False)
+        assert store.summary(january) == ({"小美": 100.0, "小華": 50.0}, {"餐飲": 100.0, "交通": 50.0})
+        assert store.summary((date(2025, 3, 1), date(2025, 3, 31))) == ({}, {})
+
+    def test_clear_and_revert(self, store):
+        """測試清除後還原"""
+        with pytest.raises(BackupNotFound):
+            store.revert()
+
+        store.clear(["時間", "人名", "品項", "分類", "費用", "總和", 0])
+        assert store.row_count() == 1
+
+        assert store.revert().startswith("entries_backup_")
+        restored = store.all_values()
+        assert restored[1:] == ROWS
+        assert restored[0][-1] == "150"
+
+    def test_versioned_snapshots(self):
+        """測試保留最近 keep 份快照，可還原任一份"""
+        store = SQLiteLedgerStore(":memory:", keep=2)
+        for row in ROWS + [["2025-01-02 12:00:00", "小明", "電影", "娛樂", "300"]]:
+            store.append_rows([row], float(row[4]))
+            store.clear(["時間", "人名", "品項", "分類", "費用", "總和", 0])
+
+        assert len(store.snapshots()) == 2
+        store.revert(2)
+        assert store.all_values()[1:] == [ROWS[1]]
+        assert store.sum_by("sum", "小華") == (50.0, False)
+        store.revert(1)
+        assert store.all_values()[0][-1] == "300"
+        with pytest.raises(BackupNotFound):
+            store.revert(3)
+        # 被刪除的快照資料也一併清除
+        assert store._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 3
+
+    def test_migrates_old_schema(self, tmp_path):
+        """測試沒有 segment 欄位的舊資料庫可直接開啟"""
+        path = str(tmp_path / "old.sqlite3")
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE entries (id INTEGER PRIMARY KEY AUTOINCREMENT, ledger TEXT NOT NULL, ts TEXT NOT NULL,
+                name TEXT NOT NULL, item TEXT NOT NULL, category TEXT NOT NULL, amount TEXT NOT NULL, cents INTEGER);
+            CREATE TABLE ledgers (ledger TEXT PRIMARY KEY, total_cents INTEGER NOT NULL DEFAULT 0,
+                has_backup INTEGER NOT NULL DEFAULT 0);
+            INSERT INTO entries (ledger, ts, name, item, category, amount, cents)
+                VALUES ('expense', '2025-01-01 12:00:00', '小美', '午餐', '餐飲', '100', 10000);
+            INSERT INTO ledgers (ledger, total_cents) VALUES ('expense', 10000);
+        """)
+        conn.close()
+
+        store = SQLiteLedgerStore(path)
+        assert store.all_values()[1:] == [ROWS[0]]
+        assert store.sum_by("sum", "小美") == (100.0, False)
+
+
+class TestMirroredLedgerStore:
+    def test_changes_replayed_in_order(self):
+        """測試修改依序同步到 mirror"""
+        mirror = Mock()
+        store = MirroredLedgerStore(SQLiteLedgerStore(":memory:"), mirror)
+
+        assert store.append_rows(ROWS, 150) == 150
+        store.delete_row(1, 100)
+        store.flush()
+
+        assert [call[0] for call in mirror.method_calls] == ["append_rows", "delete_row"]
+
+    def test_clear_and_revert_mirrored(self):
+        """測試 clear 在 mirror 建立快照，revert 以 primary 還原後的內容覆寫 mirror"""
+        mirror = Mock()
+        store = MirroredLedgerStore(SQLiteLedgerStore(":memory:"), mirror)
+        store.append_rows(ROWS, 150)
+        store.clear(["時間", "人名", "品項", "分類", "費用", "總和", 0])
+        store.revert()
+        store.flush()
+
+        assert [call[0] for call in mirror.method_calls] == ["append_rows", "clear", "replace_all"]
+        assert mirror.replace_all.call_args[0][0][1:] == ROWS
+
+    def test_bootstrap_from_mirror(self):
+        """測試本機資料庫為空時從試算表匯入"""
+        mirror = Mock()
+        mirror.all_values.return_value = [["時間", "人名", "品項", "分類", "費用", "總和", "150"]] + ROWS
+        store = MirroredLedgerStore(SQLiteLedgerStore(":memory:"), mirror).bootstrap()
+
+        assert store.all_values()[1:] == ROWS
+        assert store.sum_by("sum", "小華") == (50.0, False)
+
+    def test_resync_after_failure(self):
+        """測試同步失敗後以整份覆寫修正"""
+        mirror = Mock()
+        mirror.append_rows.side_effect = RuntimeError("quota")
+        store = MirroredLedgerStore(SQLiteLedgerStore(":memory:"), mirror)
+
+        store.append_rows(ROWS, 150)
+        store.delete_row(1, 100)
+        store.flush()
+
+        assert mirror.replace_all.called
+        assert not mirror.delete_row.called
+
+
+    def test_open_store_closes_least_recent(self, tmp_path, mock_config, mock_wks):
+        """測試開啟的帳本超過上限時，最久沒用的同步完才關閉，之後再使用會重新開啟"""
+        mock_config.LEDGER_BACKEND = "sqlite"
+        mock_config.SQLITE_PATH = str(tmp_path / "ledger.sqlite3")
+        mock_config.SQLITE_STORE_CACHE_SIZE = 1
+        with patch("linebot_app.store._sqlite_stores", OrderedDict()) as stores:
+            first = open_store(mock_wks, mock_config)
+            first.append_rows(ROWS, 150)
+            rows = first.row_count()
+            first.release()
+            mock_config.GWORKSHEET = "other"
+            second = open_store(mock_wks, mock_config)
+
+            assert list(stores.values()) == [second]
+        assert first._thread is None and first.primary._db is None
+        assert mock_wks.append_table.called
+        assert first.row_count() == rows
+
+    def test_open_store_keeps_stores_in_use(self, tmp_path, mock_config, mock_wks):
+        """測試指令使用中的帳本不會被關閉，重新開啟同一個帳本取得同一個 store"""
+        mock_config.LEDGER_BACKEND = "sqlite"
+        mock_config.SQLITE_PATH = str(tmp_path / "ledger.sqlite3")
+        mock_config.SQLITE_STORE_CACHE_SIZE = 1
+        other = copy.copy(mock_config)
+        other.GWORKSHEET = "other"
+        with patch("linebot_app.store._sqlite_stores", OrderedDict()) as stores:
+            first = open_store(mock_wks, mock_config)
+            second = open_store(mock_wks, other)
+            second.release()
+
+            assert list(stores.values()) == [first, second]
+            first.append_rows(ROWS, 150)
+            assert first._thread is not None
+            assert open_store(mock_wks, mock_config) is first
+            # second 已沒有指令使用，超過上限時關閉
+            assert list(stores.values()) == [first]
+            first.release()
+            first.release()
+            third = open_store(mock_wks, other)
+
+            assert list(stores.values()) == [third]
+        assert first._thread is None and mock_wks.append_table.called
+
+    def test_open_store_bootstraps_outside_lock(self, tmp_path, mock_config, mock_wks):
+        """測試首次下載工作表時不阻擋其他帳本，同一個帳本同時開啟只下載一次"""
+        mock_config.LEDGER_BACKEND = "sqlite"
+        mock_config.SQLITE_PATH = str(tmp_path / "ledger.sqlite3")
+        other = copy.copy(mock_config)
+        other.GWORKSHEET = "other"
+        started, release = threading.Event(), threading.Event()
+        slow_wks = Mock()
+        waited = []
+
+        def get_all_values(**kwargs):
+            started.set()
+            waited.append(release.wait(5))
+            return mock_wks.get_all_values.return_value
+
+        slow_wks.get_all_values.side_effect = get_all_values
+        with patch("linebot_app.store._sqlite_stores", OrderedDict()):
+            opened = []
+            threads = [
+                threading.Thread(target=lambda: opened.append(open_store(slow_wks, mock_config))) for _ in range(2)
+            ]
+            for thread in threads:
+                thread.start()
+            assert started.wait(5)
+            # 另一個帳本不必等待正在下載的工作表
+            assert open_store(mock_wks, other).row_count() == 3
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        assert waited == [True]
+        assert len(opened) == 2 and opened[0] is opened[1]
+        assert slow_wks.get_all_values.call_count == 1
+        assert opened[0].row_count() == 3
+
+
+
+class TestBotOperationWithSQLite:
+    def test_commands(self, mock_line_api, mock_config):
+        """測試 BotOperation 透過 SQLite 儲存執行指令"""
+        store = SQLiteLedgerStore(":memory:")
+
+        def run(msg):
+            BotOperation(store, mock_line_api, msg, "tk", mock_config).execute_command(msg.split(" ")[0])
+            args, _ = mock_line_api.reply_message.call_args
+            return args[1]
+
+        run("write 小美 午餐 餐飲 100/晚餐 餐飲 60")
+        assert run("sum 小美").text == "小美 已花費 160.0 元"
+        run("delete 1")
+        assert run("type 餐飲").text == "餐飲 已花費 60.0 元"
+        assert "晚餐" in run("read").text
+        assert run("sum 小美 2025-01").text == "小美 在 2025-01 已花費 0 元"
+        assert run("sum 小美 2025-13").text.startswith("查詢失敗")
@@ -0,0 +1,69 @@
+import pytest
+
+from linebot_app.linebot_app_gcp import BotOperation
+from linebot_app.totals import TOTAL_FORMULA, FormulaTotals, cell_data
+
+
+def total_response(total):
+    """模擬 batchUpdate 回傳的 G1 計算結果"""
+    return {
+        "updatedSpreadsheet": {
+            "sheets": [{"data": [{"rowData": [{"values": [{"effectiveValue": {"numberValue": total}}]}]}]}]
+        }
+    }
+
+
+class TestFormulaTotals:
+    @pytest.fixture
+    def formula_wks(self, mock_wks):
+        mock_wks.id = 0
+        mock_wks.title = "test_worksheet"
+        mock_wks.spreadsheet.id = "spreadsheet_id"
+        mock_wks.client.sheet.batch_update.return_value = total_response(250)
+        return mock_wks
+
+    def test_cell_data(self):
+        """測試與 USER_ENTERED 相同的解析結果"""
+        assert cell_data("100") == {"userEnteredValue": {"numberValue": 100.0}}
+        assert cell_data("午餐") == {"userEnteredValue": {"stringValue": "午餐"}}
+        assert cell_data(TOTAL_FORMULA) == {"userEnteredValue": {"formulaValue": TOTAL_FORMULA}}
+        assert cell_data("2025-01-01 12:00:00")["userEnteredValue"]["numberValue"] == pytest.approx(45658.5)
+
+    def test_cell_data_keeps_text(self):
+        """測試 float() 接受但不是一般數字的文字保留為字串"""
+        assert cell_data("-45.5") == {"userEnteredValue": {"numberValue": -45.5}}
+        assert cell_data("1e3") == {"userEnteredValue": {"numberValue": 1000.0}}
+        for text in ("nan", "inf", "-Infinity", "1_000", " 12", "1e400"):
+            assert cell_data(text) == {"userEnteredValue": {"stringValue": text}}
+
+    def test_append_single_round_trip(self, formula_wks):
+        """測試新增列與 G1 公式在同一次 batchUpdate"""
+        totals = FormulaTotals(formula_wks)
+        new_total = totals.append([["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]])
+
+        assert new_total == 250.0
+        assert formula_wks.client.sheet.batch_update.call_count == 1
+        requests = formula_wks.client.sheet.batch_update.call_args[0][1]
+        assert [list(r)[0] for r in requests] == ["appendCells", "updateCells"]
+
+    def test_empty_total(self, formula_wks):
+        """測試公式沒有結果時總和為 0"""
+        formula_wks.client.sheet.batch_update.return_value = {"updatedSpreadsheet": {"sheets": [{"data": [{}]}]}}
+
+        assert FormulaTotals(formula_wks).install() == 0.0
+
+    def test_bot_operation_formula_mode(self, formula_wks, mock_line_api, mock_config):
+        """測試 formula 模式下 write/delete/update 不再讀取 G1"""
+        mock_config.TOTAL_MODE = "formula"
+        mock_config.THRESHOLD_AMOUNT = 200
+        formula_wks.get_values.return_value = [["2025-01-01 12:00:00", "小美", "午餐", "餐飲", "100"]]
+        BotOperation(formula_wks, mock_line_api, "write 小美 午餐 餐飲 100", "tk", mock_config).write()
+        BotOperation(formula_wks, mock_line_api, "delete", "tk", mock_config).delete(1)
+        BotOperation(formula_wks, mock_line_api, "update", "tk", mock_config).update(
+            1, "2024-01-01 12:00:00 小美 早餐 餐飲 80"
+        )
+
+        assert formula_wks.client.sheet.batch_update.call_count == 3
+        assert not formula_wks.cell.called
+        assert not formula_wks.append_table.called
+        assert not formula_wks.delete_rows.called
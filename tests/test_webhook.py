@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from linebot.v3.exceptions import InvalidSignatureError
+
+from linebot_app.webhook import WebhookParser, is_import_file, is_text
+
+
+class TestWebhookParser:
+    @pytest.fixture
+    def parser(self):
+        return WebhookParser("test_secret")
+
+    def test_parse_valid_signature(self, parser, sample_webhook_data):
+        """測試簽章正確時解析成 LineEvent"""
+        body = json.dumps(sample_webhook_data).encode("utf-8")
+        events = parser.parse(body, parser.signature_for(body))
+
+        assert len(events) == 1
+        assert events[0].text == "read"
+        assert events[0].reply_token == "test_reply_token"
+        assert is_text(events[0])
+
+    def test_invalid_signature(self, parser, sample_webhook_data):
+        """測試簽章錯誤時拋出例外"""
+        body = json.dumps(sample_webhook_data).encode("utf-8")
+
+        with pytest.raises(InvalidSignatureError):
+            parser.parse(body, "invalid")
+
+    def test_source_and_delivery_fields(self, parser):
+        """測試來源與重送資訊"""
+        body = json.dumps({
+            "events": [{
+                "type": "message",
+                "webhookEventId": "01H",
+                "deliveryContext": {"isRedelivery": True},
+                "source": {"type": "group", "groupId": "G1", "userId": "U1"},
+                "message": {"type": "sticker", "id": "1"},
+            }]
+        })
+        event = parser.parse(body, parser.signature_for(body))[0]
+
+        assert event.source_id == "G1"
+        assert event.user_id == "U1"
+        assert event.webhook_event_id == "01H"
+        assert event.is_redelivery
+        assert not is_text(event)
+
+    def test_import_file_event(self, parser):
+        """測試 CSV 檔案訊息可匯入，其他檔案略過"""
+        body = json.dumps({
+            "events": [
+                {"type": "message", "message": {"type": "file", "id": "f1", "fileName": "2025-01.CSV"}},
+                {"type": "message", "message": {"type": "file", "id": "f2", "fileName": "photo.pdf"}},
+            ]
+        })
+        csv_event, pdf_event = parser.parse(body, parser.signature_for(body))
+
+        assert csv_event.file_name == "2025-01.CSV"
+        assert is_import_file(csv_event)
+        assert not is_import_file(pdf_event)